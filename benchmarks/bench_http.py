@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+
+from obsync.db.vault_schema import new_user, new_vault  # noqa: E402
+from obsync.utils.config import secret  # noqa: E402
+
+EMAIL = "bench@example.com"
+PASSWORD = "password"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--vaults", type=int, default=10)
+    return parser.parse_args()
+
+
+def create_user(vaults: int) -> str:
+    new_user(name="bench", email=EMAIL, password=PASSWORD)
+    for i in range(vaults):
+        new_vault(
+            name=f"bench-{i}",
+            user_email=EMAIL,
+            password=PASSWORD,
+            salt="salt",
+            keyhash="keyhash",
+        )
+    return jwt.encode({"email": EMAIL}, secret, algorithm="HS256")
+
+
+async def throughput(
+    client: httpx.AsyncClient,
+    path: str,
+    body: dict,
+    requests: int,
+    concurrency: int,
+) -> float:
+    remaining = requests
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            response = await client.post(path, json=body)
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return requests / (time.perf_counter() - start)
+
+
+async def main(args: argparse.Namespace) -> None:
+    from start_server import app
+
+    token = create_user(args.vaults)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for path, body, requests in (
+            ("/vault/list", {"token": token}, args.requests),
+            # Password hashing dominates sign in, fewer requests will do
+            (
+                "/user/signin",
+                {"email": EMAIL, "password": PASSWORD},
+                args.requests // 20,
+            ),
+        ):
+            rate = await throughput(
+                client, path, body, requests, args.concurrency
+            )
+            print(f"{path:>14}: {rate:>8.0f} requests/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
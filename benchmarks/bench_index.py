@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+from obsync.db.aio import (  # noqa: E402
+    get_manifest_page,
+    get_vault_seq,
+    get_vault_size,
+    load_vault_index,
+)
+from obsync.db.vault_files_schema import advance_vault_seq  # noqa: E402
+from obsync.db.vault_index import vault_index  # noqa: E402
+from obsync.utils.config import MANIFEST_BATCH_SIZE, VAULT_DB  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type=int, default=10000)
+    parser.add_argument("-r", "--repeat", type=int, default=20)
+    return parser.parse_args()
+
+
+def create_vault(files: int) -> str:
+    vault_id = str(uuid.uuid4())
+    advance_vault_seq(vault_id, 1)
+    con = sqlite3.connect(VAULT_DB)
+    con.executemany(
+        "INSERT INTO vault_file (vault_id, hash, path, extension, size,"
+        " created, modified, folder, deleted, newest, is_snapshot, seq)"
+        " VALUES (?, ?, ?, 'md', 1024, 1700000000000, 1700000000000, 0, 0,"
+        " 1, 1, ?)",
+        (
+            (vault_id, f"{i:064x}", f"notes/note {i}.md", i + 2)
+            for i in range(files)
+        ),
+    )
+    con.commit()
+    con.close()
+    return vault_id
+
+
+async def reconnect(vault_id: str) -> int:
+    # What a reconnecting client reads before it is ready
+    await get_vault_seq(vault_id)
+    await get_vault_size(vault_id)
+    rows, after = 0, 0
+    while True:
+        page = await get_manifest_page(
+            vault_id, None, after, MANIFEST_BATCH_SIZE
+        )
+        # None only for change listings older than the compaction mark
+        assert page is not None
+        rows += len(page)
+        if len(page) < MANIFEST_BATCH_SIZE:
+            return rows
+        after = page[-1][0]
+
+
+async def measure(name: str, vault_id: str, files: int, repeat: int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        assert await reconnect(vault_id) == files
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>7}: {elapsed * 1000:8.2f} ms per reconnect")
+
+
+async def main(args: argparse.Namespace) -> None:
+    vault_id = create_vault(args.files)
+    await measure("sqlite", vault_id, args.files, args.repeat)
+    start = time.perf_counter()
+    await load_vault_index(vault_id)
+    print(f"   load: {(time.perf_counter() - start) * 1000:8.2f} ms")
+    await measure("index", vault_id, args.files, args.repeat)
+    print(vault_index.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
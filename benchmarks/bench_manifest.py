@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+import jwt  # noqa: E402
+import uvicorn  # noqa: E402
+from websockets.sync.client import connect  # noqa: E402
+
+from obsync.db.vault_files_schema import advance_vault_seq  # noqa: E402
+from obsync.db.vault_schema import new_user, new_vault  # noqa: E402
+from obsync.utils.config import VAULT_DB, secret  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--files", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-p", "--port", type=int, default=3999)
+    parser.add_argument("--no-deflate", action="store_true")
+    return parser.parse_args()
+
+
+def create_vault(files: int) -> dict:
+    email = "bench@example.com"
+    new_user(name="bench", email=email, password="password")
+    vault = new_vault(
+        name=f"bench-{files}-{time.time()}",
+        user_email=email,
+        password="password",
+        salt="salt",
+        keyhash="keyhash",
+    )
+    advance_vault_seq(vault.id, 1)
+    con = sqlite3.connect(VAULT_DB)
+    con.executemany(
+        "INSERT INTO vault_file (vault_id, hash, path, extension, size,"
+        " created, modified, folder, deleted, newest, is_snapshot)"
+        " VALUES (?, ?, ?, 'md', 1024, 1700000000000, 1700000000000, 0, 0,"
+        " 1, 1)",
+        (
+            (vault.id, f"{i:064x}", f"notes/folder {i % 100}/note {i}.md")
+            for i in range(files)
+        ),
+    )
+    con.commit()
+    con.close()
+    token = jwt.encode({"email": email}, secret, algorithm="HS256")
+    return dict(id=vault.id, keyhash=vault.keyhash, token=token)
+
+
+def time_to_ready(port: int, vault: dict, deflate: bool) -> tuple:
+    with connect(
+        f"ws://127.0.0.1:{port}/",
+        compression="deflate" if deflate else None,
+        max_size=None,
+    ) as ws:
+        start = time.perf_counter()
+        ws.send(
+            json.dumps(
+                {
+                    "op": "init",
+                    "token": vault["token"],
+                    "id": vault["id"],
+                    "keyhash": vault["keyhash"],
+                    "version": 0,
+                    "initial": True,
+                    "device": "bench",
+                }
+            )
+        )
+        frames = 0
+        while True:
+            message = json.loads(ws.recv())
+            if message.get("op") == "ready":
+                return time.perf_counter() - start, frames
+            if message.get("op") == "push":
+                frames += 1
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    from start_server import app
+
+    config = uvicorn.Config(
+        app,
+        host="127.0.0.1",
+        port=args.port,
+        ws_per_message_deflate=not args.no_deflate,
+        log_level="warning",
+    )
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    for files in args.files:
+        vault = create_vault(files)
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, frames = time_to_ready(
+                args.port, vault, deflate=not args.no_deflate
+            )
+            assert frames == files
+            timings.append(elapsed)
+        print(
+            f"{files:>7} files: time to ready"
+            f" best {min(timings) * 1000:.1f} ms,"
+            f" mean {sum(timings) / len(timings) * 1000:.1f} ms"
+        )
+
+    server.should_exit = True
+    thread.join()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+from pony.orm import db_session, select  # noqa: E402
+
+from obsync.db.vault_files import VaultFile  # noqa: E402
+from obsync.db.vault_files_schema import (  # noqa: E402
+    VaultFileModel,
+    get_vault_files,
+)
+from obsync.utils.config import VAULT_DB  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--files", type=int, default=10000)
+    parser.add_argument("-s", "--size-kb", type=int, default=16)
+    return parser.parse_args()
+
+
+def create_vault(files: int, size: int) -> str:
+    # Legacy rows with their content inline, the worst case for listings
+    vault_id = str(uuid.uuid4())
+    data = os.urandom(size)
+    con = sqlite3.connect(VAULT_DB)
+    con.executemany(
+        "INSERT INTO vault_file (vault_id, hash, path, extension, size,"
+        " created, modified, folder, deleted, newest, is_snapshot, data)"
+        " VALUES (?, ?, ?, 'md', ?, 1700000000000, 1700000000000, 0, 0,"
+        " 1, 1, ?)",
+        (
+            (vault_id, f"{i:064x}", f"notes/note {i}.md", size, data)
+            for i in range(files)
+        ),
+    )
+    con.commit()
+    con.close()
+    return vault_id
+
+
+@db_session
+def entity_listing(vault_id: str) -> list:
+    # What listings did before, whole entities validated into models
+    files = select(
+        f
+        for f in VaultFile
+        if f.vault_id == vault_id and f.deleted is False and f.newest is True
+    )
+    return [VaultFileModel.model_validate(f) for f in files]
+
+
+def measure(name: str, func, vault_id: str) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(vault_id)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>8}: {len(result)} files in {elapsed * 1000:.1f} ms,"
+        f" peak {peak / 1024 / 1024:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    vault_id = create_vault(args.files, args.size_kb * 1024)
+    measure("entities", entity_listing, vault_id)
+    measure("records", get_vault_files, vault_id)
@@ -0,0 +1,79 @@
+import argparse
+import json
+import time
+
+from pydantic import create_model
+
+from obsync.handler import protocol
+
+PUSH = json.dumps(
+    {
+        "op": "push",
+        "path": "notes/folder 1/note 1.md",
+        "extension": "md",
+        "hash": "0" * 64,
+        "ctime": 1700000000000,
+        "mtime": 1700000000000,
+        "folder": False,
+        "deleted": False,
+        "size": 1024,
+        "pieces": 1,
+        "device": "bench",
+    }
+)
+OK = {"op": "ok"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--messages", type=int, default=100000)
+    return parser.parse_args()
+
+
+def per_message_model(frame: str) -> str:
+    # What the push path did before, a fresh model class per message
+    metadata = json.loads(frame)
+    model = create_model(
+        "VaultMetaFileModel",
+        vault_id=(str, ...),
+        path=(str, ...),
+        hash=(str, ...),
+        extension=(str, ...),
+        size=(int, ...),
+        created=(int, ...),
+        modified=(int, ...),
+        folder=(bool, ...),
+        deleted=(bool, ...),
+    )
+    model(
+        vault_id="vault",
+        path=metadata["path"],
+        hash=metadata["hash"],
+        extension=metadata["extension"],
+        size=metadata.get("size", 0),
+        created=metadata["ctime"],
+        modified=metadata["mtime"],
+        folder=metadata["folder"],
+        deleted=metadata["deleted"],
+    )
+    return json.dumps(OK)
+
+
+def precompiled(frame: str) -> str:
+    protocol.decode(frame)
+    return protocol.OK
+
+
+def measure(name: str, func, messages: int) -> None:
+    start = time.perf_counter()
+    for _ in range(messages):
+        func(PUSH)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>12}: {messages / elapsed:>10.0f} messages/s")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # create_model is slow enough that a tenth of the messages will do
+    measure("create_model", per_message_model, args.messages // 10)
+    measure("protocol", precompiled, args.messages)
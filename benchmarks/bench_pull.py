@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from typing import Awaitable, Callable, List
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+from obsync.db.aio import (  # noqa: E402
+    get_data_size,
+    get_file,
+    iter_file_data,
+    read_file,
+)
+from obsync.db.blob_cache import blob_cache  # noqa: E402
+from obsync.db.vault_files_schema import (  # noqa: E402
+    VaultMetaFileModel,
+    insert_data,
+    insert_metadata,
+)
+from obsync.utils.config import PULL_PIECE_SIZE  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--pushes", type=int, default=200)
+    parser.add_argument("-d", "--devices", type=int, default=10)
+    parser.add_argument("-s", "--size-kb", type=int, default=64)
+    return parser.parse_args()
+
+
+def push(vault_id: str, i: int, data: bytes) -> int:
+    uid = insert_metadata(
+        VaultMetaFileModel(
+            vault_id=vault_id,
+            path=f"notes/{i}.md",
+            hash=f"{i:064x}",
+            extension="md",
+            size=len(data),
+            created=1700000000000,
+            modified=1700000000000,
+            folder=False,
+            deleted=False,
+        )
+    )
+    insert_data(vault_id, uid, data)
+    return uid
+
+
+async def stream(vault_id: str, uid: int) -> int:
+    # The pull path without the cache
+    file = await get_file(vault_id, uid)
+    await get_data_size(vault_id, file)
+    received = 0
+    async for piece in iter_file_data(vault_id, file, PULL_PIECE_SIZE):
+        received += len(piece)
+    return received
+
+
+async def cached(vault_id: str, uid: int) -> int:
+    file = blob_cache.get(vault_id, uid)
+    if file is None:
+        read = await read_file(vault_id, uid)
+        assert read is not None
+        _, file = read
+    # Pushes are sized to fit the blob cache
+    assert file is not None
+    return len(file.data)
+
+
+async def storm(
+    name: str,
+    pull: Callable[[str, int], Awaitable[int]],
+    vault_id: str,
+    uids: List[int],
+    devices: int,
+) -> None:
+    # Every device pulls every push as soon as it is broadcast
+    start = time.perf_counter()
+    for uid in uids:
+        await asyncio.gather(*[pull(vault_id, uid) for _ in range(devices)])
+    rate = len(uids) * devices / (time.perf_counter() - start)
+    print(f"{name:>8}: {rate:>8.0f} pulls/s")
+
+
+async def main(args: argparse.Namespace) -> None:
+    vault_id = str(uuid.uuid4())
+    data = os.urandom(args.size_kb * 1024)
+    uids = [push(vault_id, i, data) for i in range(args.pushes)]
+    await storm("streamed", stream, vault_id, uids, args.devices)
+    await storm("cached", cached, vault_id, uids, args.devices)
+    print(f"{'cache':>8}: {blob_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+from obsync.db.coalescer import WriteCoalescer  # noqa: E402
+from obsync.db.executor import db_executor  # noqa: E402
+from obsync.db.vault_files_schema import (  # noqa: E402
+    VaultMetaFileModel,
+    insert_metadata,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--pushes", type=int, default=2000)
+    parser.add_argument("-c", "--clients", type=int, default=50)
+    return parser.parse_args()
+
+
+def metadata(vault_id: str, i: int) -> VaultMetaFileModel:
+    return VaultMetaFileModel(
+        vault_id=vault_id,
+        path=f"attachments/{i}.png",
+        hash=f"{i:064x}",
+        extension="png",
+        size=1024,
+        created=1700000000000,
+        modified=1700000000000,
+        folder=False,
+        deleted=False,
+    )
+
+
+async def throughput(name: str, write, pushes: int, clients: int) -> None:
+    vault_id = str(uuid.uuid4())
+    remaining = pushes
+
+    async def client() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await write(
+                insert_metadata, vault_file=metadata(vault_id, remaining)
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    rate = pushes / (time.perf_counter() - start)
+    print(f"{name:>12}: {rate:>8.0f} pushes/s")
+
+
+async def main(args: argparse.Namespace) -> None:
+    coalescer = WriteCoalescer(max_delay=0.002, max_ops=64)
+    await throughput("per push", db_executor.write, args.pushes, args.clients)
+    await throughput("coalesced", coalescer.submit, args.pushes, args.clients)
+    print(f"{'batches':>12}: {coalescer.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
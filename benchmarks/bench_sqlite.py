@@ -0,0 +1,107 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+os.environ.setdefault("DB_PATH", tempfile.mkdtemp(prefix="obsync-bench-"))
+
+from obsync.db.database import PRAGMAS  # noqa: E402
+
+# What every connection got before, SQLite's own defaults
+DEFAULTS: Dict[str, Any] = dict(journal_mode="delete", synchronous="full")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--seconds", type=float, default=5)
+    parser.add_argument("-r", "--readers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=10000)
+    return parser.parse_args()
+
+
+def connect(filename: str, pragmas: Dict[str, Any]) -> sqlite3.Connection:
+    con = sqlite3.connect(
+        filename, isolation_level=None, check_same_thread=False
+    )
+    for name, value in pragmas.items():
+        con.execute(f"PRAGMA {name} = {value}")
+    return con
+
+
+def create_db(filename: str, pragmas: Dict[str, Any], rows: int) -> None:
+    con = connect(filename, pragmas)
+    con.execute(
+        "CREATE TABLE vault_file (uid INTEGER PRIMARY KEY, vault_id TEXT,"
+        " path TEXT, hash TEXT, modified INTEGER)"
+    )
+    con.execute("CREATE INDEX idx_vault_path ON vault_file (vault_id, path)")
+    con.execute("BEGIN")
+    con.executemany(
+        "INSERT INTO vault_file (vault_id, path, hash, modified)"
+        " VALUES ('vault', ?, ?, 0)",
+        ((f"notes/{i}.md", f"{i:064x}") for i in range(rows)),
+    )
+    con.execute("COMMIT")
+    con.close()
+
+
+def run(name: str, pragmas: Dict[str, Any], args: argparse.Namespace) -> None:
+    filename = os.path.join(tempfile.mkdtemp(prefix="obsync-bench-"), "v.db")
+    create_db(filename, pragmas, args.rows)
+    stop = time.perf_counter() + args.seconds
+    counts = dict(reads=0, writes=0, busy=0)
+    lock = threading.Lock()
+
+    def reader(n: int) -> None:
+        con = connect(filename, pragmas)
+        reads = busy = 0
+        while time.perf_counter() < stop:
+            try:
+                con.execute(
+                    "SELECT uid, hash FROM vault_file"
+                    " WHERE vault_id = 'vault' AND path = ?",
+                    (f"notes/{(reads * 7919 + n) % args.rows}.md",),
+                ).fetchall()
+                reads += 1
+            except sqlite3.OperationalError:
+                busy += 1
+        with lock:
+            counts["reads"] += reads
+            counts["busy"] += busy
+
+    def writer() -> None:
+        con = connect(filename, pragmas)
+        writes = 0
+        while time.perf_counter() < stop:
+            # One push, one transaction
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(
+                "INSERT INTO vault_file (vault_id, path, hash, modified)"
+                " VALUES ('vault', ?, 'hash', ?)",
+                (f"new/{writes}.md", writes),
+            )
+            con.execute("COMMIT")
+            writes += 1
+        counts["writes"] = writes
+
+    threads = [threading.Thread(target=writer)] + [
+        threading.Thread(target=reader, args=(n,)) for n in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(
+        f"{name:>8}: {counts['writes'] / args.seconds:>8.0f} writes/s"
+        f" {counts['reads'] / args.seconds:>10.0f} reads/s"
+        f" {counts['busy']:>6} busy errors"
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run("default", DEFAULTS, args)
+    run("tuned", PRAGMAS, args)
@@ -0,0 +1,28 @@
+import argparse
+
+from pony.orm import db_session
+
+from obsync.db.database import db
+from obsync.db.vault_files_schema import move_data_to_blob_store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--batch-size", type=int, default=100)
+    parser.add_argument("--vacuum", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    total = 0
+    while True:
+        moved = move_data_to_blob_store(limit=args.batch_size)
+        if moved == 0:
+            break
+        total += moved
+        print(f"Moved {total} files to the blob store.")
+    if args.vacuum:
+        with db_session(ddl=True):
+            db.execute("VACUUM")
+    print("Done.")
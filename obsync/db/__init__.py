@@ -0,0 +1,5 @@
+from obsync.db import vault, vault_files  # noqa: F401
+from obsync.db.database import setup_database
+
+# Both entity modules share one database, mapped once they are defined
+setup_database()
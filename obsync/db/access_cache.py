@@ -0,0 +1,57 @@
+from typing import Awaitable, Callable, List
+
+from obsync.db.blob_cache import blob_cache
+from obsync.db.vault_index import VaultDelta, vault_index
+from obsync.utils.cache import TTLCache
+from obsync.utils.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+Listener = Callable[[str], Awaitable[None]]
+DeltaListener = Callable[[str, VaultDelta], Awaitable[None]]
+
+# (vault_id, keyhash) -> Optional[VaultModel]
+vault_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+# (vault_id, email) -> bool
+access_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+listeners: List[Listener] = []
+delta_listeners: List[DeltaListener] = []
+
+
+def invalidate_vault(vault_id: str) -> None:
+    vault_cache.invalidate(lambda key: key[0] == vault_id)
+    access_cache.invalidate(lambda key: key[0] == vault_id)
+    vault_index.drop(vault_id)
+    blob_cache.invalidate(vault_id)
+
+
+def on_vault_changed(listener: Listener) -> None:
+    # Listeners forward invalidations to the other workers
+    listeners.append(listener)
+
+
+async def vault_changed(vault_id: str) -> None:
+    # Called after every write that changes what the caches hold for a vault
+    invalidate_vault(vault_id)
+    for listener in listeners:
+        await listener(vault_id)
+
+
+def apply_vault_delta(vault_id: str, delta: VaultDelta) -> None:
+    vault_index.apply(vault_id, delta)
+    for uid, _ in delta.removed:
+        blob_cache.discard(vault_id, uid)
+
+
+def on_vault_maintained(listener: DeltaListener) -> None:
+    # Listeners forward deltas to the other workers
+    delta_listeners.append(listener)
+
+
+async def vault_maintained(vault_id: str, delta: VaultDelta) -> None:
+    # Called after maintenance deleted versions of a vault or corrected its
+    # size. Vaults and shares are untouched, their caches stay.
+    if delta.is_empty():
+        return
+    apply_vault_delta(vault_id, delta)
+    for listener in delta_listeners:
+        await listener(vault_id, delta)
@@ -0,0 +1,384 @@
+import asyncio
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from obsync.db import vault_files_schema, vault_schema
+from obsync.db.access_cache import (
+    access_cache,
+    vault_cache,
+    vault_changed,
+    vault_maintained,
+)
+from obsync.db.blob_cache import CachedFile, blob_cache
+from obsync.db.coalescer import batched
+from obsync.db.executor import db_executor, reader, writer
+from obsync.db.retention import RetentionPolicy
+from obsync.db.vault_files_schema import FileRecord, manifest_row
+from obsync.db.vault_index import ManifestRow, VaultIndex, vault_index
+from obsync.db.vault_schema import ShareModel, UserModel, VaultModel
+from obsync.utils.cache import MISSING
+from obsync.utils.kdf import check_password, hash_password, kdf_pool
+from obsync.utils.scrypt import make_key_hash
+
+# vault_file
+get_changes = reader(vault_files_schema.get_changes)
+get_retention_policy = reader(vault_files_schema.get_retention_policy)
+set_retention_policy = writer(vault_files_schema.set_retention_policy)
+get_vault_stats = reader(vault_files_schema.get_vault_stats)
+get_vault_ids = reader(vault_files_schema.get_vault_ids)
+get_vault_files = reader(vault_files_schema.get_vault_files)
+get_file = reader(vault_files_schema.get_file)
+get_data_size = reader(vault_files_schema.get_data_size)
+get_file_history = reader(vault_files_schema.get_file_history)
+get_deleted_files = reader(vault_files_schema.get_deleted_files)
+find_duplicate_blob = reader(vault_files_schema.find_duplicate_blob)
+insert_data = writer(vault_files_schema.insert_data)
+insert_blob = writer(vault_files_schema.insert_blob)
+
+# Manifests, sequence numbers and sizes of hot vaults are served from their
+# index, writes and maintenance update it once committed.
+
+
+async def load_vault_index(vault_id: str) -> Optional[VaultIndex]:
+    return await vault_index.load(vault_id, _read_vault_index)
+
+
+async def get_vault_seq(vault_id: str) -> Optional[int]:
+    index = vault_index.get(vault_id)
+    if index is not None:
+        return index.seq
+    return await db_executor.read(
+        vault_files_schema.get_vault_seq, vault_id=vault_id
+    )
+
+
+async def get_manifest_page(
+    vault_id: str, since: Optional[int], after: int, limit: int
+) -> Optional[List[ManifestRow]]:
+    index = vault_index.get(vault_id)
+    if index is not None:
+        return index.manifest_page(since, after, limit)
+    return await db_executor.read(
+        vault_files_schema.get_manifest_page,
+        vault_id=vault_id,
+        since=since,
+        after=after,
+        limit=limit,
+    )
+
+
+async def get_vault_size(vault_id: str) -> int:
+    index = vault_index.get(vault_id)
+    if index is not None:
+        return index.total_bytes
+    return await db_executor.read(
+        vault_files_schema.get_vault_size, vault_id=vault_id
+    )
+
+
+async def advance_vault_seq(vault_id: str, version: int) -> int:
+    seq = await _advance_vault_seq(vault_id, version)
+    vault_index.advance(vault_id, seq)
+    return seq
+
+
+async def insert_metadata(
+    vault_file: Any, blob: Optional[Tuple[str, int]] = None
+) -> int:
+    row = await _insert_file(vault_file=vault_file, blob=blob)
+    vault_index.put(vault_file.vault_id, row, added=row[3] or 0)
+    return row[0]
+
+
+async def insert_duplicate(vault_file: Any) -> Optional[int]:
+    row = await _insert_duplicate(vault_file=vault_file)
+    if row is None:
+        return None
+    vault_index.put(vault_file.vault_id, row, added=row[3] or 0)
+    return row[0]
+
+
+async def overwrite_file(
+    vault_id: str,
+    uid: int,
+    vault_file: Any,
+    blob: Optional[Tuple[str, int]] = None,
+) -> bool:
+    overwritten = await _overwrite_file(vault_id, uid, vault_file, blob)
+    if overwritten is None:
+        return False
+    row, added = overwritten
+    vault_index.put(vault_id, row, added=added)
+    # Pulls from now on read the new content
+    blob_cache.discard(vault_id, uid)
+    reading.pop((vault_id, uid), None)
+    return True
+
+
+async def delete_vault_file(vault_id: str, path: str) -> None:
+    tombstone = await _delete_vault_file(vault_id, path)
+    if tombstone is not None:
+        vault_index.put(vault_id, tombstone)
+
+
+async def restore_file(vault_id: str, uid: int) -> Optional[FileRecord]:
+    record = await _restore_file(vault_id, uid=uid)
+    if record is not None:
+        vault_index.put(vault_id, manifest_row(record))
+    return record
+
+
+async def snapshot(
+    vault_id: str, limit: Optional[int] = None
+) -> Tuple[int, bool]:
+    rewritten, done, delta = await _snapshot(vault_id, limit)
+    await vault_maintained(vault_id, delta)
+    return rewritten, done
+
+
+async def prune_versions(
+    vault_id: str, policy: RetentionPolicy, after: str, limit: int, now: int
+) -> Tuple[int, Optional[str]]:
+    removed, last, delta = await _prune_versions(
+        vault_id, policy, after, limit, now
+    )
+    await vault_maintained(vault_id, delta)
+    return removed, last
+
+
+async def prune_tombstones(
+    vault_id: str, deleted_before: int, limit: int
+) -> Tuple[int, bool]:
+    removed, done, delta = await _prune_tombstones(
+        vault_id, deleted_before, limit
+    )
+    await vault_maintained(vault_id, delta)
+    return removed, done
+
+
+async def reconcile_vault_stats(vault_id: str) -> bool:
+    # Returns whether the materialized stats had drifted
+    delta = await _reconcile_vault_stats(vault_id)
+    if delta is None:
+        return False
+    await vault_maintained(vault_id, delta)
+    return True
+
+
+_read_vault_index = reader(vault_files_schema.read_vault_index)
+_advance_vault_seq = writer(vault_files_schema.advance_vault_seq)
+_insert_file = batched(
+    vault_files_schema.insert_file,
+    key=lambda vault_file, blob=None: vault_file.vault_id,
+)
+_insert_duplicate = batched(
+    vault_files_schema.insert_duplicate,
+    key=lambda vault_file: vault_file.vault_id,
+)
+_overwrite_file = writer(vault_files_schema.overwrite_file)
+_delete_vault_file = batched(vault_files_schema.delete_vault_file)
+_restore_file = writer(vault_files_schema.restore_file)
+_snapshot = writer(vault_files_schema.snapshot)
+_prune_versions = writer(vault_files_schema.prune_versions)
+_prune_tombstones = writer(vault_files_schema.prune_tombstones)
+_reconcile_vault_stats = writer(vault_files_schema.reconcile_vault_stats)
+
+# vault, share and user
+get_vault_shares = reader(vault_schema.get_vault_shares)
+get_shared_vaults = reader(vault_schema.get_shared_vaults)
+get_user_info = reader(vault_schema.get_user_info)
+is_vault_owner = reader(vault_schema.is_vault_owner)
+create_user = writer(vault_schema.create_user)
+find_user = reader(vault_schema.find_user)
+user_info = reader(vault_schema.user_info)
+get_password_hash = reader(vault_schema.get_password_hash)
+create_vault = writer(vault_schema.create_vault)
+find_vault = reader(vault_schema.find_vault)
+get_vaults = reader(vault_schema.get_vaults)
+
+
+# Password hashing and key derivation run on the KDF pool, only the
+# database part goes through the database executor. Existing users and
+# vaults are returned as they are, without spending a KDF run on them
+
+
+async def new_user(name: str, email: str, password: str) -> UserModel:
+    user = await find_user(email)
+    if user is not None:
+        return user
+    password_hash = await kdf_pool.run(hash_password, password)
+    return await create_user(
+        name=name, email=email, password_hash=password_hash
+    )
+
+
+async def login(email: str, password: str) -> Optional[UserModel]:
+    hashed = await get_password_hash(email)
+    if hashed is None:
+        return None
+    if not await kdf_pool.run(check_password, password, hashed):
+        return None
+    return await user_info(email)
+
+
+async def new_vault(
+    name: str, user_email: str, password: str, salt: str, keyhash: str
+) -> VaultModel:
+    vault = await find_vault(name, user_email)
+    if vault is not None:
+        return vault
+    if keyhash == "":
+        keyhash = await kdf_pool.run(make_key_hash, password, salt)
+    return await create_vault(
+        name=name,
+        user_email=user_email,
+        password=password,
+        salt=salt,
+        keyhash=keyhash,
+    )
+
+
+# Vault lookups and access checks run on every connection and most requests,
+# results are cached until a write to the vault invalidates them
+
+
+async def get_vault(id: str, keyhash: str) -> Optional[VaultModel]:
+    vault = vault_cache.get((id, keyhash))
+    if vault is MISSING:
+        generation = vault_cache.generation
+        vault = await db_executor.read(
+            vault_schema.get_vault, id=id, keyhash=keyhash
+        )
+        vault_cache.set((id, keyhash), vault, generation)
+    return vault
+
+
+async def has_access_to_vault(vault_id: str, email: str) -> bool:
+    access = access_cache.get((vault_id, email))
+    if access is MISSING:
+        generation = access_cache.generation
+        access = await db_executor.read(
+            vault_schema.has_access_to_vault, vault_id=vault_id, email=email
+        )
+        access_cache.set((vault_id, email), access, generation)
+    return access
+
+
+async def set_vault_version(id: str, version: int) -> None:
+    await db_executor.write(
+        vault_schema.set_vault_version, id=id, version=version
+    )
+    await vault_changed(id)
+
+
+async def delete_vault(id: str, email: str) -> int:
+    deleted = await db_executor.write(
+        vault_schema.delete_vault, id=id, email=email
+    )
+    await vault_changed(id)
+    return deleted
+
+
+async def share_vault_invite(
+    email: str, name: str, vault_id: str
+) -> ShareModel:
+    share = await db_executor.write(
+        vault_schema.share_vault_invite,
+        email=email,
+        name=name,
+        vault_id=vault_id,
+    )
+    await vault_changed(vault_id)
+    return share
+
+
+async def share_vault_revoke(share_id: str, vault_id: str, email: str) -> int:
+    revoked = await db_executor.write(
+        vault_schema.share_vault_revoke,
+        share_id=share_id,
+        vault_id=vault_id,
+        email=email,
+    )
+    await vault_changed(vault_id)
+    return revoked
+
+
+# (vault id, uid) -> read in flight
+reading: Dict[Tuple[str, int], asyncio.Future] = {}
+
+
+async def read_file(
+    vault_id: str, uid: int
+) -> Optional[Tuple[FileRecord, Optional[CachedFile]]]:
+    # Files small enough for the blob cache are read whole and cached,
+    # larger ones come without content and are streamed. Concurrent pulls
+    # of a file share one read.
+    key = (vault_id, uid)
+    if key not in reading:
+        future = asyncio.ensure_future(_read_file(vault_id, uid))
+        reading[key] = future
+        future.add_done_callback(lambda _: forget_read(key, future))
+    return await asyncio.shield(reading[key])
+
+
+def forget_read(key: Tuple[str, int], future: asyncio.Future) -> None:
+    # A read superseded by an overwrite may finish after the next one began
+    if reading.get(key) is future:
+        del reading[key]
+
+
+async def _read_file(
+    vault_id: str, uid: int
+) -> Optional[Tuple[FileRecord, Optional[CachedFile]]]:
+    generation = blob_cache.generation
+    read = await db_executor.read(
+        vault_files_schema.read_file,
+        vault_id=vault_id,
+        uid=uid,
+        max_size=blob_cache.max_file,
+    )
+    if read is None:
+        return None
+    file, data = read
+    if data is None:
+        return file, None
+    cached = CachedFile(file.hash, file.size, data)
+    blob_cache.put(vault_id, uid, cached, generation)
+    return file, cached
+
+
+async def prewarm_files(vault_id: str, uids: List[int]) -> int:
+    # Reads files into the blob cache before they are pulled, at most as
+    # many bytes as the cache holds. Returns the bytes read.
+    loaded = 0
+    for uid in uids:
+        if loaded >= blob_cache.max_bytes:
+            break
+        if blob_cache.contains(vault_id, uid):
+            continue
+        read = await read_file(vault_id, uid)
+        if read is not None and read[1] is not None:
+            loaded += len(read[1].data)
+    return loaded
+
+
+async def iter_file_data(
+    vault_id: str, file: FileRecord, piece_size: int
+) -> AsyncIterator[bytes]:
+    pieces = vault_files_schema.iter_file_data(vault_id, file, piece_size)
+    while True:
+        piece = await db_executor.read(_next_piece, pieces)
+        if piece is None:
+            return
+        yield piece
+
+
+def _next_piece(pieces: Iterator[bytes]) -> Optional[bytes]:
+    return next(pieces, None)
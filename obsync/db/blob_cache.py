@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from obsync.utils.config import BLOB_CACHE_MAX_FILE, BLOB_CACHE_MEMORY
+
+
+class CachedFile(NamedTuple):
+    # What a pull sends, the header fields and the content
+    hash: Optional[str]
+    size: Optional[int]
+    data: bytes
+
+
+class BlobCache(object):
+    # Contents of recently pushed and pulled files by (vault id, uid), the
+    # devices of a vault pull a push right after its broadcast. Files larger
+    # than `max_file` are streamed and never cached, a non-positive
+    # `max_bytes` disables the cache.
+    def __init__(self, max_bytes: int, max_file: int) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_file = max(min(max_file, max_bytes), 0)
+        self.files: "OrderedDict[Tuple[str, int], CachedFile]" = OrderedDict()
+        self.nbytes = 0
+        # Bumped whenever cached content may have changed, see put()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def cacheable(self, size: int) -> bool:
+        return self.max_bytes > 0 and size <= self.max_file
+
+    def get(self, vault_id: str, uid: int) -> Optional[CachedFile]:
+        file = self.files.get((vault_id, uid))
+        if file is None:
+            self.misses += 1
+            return None
+        self.files.move_to_end((vault_id, uid))
+        self.hits += 1
+        return file
+
+    def contains(self, vault_id: str, uid: int) -> bool:
+        return (vault_id, uid) in self.files
+
+    def put(
+        self,
+        vault_id: str,
+        uid: int,
+        file: CachedFile,
+        generation: Optional[int] = None,
+    ) -> None:
+        # Pass the generation read before reading the content, content read
+        # while a file was overwritten is not cached
+        if not self.cacheable(len(file.data)):
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self.discard(vault_id, uid)
+        self.files[(vault_id, uid)] = file
+        self.nbytes += len(file.data)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.files.popitem(last=False)
+            self.nbytes -= len(evicted.data)
+            self.evicted += 1
+
+    def discard(self, vault_id: str, uid: int) -> None:
+        self.generation += 1
+        previous = self.files.pop((vault_id, uid), None)
+        if previous is not None:
+            self.nbytes -= len(previous.data)
+
+    def invalidate(self, vault_id: str) -> None:
+        self.generation += 1
+        for key in [key for key in self.files if key[0] == vault_id]:
+            self.nbytes -= len(self.files.pop(key).data)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            files=len(self.files),
+            bytes=self.nbytes,
+            hits=self.hits,
+            misses=self.misses,
+            evicted=self.evicted,
+        )
+
+
+blob_cache = BlobCache(
+    max_bytes=BLOB_CACHE_MEMORY, max_file=BLOB_CACHE_MAX_FILE
+)
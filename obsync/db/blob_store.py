@@ -0,0 +1,214 @@
+import hashlib
+import io
+import os
+import tempfile
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+from obsync.utils.config import BLOB_PATH, BLOB_STORE
+
+
+class BlobTooLargeError(ValueError):
+    pass
+
+
+class BlobMissingError(LookupError):
+    pass
+
+
+class BlobWriter(object):
+    def __init__(
+        self, store: "BlobStore", max_memory: int, max_size: int
+    ) -> None:
+        super().__init__()
+        self.store = store
+        self.max_memory = max_memory
+        self.max_size = max_size
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.buffer: Optional[bytearray] = bytearray()
+        self.spill: Optional[BinaryIO] = None
+        self.spill_path: Optional[str] = None
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise BlobTooLargeError(
+                "File exceeds the limit of {} bytes".format(self.max_size)
+            )
+        self.hasher.update(data)
+        if self.spill is not None:
+            self.spill.write(data)
+            return
+        buffer = self.buffer
+        assert buffer is not None, "BlobWriter is closed"
+        if self.size > self.max_memory:
+            fd, self.spill_path = tempfile.mkstemp(dir=self.store.spill_dir())
+            self.spill = os.fdopen(fd, "wb")
+            self.spill.write(buffer)
+            self.spill.write(data)
+            self.buffer = None
+        else:
+            buffer.extend(data)
+
+    def contents(self) -> Optional[bytes]:
+        # None once spilled to disk or committed
+        return None if self.buffer is None else bytes(self.buffer)
+
+    def commit(self) -> Tuple[str, int]:
+        digest = self.hasher.hexdigest()
+        if self.spill is None:
+            assert self.buffer is not None, "BlobWriter is closed"
+            self.store.put_buffer(digest, self.buffer)
+        else:
+            assert self.spill_path is not None
+            self.spill.flush()
+            os.fsync(self.spill.fileno())
+            self.spill.close()
+            self.spill = None
+            self.store.put_file(digest, self.spill_path)
+            self.spill_path = None
+        self.buffer = None
+        return digest, self.size
+
+    def abort(self) -> None:
+        self.buffer = None
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        if self.spill_path is not None:
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            self.spill_path = None
+
+
+class BlobStore(object):
+    def put(self, data: bytes) -> str:
+        digest = self.digest(data)
+        self.put_buffer(digest, data)
+        return digest
+
+    def put_buffer(self, digest: str, data: Union[bytes, bytearray]) -> None:
+        raise NotImplementedError
+
+    def put_file(self, digest: str, path: str) -> None:
+        # Takes ownership of the file at `path`
+        raise NotImplementedError
+
+    def spill_dir(self) -> Optional[str]:
+        return None
+
+    def writer(self, max_memory: int, max_size: int) -> BlobWriter:
+        return BlobWriter(self, max_memory=max_memory, max_size=max_size)
+
+    def open(self, digest: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, digest: str) -> None:
+        raise NotImplementedError
+
+    def get(self, digest: str) -> bytes:
+        with self.open(digest) as f:
+            return f.read()
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+
+class FileBlobStore(BlobStore):
+    def __init__(self, root: str) -> None:
+        super().__init__()
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def spill_dir(self) -> Optional[str]:
+        return self.tmp_dir
+
+    def put_buffer(self, digest: str, data: Union[bytes, bytearray]) -> None:
+        if self.exists(digest):
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._move_into_place(tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_file(self, digest: str, path: str) -> None:
+        if self.exists(digest):
+            os.remove(path)
+            return
+        self._move_into_place(path, digest)
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self.path(digest), "rb")
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _move_into_place(self, tmp_path: str, digest: str) -> None:
+        path = self.path(digest)
+        shard_dir = os.path.dirname(path)
+        os.makedirs(shard_dir, exist_ok=True)
+        os.replace(tmp_path, path)
+        # Persist the rename itself, not only the file contents
+        dir_fd = os.open(shard_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class MemoryBlobStore(BlobStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.blobs: Dict[str, bytes] = {}
+
+    def put_buffer(self, digest: str, data: Union[bytes, bytearray]) -> None:
+        self.blobs.setdefault(digest, bytes(data))
+
+    def put_file(self, digest: str, path: str) -> None:
+        with open(path, "rb") as f:
+            self.blobs.setdefault(digest, f.read())
+        os.remove(path)
+
+    def open(self, digest: str) -> BinaryIO:
+        return io.BytesIO(self.blobs[digest])
+
+    def exists(self, digest: str) -> bool:
+        return digest in self.blobs
+
+    def delete(self, digest: str) -> None:
+        self.blobs.pop(digest, None)
+
+
+def create_blob_store(
+    kind: str = BLOB_STORE, root: str = BLOB_PATH
+) -> BlobStore:
+    if kind == "file":
+        return FileBlobStore(root)
+    if kind == "memory":
+        return MemoryBlobStore()
+    raise ValueError("Unknown blob store: {}".format(kind))
+
+
+blob_store = create_blob_store()
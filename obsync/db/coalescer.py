@@ -0,0 +1,168 @@
+import asyncio
+import functools
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from pony.orm import db_session
+
+from obsync.db.executor import db_executor, vault_key
+from obsync.db.shards import shards
+from obsync.utils.config import WRITE_BATCH_DELAY, WRITE_BATCH_SIZE
+from obsync.utils.logger import get_logger
+
+T = TypeVar("T")
+
+# (func, args, kwargs)
+Op = Tuple[Callable[..., Any], Tuple[Any, ...], Dict[str, Any]]
+# (ok, result or exception)
+Outcome = Tuple[bool, Any]
+# (vault_id, op, future)
+Pending = Tuple[Optional[str], Op, asyncio.Future]
+
+logger = get_logger()
+
+
+def run_batch(ops: List[Op]) -> List[Outcome]:
+    # One transaction for the whole batch. If it fails the operations are
+    # retried one transaction each, so one bad push does not fail the others
+    try:
+        with db_session:
+            outcomes = [
+                (True, func(*args, **kwargs)) for func, args, kwargs in ops
+            ]
+        return outcomes
+    except Exception as e:
+        if len(ops) == 1:
+            return [(False, e)]
+        logger.warning(f"Write batch of {len(ops)} failed, retrying: {e}")
+
+    outcomes = []
+    for func, args, kwargs in ops:
+        try:
+            with db_session:
+                outcomes.append((True, func(*args, **kwargs)))
+        except Exception as e:
+            outcomes.append((False, e))
+    return outcomes
+
+
+class WriteCoalescer(object):
+    # Gathers the writes of every connection into one transaction, flushed
+    # after `max_delay` seconds or once `max_ops` are pending. A write
+    # returns once its transaction has committed.
+    def __init__(self, max_delay: float, max_ops: int) -> None:
+        super().__init__()
+        self.max_delay = max_delay
+        self.max_ops = max_ops
+        self.pending: List[Pending] = []
+        self.full: Optional[asyncio.Future] = None
+        self.task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.ops = 0
+        self.max_batch = 0
+
+    async def submit(
+        self, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return await self.submit_to(None, func, *args, **kwargs)
+
+    async def submit_to(
+        self,
+        vault_id: Optional[str],
+        func: Callable[..., T],
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((vault_id, (func, args, kwargs), future))
+        if len(self.pending) >= self.max_ops and self.full is not None:
+            if not self.full.done():
+                self.full.set_result(None)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._flush())
+        return await future
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            await self.task
+            self.task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            batches=self.batches,
+            ops=self.ops,
+            max_batch=self.max_batch,
+            pending=len(self.pending),
+        )
+
+    async def _flush(self) -> None:
+        # Writes arriving while a batch commits wait for the next one
+        while len(self.pending) > 0:
+            if len(self.pending) < self.max_ops and self.max_delay > 0:
+                self.full = asyncio.get_running_loop().create_future()
+                await asyncio.wait([self.full], timeout=self.max_delay)
+                self.full = None
+            batch = self.pending[: self.max_ops]
+            self.pending = self.pending[self.max_ops :]
+            await self._write(batch)
+
+    async def _write(self, batch: List[Pending]) -> None:
+        # One transaction per database, so a group that fails was not
+        # partly committed. Shards commit in parallel on their writers.
+        groups: Dict[Any, List[Pending]] = {}
+        for pending in batch:
+            key = (
+                db_executor.writer_for(pending[0]),
+                shards.database_key(pending[0]),
+            )
+            groups.setdefault(key, []).append(pending)
+        await asyncio.gather(
+            *[self._write_group(group) for group in groups.values()]
+        )
+
+    async def _write_group(self, group: List[Pending]) -> None:
+        try:
+            outcomes = await db_executor.write_to(
+                group[0][0], run_batch, [op for _, op, _ in group]
+            )
+        except Exception as e:
+            outcomes = [(False, e)] * len(group)
+        self.batches += 1
+        self.ops += len(group)
+        self.max_batch = max(self.max_batch, len(group))
+        for (_, _, future), (ok, result) in zip(group, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+
+def batched(
+    func: Callable[..., T],
+    key: Optional[Callable[..., Optional[str]]] = None,
+) -> Callable[..., Awaitable[T]]:
+    vault_of = vault_key(func) if key is None else key
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await write_coalescer.submit_to(
+            vault_of(*args, **kwargs), func, *args, **kwargs
+        )
+
+    return wrapper
+
+
+write_coalescer = WriteCoalescer(
+    max_delay=WRITE_BATCH_DELAY, max_ops=WRITE_BATCH_SIZE
+)
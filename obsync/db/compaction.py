@@ -0,0 +1,101 @@
+import time
+from typing import Any, Dict
+
+from obsync.db.aio import snapshot
+from obsync.utils.config import (
+    COMPACTION_DELAY,
+    COMPACTION_INTERVAL,
+    COMPACTION_ROW_BUDGET,
+)
+from obsync.utils.logger import get_logger
+from obsync.utils.periodic import PeriodicTask
+
+logger = get_logger()
+
+
+class CompactionStats(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.runs = 0
+        self.vaults_compacted = 0
+        self.rows_rewritten = 0
+        self.seconds_spent = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            runs=self.runs,
+            vaults_compacted=self.vaults_compacted,
+            rows_rewritten=self.rows_rewritten,
+            seconds_spent=self.seconds_spent,
+        )
+
+
+class CompactionScheduler(object):
+    def __init__(
+        self,
+        interval: float = COMPACTION_INTERVAL,
+        delay: float = COMPACTION_DELAY,
+        row_budget: int = COMPACTION_ROW_BUDGET,
+    ) -> None:
+        super().__init__()
+        self.delay = delay
+        self.row_budget = row_budget
+        # vault id -> time it was first marked dirty
+        self.dirty: Dict[str, float] = {}
+        self.stats = CompactionStats()
+        self.task = PeriodicTask("compaction", interval, self.run_once)
+
+    def mark_dirty(self, vault_id: str) -> None:
+        # Repeated marks coalesce into a single pending compaction
+        self.dirty.setdefault(vault_id, time.monotonic())
+
+    async def start(self) -> None:
+        await self.task.start()
+
+    async def stop(self) -> None:
+        await self.task.stop()
+
+    async def run_once(self, force: bool = False) -> int:
+        # Compact due vaults until the row budget of this run is spent
+        start = time.monotonic()
+        budget = self.row_budget
+        rewritten_total = 0
+        due = [
+            vault_id
+            for vault_id, marked in sorted(
+                self.dirty.items(), key=lambda item: item[1]
+            )
+            if force or start - marked >= self.delay
+        ]
+        for vault_id in due:
+            if budget <= 0:
+                break
+            del self.dirty[vault_id]
+            try:
+                rewritten, done = await snapshot(vault_id, budget)
+            except Exception:
+                logger.exception(f"Compaction of vault {vault_id} failed")
+                continue
+            if not done:
+                self.mark_dirty(vault_id)
+            budget -= rewritten
+            rewritten_total += rewritten
+            self.stats.vaults_compacted += 1
+
+        elapsed = time.monotonic() - start
+        self.stats.runs += 1
+        self.stats.rows_rewritten += rewritten_total
+        self.stats.seconds_spent += elapsed
+        if rewritten_total:
+            logger.info(
+                f"Compaction rewrote {rewritten_total} rows of "
+                f"{len(due)} vaults in {elapsed * 1000:.1f}ms, "
+                f"{len(self.dirty)} vaults pending"
+            )
+        return rewritten_total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.stats.to_dict(), pending=len(self.dirty))
+
+
+compaction_scheduler = CompactionScheduler()
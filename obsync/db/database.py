@@ -0,0 +1,114 @@
+import os
+import sqlite3
+from typing import Any, Dict, Tuple
+
+from pony.orm import Database, db_session
+
+from obsync.db.migrations import run_migrations
+from obsync.utils.config import (
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE,
+    DB_JOURNAL_MODE,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_SYNCHRONOUS,
+    PROVIDER,
+    VAULT_DB,
+    WAL_AUTOCHECKPOINT,
+    WAL_CHECKPOINT_TIMEOUT,
+)
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+# Applied to every connection, in this order since journal_mode decides
+# what synchronous means
+PRAGMAS: Dict[str, Any] = dict(
+    journal_mode=DB_JOURNAL_MODE,
+    synchronous=DB_SYNCHRONOUS,
+    busy_timeout=DB_BUSY_TIMEOUT,
+    cache_size=DB_CACHE_SIZE,
+    mmap_size=DB_MMAP_SIZE,
+    wal_autocheckpoint=WAL_AUTOCHECKPOINT,
+)
+
+
+def create_database() -> Database:
+    database = Database()
+    database.on_connect(provider=PROVIDER)(_apply_pragmas)
+    return database
+
+
+def _apply_pragmas(db: Database, con: sqlite3.Connection) -> None:
+    apply_pragmas(con)
+
+
+def apply_pragmas(con: sqlite3.Connection) -> None:
+    for name, value in PRAGMAS.items():
+        con.execute(f"PRAGMA {name} = {value}")
+
+
+def effective_pragmas(con: sqlite3.Connection) -> Dict[str, Any]:
+    return {
+        name: con.execute(f"PRAGMA {name}").fetchone()[0] for name in PRAGMAS
+    }
+
+
+def bind_database(database: Database, filename: str) -> Dict[str, Any]:
+    # Called once every entity of `database` has been defined, returns the
+    # effective pragmas
+    database.bind(provider=PROVIDER, filename=filename, create_db=True)
+    with db_session:
+        con = database.get_connection()
+        run_migrations(con)
+        pragmas = effective_pragmas(con)
+    database.generate_mapping(create_tables=True)
+    return pragmas
+
+
+def setup_database() -> None:
+    if os.path.dirname(VAULT_DB) != DB_PATH:
+        logger.warning(
+            f"Using {VAULT_DB} of an earlier version, move it to {DB_PATH}"
+        )
+    pragmas = bind_database(db, VAULT_DB)
+    logger.info(
+        "Database pragmas: "
+        + ", ".join(f"{name}={value}" for name, value in pragmas.items())
+    )
+
+
+# The catalog, and the files of every vault unless they are sharded
+db = create_database()
+
+
+def bound_filename(database: Database) -> str:
+    # Pony resolves a relative filename itself when binding
+    return database.provider.pool.filename
+
+
+def wal_size(filename: str = VAULT_DB) -> int:
+    try:
+        return os.path.getsize(filename + "-wal")
+    except FileNotFoundError:
+        return 0
+
+
+def checkpoint_wal(
+    truncate_bytes: int,
+    filename: str = VAULT_DB,
+    busy_timeout: int = WAL_CHECKPOINT_TIMEOUT,
+) -> Tuple[str, int, int, int]:
+    # SQLite checkpoints passively on its own but never shrinks the file, a
+    # WAL grown past truncate_bytes by a burst of writes is reset once the
+    # readers let go of it. Returns (mode, busy, wal pages, checkpointed)
+    mode = "TRUNCATE" if wal_size(filename) > truncate_bytes else "PASSIVE"
+    con = sqlite3.connect(filename, isolation_level=None)
+    try:
+        con.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+        busy, log, checkpointed = con.execute(
+            f"PRAGMA wal_checkpoint({mode})"
+        ).fetchone()
+    finally:
+        con.close()
+    return mode, busy, log, checkpointed
@@ -0,0 +1,190 @@
+import asyncio
+import functools
+import inspect
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from obsync.utils.config import (
+    DB_READ_WORKERS,
+    DB_WRITE_WORKERS,
+    VAULT_SHARDS,
+)
+from obsync.utils.logger import get_logger
+
+T = TypeVar("T")
+
+logger = get_logger()
+
+
+class PoolStats(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submitted(self) -> None:
+        with self.lock:
+            self.queued += 1
+
+    def started(self, wait: float) -> None:
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def cancelled(self) -> None:
+        with self.lock:
+            self.queued -= 1
+
+    def finished(self) -> None:
+        with self.lock:
+            self.running -= 1
+            self.completed += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(
+                queued=self.queued,
+                running=self.running,
+                completed=self.completed,
+                avg_wait_ms=(
+                    0.0
+                    if self.completed == 0
+                    else self.total_wait * 1000 / self.completed
+                ),
+                max_wait_ms=self.max_wait * 1000,
+            )
+
+
+class DatabaseExecutor(object):
+    # Reads run on a bounded pool, writes are serialized on a single thread
+    # that owns every write transaction. With sharded vaults there is one
+    # writer thread per group of vaults, see write_to.
+    def __init__(self, read_workers: int, write_workers: int = 1) -> None:
+        super().__init__()
+        self.reader = ThreadPoolExecutor(
+            max_workers=read_workers, thread_name_prefix="db-read"
+        )
+        self.writers = [
+            ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"db-write-{i}"
+            )
+            for i in range(write_workers)
+        ]
+        self.read_stats = PoolStats()
+        self.write_stats = PoolStats()
+
+    async def read(
+        self, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return await self._run(
+            self.reader, self.read_stats, func, *args, **kwargs
+        )
+
+    async def write(
+        self, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        return await self.write_to(None, func, *args, **kwargs)
+
+    async def write_to(
+        self,
+        vault_id: Optional[str],
+        func: Callable[..., T],
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        # Writes to the same vault keep their order on the same thread
+        return await self._run(
+            self.writer_for(vault_id), self.write_stats, func, *args, **kwargs
+        )
+
+    def writer_for(self, vault_id: Optional[str]) -> ThreadPoolExecutor:
+        if vault_id is None or len(self.writers) == 1:
+            return self.writers[0]
+        return self.writers[zlib.crc32(vault_id.encode()) % len(self.writers)]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return dict(
+            read=self.read_stats.to_dict(), write=self.write_stats.to_dict()
+        )
+
+    def shutdown(self) -> None:
+        self.reader.shutdown(wait=True)
+        for writer in self.writers:
+            writer.shutdown(wait=True)
+
+    async def _run(
+        self,
+        pool: ThreadPoolExecutor,
+        stats: PoolStats,
+        func: Callable[..., T],
+        *args: Any,
+        **kwargs: Any,
+    ) -> T:
+        submitted = time.perf_counter()
+
+        def call() -> T:
+            stats.started(time.perf_counter() - submitted)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.finished()
+
+        stats.submitted()
+        future = pool.submit(call)
+        future.add_done_callback(
+            lambda f: stats.cancelled() if f.cancelled() else None
+        )
+        return await asyncio.wrap_future(future)
+
+
+def reader(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await db_executor.read(func, *args, **kwargs)
+
+    return wrapper
+
+
+def vault_key(
+    func: Callable[..., Any],
+) -> Callable[..., Optional[str]]:
+    # Finds the vault a call writes to from its vault_id argument
+    signature = inspect.signature(func)
+    if "vault_id" not in signature.parameters:
+        return lambda *args, **kwargs: None
+
+    def key(*args: Any, **kwargs: Any) -> Optional[str]:
+        return signature.bind(*args, **kwargs).arguments.get("vault_id")
+
+    return key
+
+
+def writer(
+    func: Callable[..., T],
+    key: Optional[Callable[..., Optional[str]]] = None,
+) -> Callable[..., Awaitable[T]]:
+    vault_of = vault_key(func) if key is None else key
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await db_executor.write_to(
+            vault_of(*args, **kwargs), func, *args, **kwargs
+        )
+
+    return wrapper
+
+
+db_executor = DatabaseExecutor(
+    read_workers=DB_READ_WORKERS,
+    write_workers=DB_WRITE_WORKERS if VAULT_SHARDS else 1,
+)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from obsync.db.aio import (
+    get_retention_policy,
+    get_vault_ids,
+    prune_tombstones,
+    prune_versions,
+    reconcile_vault_stats,
+)
+from obsync.db.database import bound_filename, checkpoint_wal, db, wal_size
+from obsync.db.shards import shards
+from obsync.utils.config import RETENTION_BATCH_SIZE, WAL_TRUNCATE_BYTES
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+async def reconcile_all_vault_stats() -> None:
+    for vault_id in await get_vault_ids():
+        if await reconcile_vault_stats(vault_id):
+            logger.warning(f"Vault stats of {vault_id} had drifted, fixed")
+
+
+async def prune_vault(vault_id: str, batch_size: int) -> int:
+    # Every batch is its own write transaction so pushes are never blocked
+    # behind a whole vault
+    policy = await get_retention_policy(vault_id)
+    now = int(time.time() * 1000)
+    removed = 0
+    if policy.tombstone_days > 0:
+        deleted_before = now - policy.tombstone_days * DAY_MS
+        done = False
+        while not done:
+            count, done = await prune_tombstones(
+                vault_id, deleted_before, batch_size
+            )
+            removed += count
+    if policy.prunes_versions():
+        after: Optional[str] = ""
+        while after is not None:
+            count, after = await prune_versions(
+                vault_id, policy, after, batch_size, now
+            )
+            removed += count
+    return removed
+
+
+async def prune_all_vaults() -> None:
+    for vault_id in await get_vault_ids():
+        removed = await prune_vault(vault_id, RETENTION_BATCH_SIZE)
+        if removed > 0:
+            logger.info(f"Retention removed {removed} versions of {vault_id}")
+
+
+def checkpoint_files() -> List[str]:
+    # SQLite checkpoints the shards on its own, their WALs are only
+    # truncated once grown
+    return [bound_filename(db)] + [
+        filename
+        for filename in shards.files()
+        if wal_size(filename) > WAL_TRUNCATE_BYTES
+    ]
+
+
+async def checkpoint_vault_db() -> None:
+    # Off the writer threads with a short busy timeout, a checkpoint held up
+    # by readers or writers gives up until the next run
+    for filename in await asyncio.to_thread(checkpoint_files):
+        mode, busy, log, checkpointed = await asyncio.to_thread(
+            checkpoint_wal, WAL_TRUNCATE_BYTES, filename
+        )
+        if busy or mode == "TRUNCATE":
+            logger.info(
+                f"WAL checkpoint {mode.lower()} of {filename}:"
+                f" {checkpointed}/{log} pages"
+                + (", blocked by readers or writers" if busy else "")
+            )
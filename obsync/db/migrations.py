@@ -0,0 +1,98 @@
+import sqlite3
+from typing import Callable, List, Tuple
+
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+
+def table_exists(con: sqlite3.Connection, table: str) -> bool:
+    return (
+        con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table,),
+        ).fetchone()
+        is not None
+    )
+
+
+def table_columns(con: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in con.execute(f"PRAGMA table_info({table})")]
+
+
+def create_index(
+    con: sqlite3.Connection, table: str, columns: Tuple[str, ...]
+) -> None:
+    # Same naming as Pony, so fresh and upgraded databases end up identical
+    if not table_exists(con, table):
+        return
+    name = "idx_{}__{}".format(table, "_".join(columns))
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+            name, table, ", ".join(columns)
+        )
+    )
+
+
+def add_blob_column(con: sqlite3.Connection) -> None:
+    if table_exists(con, "vault_file") and "blob" not in table_columns(
+        con, "vault_file"
+    ):
+        con.execute("ALTER TABLE vault_file ADD COLUMN blob TEXT")
+
+
+def add_indexes(con: sqlite3.Connection) -> None:
+    create_index(con, "vault_file", ("vault_id", "newest", "deleted"))
+    create_index(con, "vault_file", ("vault_id", "path", "newest"))
+    create_index(con, "vault_file", ("vault_id", "path", "modified"))
+    create_index(con, "share", ("email",))
+    create_index(con, "vault", ("user_email",))
+
+
+def add_seq_column(con: sqlite3.Connection) -> None:
+    if table_exists(con, "vault_file") and "seq" not in table_columns(
+        con, "vault_file"
+    ):
+        con.execute("ALTER TABLE vault_file ADD COLUMN seq INTEGER")
+    create_index(con, "vault_file", ("vault_id", "seq"))
+
+
+def add_deleted_at_column(con: sqlite3.Connection) -> None:
+    if table_exists(con, "vault_file") and "deleted_at" not in table_columns(
+        con, "vault_file"
+    ):
+        con.execute("ALTER TABLE vault_file ADD COLUMN deleted_at INTEGER")
+
+
+def add_hash_index(con: sqlite3.Connection) -> None:
+    create_index(con, "vault_file", ("vault_id", "hash"))
+
+
+# Append only, the position in the list is the schema version
+MIGRATIONS: List[Tuple[str, Callable[[sqlite3.Connection], None]]] = [
+    ("add vault_file.blob", add_blob_column),
+    ("add indexes", add_indexes),
+    ("add vault_file.seq", add_seq_column),
+    ("add vault_file.deleted_at", add_deleted_at_column),
+    ("add vault_file hash index", add_hash_index),
+]
+
+
+def schema_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(con: sqlite3.Connection) -> int:
+    # Tables missing here are created by Pony with the latest schema, so
+    # migrations only touch the tables that already exist
+    version = schema_version(con)
+    for index, (description, migration) in enumerate(MIGRATIONS):
+        if index < version:
+            continue
+        logger.info(
+            f"Migrating database to version {index + 1}: {description}"
+        )
+        migration(con)
+        con.execute(f"PRAGMA user_version = {index + 1}")
+        con.commit()
+    return schema_version(con)
@@ -0,0 +1,95 @@
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from obsync.utils.config import (
+    RETENTION_BUCKETS,
+    RETENTION_KEEP_VERSIONS,
+    RETENTION_TOMBSTONE_DAYS,
+)
+
+UNITS: Dict[str, int] = {
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+    "w": 7 * 24 * 60 * 60 * 1000,
+}
+
+
+def parse_duration(value: str) -> int:
+    match = re.fullmatch(r"(\d+)([mhdw])", value.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def parse_buckets(spec: str) -> List[Tuple[int, int]]:
+    # "1h:1d,1d:30d" keeps one version per hour for a day, then one version
+    # per day for a month, as (width, span) in milliseconds
+    buckets = []
+    for item in spec.split(","):
+        if item.strip() == "":
+            continue
+        width, _, span = item.partition(":")
+        buckets.append((parse_duration(width), parse_duration(span)))
+    return sorted(buckets, key=lambda bucket: bucket[1])
+
+
+class RetentionPolicy(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    # 0 disables the rule, the newest version is always kept
+    keep_versions: int = 0
+    buckets: str = ""
+    tombstone_days: int = 0
+
+    @field_validator("buckets")
+    @classmethod
+    def check_buckets(cls, value: Optional[str]) -> str:
+        parse_buckets(value or "")
+        return value or ""
+
+    def prunes_versions(self) -> bool:
+        return self.keep_versions > 0 or self.buckets != ""
+
+
+def default_policy() -> RetentionPolicy:
+    return RetentionPolicy(
+        keep_versions=RETENTION_KEEP_VERSIONS,
+        buckets=RETENTION_BUCKETS,
+        tombstone_days=RETENTION_TOMBSTONE_DAYS,
+    )
+
+
+def bucket_key(
+    buckets: List[Tuple[int, int]], modified: int, now: int
+) -> Optional[Tuple[int, int]]:
+    for index, (width, span) in enumerate(buckets):
+        if now - modified <= span:
+            return index, modified // width
+    return None
+
+
+def select_pruned(
+    versions: Sequence[Tuple[int, int]], policy: RetentionPolicy, now: int
+) -> List[int]:
+    # `versions` are the (uid, modified) of one path, newest first, returns
+    # the uids the policy no longer keeps
+    if not policy.prunes_versions():
+        return []
+    buckets = parse_buckets(policy.buckets)
+    seen: Set[Tuple[int, int]] = set()
+    pruned = []
+    for index, (uid, modified) in enumerate(versions):
+        key = bucket_key(buckets, modified or 0, now)
+        keep = (
+            index == 0
+            or index < policy.keep_versions
+            or (key is not None and key not in seen)
+        )
+        if key is not None:
+            seen.add(key)
+        if not keep:
+            pruned.append(uid)
+    return pruned
@@ -0,0 +1,134 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from pony.orm import Database
+
+from obsync.db.blob_store import BlobStore, blob_store, create_blob_store
+from obsync.db.database import bind_database, create_database, db
+from obsync.db.vault_files import FileEntities, central, define_file_entities
+from obsync.utils.config import SHARD_MAX_OPEN, SHARD_PATH, VAULT_SHARDS
+
+VAULT_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Shard(object):
+    # Where the files of a vault live, the file entities of a database and
+    # the blob store their content is in
+    def __init__(
+        self, db: Database, entities: FileEntities, blobs: BlobStore
+    ) -> None:
+        super().__init__()
+        self.db = db
+        self.VaultFile = entities.VaultFile
+        self.Blob = entities.Blob
+        self.VaultSeq = entities.VaultSeq
+        self.VaultStats = entities.VaultStats
+        self.VaultRetention = entities.VaultRetention
+        self.blobs = blobs
+
+
+class ShardPool(object):
+    # With a root every vault has its own database under it, at most
+    # `max_open` of them stay open. Without one every vault lives in the
+    # central database.
+    def __init__(self, root: Optional[str], max_open: int) -> None:
+        super().__init__()
+        self.root = root
+        self.max_open = max_open
+        self.central = Shard(db, central, blob_store)
+        self.open: "OrderedDict[str, Shard]" = OrderedDict()
+        # Blob stores are cheap and a memory store must outlive its shard
+        self.blob_stores: Dict[str, BlobStore] = {}
+        # Shards are opened from the database threads
+        self.lock = threading.Lock()
+        # Creating the tables needs a DDL session, which cannot nest in the
+        # session of the caller, so shards are set up on a thread of their own
+        self.opener = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="db-shard"
+        )
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, vault_id: str) -> Shard:
+        if self.root is None:
+            return self.central
+        with self.lock:
+            shard = self.open.get(vault_id)
+            if shard is not None:
+                self.open.move_to_end(vault_id)
+                return shard
+            shard = self._open_shard(vault_id)
+            self.open[vault_id] = shard
+            if len(self.open) > self.max_open:
+                # Connections close once the threads using it let go
+                self.open.popitem(last=False)
+                self.evicted += 1
+            return shard
+
+    def database_key(self, vault_id: Optional[str]) -> Optional[str]:
+        # Vaults with the same key share a database
+        return None if self.root is None else vault_id
+
+    def path(self, vault_id: str) -> str:
+        if self.root is None:
+            raise ValueError("Vaults are not sharded")
+        if VAULT_ID.match(vault_id) is None:
+            raise ValueError("Invalid vault id: {}".format(vault_id))
+        return os.path.join(self.root, vault_id + ".db")
+
+    def blob_path(self, vault_id: str) -> str:
+        return os.path.join(os.path.dirname(self.path(vault_id)), vault_id)
+
+    def vault_ids(self) -> List[str]:
+        # Vaults that have a shard, see get_vault_ids for the central ones
+        if self.root is None or not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name[:-3] for name in os.listdir(self.root) if name.endswith(".db")
+        )
+
+    def files(self) -> List[str]:
+        return [self.path(vault_id) for vault_id in self.vault_ids()]
+
+    def all(self) -> Iterator[Shard]:
+        if self.root is None:
+            yield self.central
+            return
+        for vault_id in self.vault_ids():
+            yield self.get(vault_id)
+
+    def blob_store(self, vault_id: str) -> BlobStore:
+        if self.root is None:
+            return blob_store
+        with self.lock:
+            return self._blob_store(vault_id)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            open=len(self.open), opened=self.opened, evicted=self.evicted
+        )
+
+    def _blob_store(self, vault_id: str) -> BlobStore:
+        store = self.blob_stores.get(vault_id)
+        if store is None:
+            store = create_blob_store(root=self.blob_path(vault_id))
+            self.blob_stores[vault_id] = store
+        return store
+
+    def _open_shard(self, vault_id: str) -> Shard:
+        filename = self.path(vault_id)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        database = create_database()
+        entities = define_file_entities(database)
+        self.opener.submit(bind_database, database, filename).result()
+        self.opened += 1
+        return Shard(database, entities, self._blob_store(vault_id))
+
+
+shards = ShardPool(
+    root=SHARD_PATH if VAULT_SHARDS else None, max_open=SHARD_MAX_OPEN
+)
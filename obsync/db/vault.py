@@ -1,21 +1,17 @@
 from pony.orm import (
-    Database,
     Optional,
     PrimaryKey,
     Required,
 )
 
-from obsync.utils.config import PROVIDER, VAULT_DB
-
-db = Database()
-db.bind(provider=PROVIDER, filename=VAULT_DB, create_db=True)
+from obsync.db.database import db
 
 
 class Vault(db.Entity):
     _table_ = "vault"
 
     id = PrimaryKey(str, auto=True)
-    user_email = Required(str)
+    user_email = Required(str, index=True)
     created = Required(int, size=64)
     host = Required(str)
     name = Required(str)
@@ -29,7 +25,7 @@ class Share(db.Entity):
     _table_ = "share"
 
     uid = PrimaryKey(str, auto=True)
-    email = Required(str)
+    email = Required(str, index=True)
     name = Required(str)
     vault_id = Required(str)
     accepted = Required(bool, default=True)
@@ -42,6 +38,3 @@ class User(db.Entity):
     email = PrimaryKey(str)
     password = Required(str)
     license = Optional(str)
-
-
-db.generate_mapping(create_tables=True)
@@ -1,32 +1,92 @@
+from typing import Any, NamedTuple
+
 from pony.orm import (
     Database,
     Optional,
     PrimaryKey,
     Required,
+    composite_index,
 )
 
-from obsync.utils.config import PROVIDER, VAULT_DB
+from obsync.db.database import db
+
+
+class FileEntities(NamedTuple):
+    VaultFile: Any
+    Blob: Any
+    VaultSeq: Any
+    VaultStats: Any
+    VaultRetention: Any
+
+
+def define_file_entities(db: Database) -> FileEntities:
+    # The file tables of a database, defined once on the central database
+    # and once on every vault shard
+    class VaultFile(db.Entity):
+        _table_ = "vault_file"
+
+        uid = PrimaryKey(int, auto=True)
+        vault_id = Optional(str)
+        hash = Optional(str)
+        path = Optional(str)
+        extension = Optional(str)
+        size = Optional(int, size=64)
+        created = Optional(int, size=64)
+        modified = Optional(int, size=64)
+        folder = Optional(bool)
+        deleted = Optional(bool)
+        # Legacy inline content, new content lives in the blob store
+        data = Optional(bytes, lazy=True)
+        blob = Optional(str, nullable=True)
+        newest = Required(bool, default=True)
+        is_snapshot = Required(bool, default=False)
+        seq = Optional(int, size=64)
+        # When the file was deleted on the server, used to expire tombstones
+        deleted_at = Optional(int, size=64, nullable=True)
+        composite_index(vault_id, newest, deleted)
+        composite_index(vault_id, path, newest)
+        composite_index(vault_id, path, modified)
+        composite_index(vault_id, seq)
+        composite_index(vault_id, hash)
+
+    class Blob(db.Entity):
+        _table_ = "blob"
+
+        digest = PrimaryKey(str)
+        size = Required(int, size=64)
+        refcount = Required(int, default=0)
+
+    class VaultSeq(db.Entity):
+        _table_ = "vault_seq"
+
+        vault_id = PrimaryKey(str)
+        # Last sequence number handed out to a metadata write
+        seq = Required(int, size=64, default=0)
+        # Changes up to this sequence number may no longer be in vault_file
+        compacted = Required(int, size=64, default=0)
+
+    class VaultStats(db.Entity):
+        _table_ = "vault_stats"
 
-db = Database()
-db.bind(provider=PROVIDER, filename=VAULT_DB, create_db=True)
+        vault_id = PrimaryKey(str)
+        # Every stored version, what the size op reports
+        total_bytes = Required(int, size=64, default=0)
+        version_count = Required(int, size=64, default=0)
+        # Newest versions that are not deleted
+        live_bytes = Required(int, size=64, default=0)
+        file_count = Required(int, size=64, default=0)
+        tombstone_count = Required(int, size=64, default=0)
 
+    class VaultRetention(db.Entity):
+        _table_ = "vault_retention"
 
-class VaultFile(db.Entity):
-    _table_ = "vault_file"
+        vault_id = PrimaryKey(str)
+        keep_versions = Required(int, default=0)
+        buckets = Optional(str)
+        tombstone_days = Required(int, default=0)
 
-    uid = PrimaryKey(int, auto=True)
-    vault_id = Optional(str)
-    hash = Optional(str)
-    path = Optional(str)
-    extension = Optional(str)
-    size = Optional(int, size=64)
-    created = Optional(int, size=64)
-    modified = Optional(int, size=64)
-    folder = Optional(bool)
-    deleted = Optional(bool)
-    data = Optional(bytes)
-    newest = Required(bool, default=True)
-    is_snapshot = Required(bool, default=False)
+    return FileEntities(VaultFile, Blob, VaultSeq, VaultStats, VaultRetention)
 
 
-db.generate_mapping(create_tables=True)
+central = define_file_entities(db)
+VaultFile, Blob, VaultSeq, VaultStats, VaultRetention = central
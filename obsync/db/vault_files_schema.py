@@ -1,10 +1,34 @@
 import time
-from typing import Any, Dict, List, Optional
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    cast,
+)
 
-from pony.orm import commit, db_session, delete, desc, select
+from pony.orm import db_session, flush, select
 from pydantic import BaseModel, ConfigDict, Field
 
-from obsync.db.vault_files import VaultFile
+from obsync.db.blob_store import BlobMissingError
+from obsync.db.retention import (
+    RetentionPolicy,
+    default_policy,
+    select_pruned,
+)
+from obsync.db.shards import Shard, shards
+from obsync.db.vault_index import (
+    MANIFEST_COLUMNS,
+    ManifestRow,
+    VaultDelta,
+    VaultIndex,
+    vault_index,
+)
+from obsync.utils.config import HISTORY_PAGE_SIZE
 
 
 class VaultFileModel(BaseModel):
@@ -20,115 +44,880 @@ class VaultFileModel(BaseModel):
     modified: Optional[int]
     folder: Optional[bool]
     deleted: Optional[bool]
-    data: Optional[bytes] = Field(exclude=True)
+    data: Optional[bytes] = Field(default=None, exclude=True)
+    blob: Optional[str] = Field(default=None, exclude=True)
     newest: bool = True
     is_snapshot: bool = False
+    seq: Optional[int] = Field(default=None, exclude=True)
+
+
+class VaultMetaFileModel(BaseModel):
+    vault_id: str
+    path: str
+    hash: str
+    extension: str
+    size: int
+    created: int
+    modified: int
+    folder: bool
+    deleted: bool
+
+
+class FileRecord(NamedTuple):
+    # Metadata of a vault_file row, listings select these columns only so
+    # the content of a file is never read unless it is pulled
+    uid: int
+    vault_id: Optional[str]
+    hash: Optional[str]
+    path: Optional[str]
+    extension: Optional[str]
+    size: Optional[int]
+    created: Optional[int]
+    modified: Optional[int]
+    folder: Optional[bool]
+    deleted: Optional[bool]
+    newest: bool
+    is_snapshot: bool
+    blob: Optional[str]
+    seq: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Same keys as VaultFileModel.model_dump()
+        return dict(zip(RECORD_PUBLIC_FIELDS, self))
+
+
+RECORD_COLUMNS = ", ".join(FileRecord._fields)
+RECORD_PUBLIC_FIELDS = FileRecord._fields[:12]
+RECORD_FLAGS = tuple(
+    FileRecord._fields.index(name)
+    for name in ("folder", "deleted", "newest", "is_snapshot")
+)
+
+
+def file_record(row: Tuple) -> FileRecord:
+    # SQLite hands booleans back as integers
+    values = list(row)
+    for index in RECORD_FLAGS:
+        if values[index] is not None:
+            values[index] = bool(values[index])
+    return FileRecord._make(values)
+
+
+def entity_record(file: Any) -> FileRecord:
+    return FileRecord._make(getattr(file, name) for name in FileRecord._fields)
+
+
+class VaultStatsModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    vault_id: str
+    total_bytes: int
+    version_count: int
+    live_bytes: int
+    file_count: int
+    tombstone_count: int
+
+
+def compute_vault_stats(shard: Shard, vault_id: str) -> Dict[str, int]:
+    total_bytes, version_count, live_bytes, file_count, tombstone_count = (
+        shard.db.select("""
+            COALESCE(SUM(size), 0),
+            COUNT(*),
+            COALESCE(SUM(
+                CASE WHEN newest AND NOT COALESCE(deleted, 0) THEN size END
+            ), 0),
+            COALESCE(SUM(newest AND NOT COALESCE(deleted, 0)), 0),
+            COALESCE(SUM(newest AND COALESCE(deleted, 0)), 0)
+            FROM vault_file WHERE vault_id = $vault_id
+            """)[0]
+    )
+    return dict(
+        total_bytes=total_bytes,
+        version_count=version_count,
+        live_bytes=live_bytes,
+        file_count=file_count,
+        tombstone_count=tombstone_count,
+    )
+
+
+def vault_stats_state(shard: Shard, vault_id: str) -> Any:
+    # Must be called before the vault is modified in the same transaction,
+    # the first call computes the stats from the existing rows
+    stats = shard.VaultStats.get(vault_id=vault_id)
+    if stats is None:
+        stats = shard.VaultStats(
+            vault_id=vault_id, **compute_vault_stats(shard, vault_id)
+        )
+    return stats
+
+
+def count_file(stats: Any, file: Any, sign: int) -> None:
+    count_row(stats, file.size, file.newest, file.deleted, sign)
+
+
+def count_row(
+    stats: Any,
+    size: Optional[int],
+    newest: bool,
+    deleted: Optional[bool],
+    sign: int,
+) -> None:
+    size = size or 0
+    stats.total_bytes += sign * size
+    stats.version_count += sign
+    if newest:
+        if deleted:
+            stats.tombstone_count += sign
+        else:
+            stats.live_bytes += sign * size
+            stats.file_count += sign
 
 
 @db_session
-def snapshot(vault_id: str) -> None:
-    # Set newest files to be snapshots
-    files = select(
-        f for f in VaultFile if f.vault_id == vault_id and f.newest is True
+def get_vault_stats(vault_id: str) -> VaultStatsModel:
+    shard = shards.get(vault_id)
+    stats = shard.VaultStats.get(vault_id=vault_id)
+    if stats is None:
+        return VaultStatsModel(
+            vault_id=vault_id, **compute_vault_stats(shard, vault_id)
+        )
+    return VaultStatsModel.model_validate(stats)
+
+
+@db_session
+def reconcile_vault_stats(vault_id: str) -> Optional[VaultDelta]:
+    # Returns the correction of the vault size, None if the materialized
+    # stats had not drifted
+    shard = shards.get(vault_id)
+    computed = compute_vault_stats(shard, vault_id)
+    stats = shard.VaultStats.get(vault_id=vault_id)
+    if stats is None:
+        shard.VaultStats(vault_id=vault_id, **computed)
+        return None
+    delta = VaultDelta(added=computed["total_bytes"] - stats.total_bytes)
+    drifted = False
+    for key, value in computed.items():
+        if getattr(stats, key) != value:
+            setattr(stats, key, value)
+            drifted = True
+    return delta if drifted else None
+
+
+def get_vault_ids() -> List[str]:
+    with db_session:
+        vault_ids = set(
+            select(f.vault_id for f in shards.central.VaultFile)[:]
+        )
+    return sorted(vault_ids.union(shards.vault_ids()))
+
+
+def vault_seq_state(shard: Shard, vault_id: str, version: int = 0) -> Any:
+    state = shard.VaultSeq.get(vault_id=vault_id)
+    if state is None:
+        # Vaults synced before sequence numbers existed start at their
+        # version, older clients then fall back to the full manifest
+        state = shard.VaultSeq(
+            vault_id=vault_id, seq=version, compacted=version
+        )
+    return state
+
+
+def next_seq(shard: Shard, vault_id: str) -> int:
+    state = vault_seq_state(shard, vault_id)
+    state.seq += 1
+    return state.seq
+
+
+def mark_compacted(
+    shard: Shard, vault_id: str, seqs: Iterable[Optional[int]]
+) -> int:
+    # Called when newest rows are removed, their change is lost for clients
+    # that have not seen it yet. Returns the compaction mark, 0 if unchanged.
+    removed = [seq for seq in seqs if seq is not None]
+    if len(removed) == 0:
+        return 0
+    state = vault_seq_state(shard, vault_id)
+    state.compacted = max(state.compacted, max(removed))
+    return state.compacted
+
+
+@db_session
+def get_vault_seq(vault_id: str) -> Optional[int]:
+    shard = shards.get(vault_id)
+    state = shard.VaultSeq.get(vault_id=vault_id)
+    return None if state is None else state.seq
+
+
+@db_session
+def advance_vault_seq(vault_id: str, version: int) -> int:
+    shard = shards.get(vault_id)
+    state = vault_seq_state(shard, vault_id, version)
+    state.seq = max(state.seq, version)
+    return state.seq
+
+
+@db_session
+def get_changes(vault_id: str, since: int) -> Optional[List[FileRecord]]:
+    # None means the change log no longer goes back to `since`
+    shard = shards.get(vault_id)
+    state = shard.VaultSeq.get(vault_id=vault_id)
+    if state is None or since < state.compacted:
+        return None
+    rows = shard.db.select(
+        f"{RECORD_COLUMNS} FROM vault_file WHERE vault_id = $vault_id"
+        " AND seq > $since AND newest = 1 ORDER BY seq"
     )
-    for file in files:
-        file.is_snapshot = True
+    return [file_record(row) for row in rows]
 
-    # delete all files that are not snapshots
-    delete(
-        f
-        for f in VaultFile
-        if f.vault_id == vault_id and f.is_snapshot is False
+
+def manifest_rows(shard: Shard) -> Any:
+    # Query of the ManifestRow of every version, narrowed down with where()
+    columns = ", ".join(f"f.{column}" for column in MANIFEST_COLUMNS)
+    return select(f"({columns}) for f in shard.VaultFile")
+
+
+def newest_rows(shard: Shard, vault_id: str) -> List[ManifestRow]:
+    # Newest version of every path, tombstones included
+    query = manifest_rows(shard).where(
+        lambda f: f.vault_id == vault_id and f.newest is True
     )
-    # delete all files where size is not 0 but data is null
-    delete(
-        f
-        for f in VaultFile
-        if f.size != 0 and f.data is None and f.vault_id == vault_id
+    return query.without_distinct()[:]
+
+
+def manifest_row(file: Any) -> ManifestRow:
+    return cast(
+        ManifestRow,
+        tuple(getattr(file, column) for column in MANIFEST_COLUMNS),
+    )
+
+
+@db_session
+def get_manifest_page(
+    vault_id: str, since: Optional[int], after: int, limit: int
+) -> Optional[List[ManifestRow]]:
+    # Full manifest when `since` is None, keyed by uid, otherwise the
+    # changes after `since`, keyed by seq. Rows are ManifestRow tuples.
+    shard = shards.get(vault_id)
+    if since is None:
+        query = (
+            manifest_rows(shard)
+            .where(
+                lambda f: f.vault_id == vault_id
+                and f.deleted is False
+                and f.newest is True
+                and f.uid > after
+            )
+            .order_by(1)
+        )
+    else:
+        state = shard.VaultSeq.get(vault_id=vault_id)
+        if state is None or since < state.compacted:
+            return None
+        query = (
+            manifest_rows(shard)
+            .where(
+                lambda f: f.vault_id == vault_id
+                and f.seq > after
+                and f.newest is True
+            )
+            .order_by(9)
+        )
+    return query.without_distinct()[:limit]
+
+
+@db_session
+def read_vault_index(vault_id: str) -> VaultIndex:
+    shard = shards.get(vault_id)
+    state = shard.VaultSeq.get(vault_id=vault_id)
+    stats = shard.VaultStats.get(vault_id=vault_id)
+    return VaultIndex(
+        newest_rows(shard, vault_id),
+        seq=None if state is None else state.seq,
+        compacted=0 if state is None else state.compacted,
+        total_bytes=(
+            compute_vault_stats(shard, vault_id)["total_bytes"]
+            if stats is None
+            else stats.total_bytes
+        ),
     )
 
 
+def acquire_blob(shard: Shard, digest: str, size: int) -> None:
+    blob = shard.Blob.get(digest=digest)
+    if blob is None:
+        # The last reference may have been released and the file purged
+        # since it was stored. Purges run on the writer thread of the vault,
+        # so the file cannot go away after this check.
+        if not shard.blobs.exists(digest):
+            raise BlobMissingError("Blob {} is missing".format(digest))
+        blob = shard.Blob(digest=digest, size=size)
+    blob.refcount += 1
+
+
+def release_blobs(shard: Shard, digests: Iterable[Optional[str]]) -> List[str]:
+    # Returns the digests nobody references anymore, the caller removes
+    # them from the blob store once the transaction is committed
+    orphans = []
+    for digest in digests:
+        if digest is None:
+            continue
+        blob = shard.Blob.get(digest=digest)
+        if blob is None:
+            continue
+        blob.refcount -= 1
+        if blob.refcount <= 0:
+            blob.delete()
+            orphans.append(digest)
+    return orphans
+
+
+def purge_blobs(shard: Shard, digests: List[str]) -> None:
+    if len(digests) == 0:
+        return
+    with db_session:
+        for digest in digests:
+            if shard.Blob.get(digest=digest) is None:
+                shard.blobs.delete(digest)
+
+
+def snapshot(
+    vault_id: str, limit: Optional[int] = None
+) -> Tuple[int, bool, VaultDelta]:
+    # Returns the number of rows rewritten, whether the vault is fully
+    # compacted and the versions deleted, `limit` bounds the rows rewritten
+    # by this call
+    shard = shards.get(vault_id)
+    with db_session:
+        stats = vault_stats_state(shard, vault_id)
+        # Set newest files to be snapshots
+        rewritten = shard.db.execute(
+            "UPDATE vault_file SET is_snapshot = 1"
+            " WHERE vault_id = $vault_id AND newest = 1 AND is_snapshot = 0"
+        ).rowcount
+
+        # delete files that are not snapshots, none of them is newest
+        batch = -1 if limit is None else max(limit - rewritten, 1)
+        removed = shard.db.select(
+            "uid, path, blob, size FROM vault_file"
+            " WHERE vault_id = $vault_id AND is_snapshot = 0 LIMIT $batch"
+        )
+        delete_rows(shard, [uid for uid, *_ in removed])
+        freed = sum(size or 0 for *_, size in removed)
+        stats.total_bytes -= freed
+        stats.version_count -= len(removed)
+
+        # delete all files where size is not 0 but data is null
+        empty = shard.db.select(
+            "uid, path, size, newest, deleted, seq FROM vault_file"
+            " WHERE vault_id = $vault_id AND size != 0"
+            " AND blob IS NULL AND data IS NULL"
+        )
+        delete_rows(shard, [uid for uid, *_ in empty])
+        compacted = mark_compacted(
+            shard, vault_id, [seq for *_, newest, _, seq in empty if newest]
+        )
+        for _, _, size, newest, deleted, _ in empty:
+            count_row(stats, size, newest, deleted, -1)
+            freed += size or 0
+
+        rewritten += len(removed) + len(empty)
+        done = batch < 0 or len(removed) < batch
+        delta = VaultDelta(
+            removed=tuple((uid, path) for uid, path, *_ in removed + empty),
+            added=-freed,
+            compacted=compacted,
+        )
+        orphans = release_blobs(shard, [blob for _, _, blob, _ in removed])
+    purge_blobs(shard, orphans)
+    return rewritten, done, delta
+
+
+def delete_rows(shard: Shard, uids: List[int], chunk: int = 500) -> None:
+    for start in range(0, len(uids), chunk):
+        in_list = ",".join(
+            str(int(uid)) for uid in uids[start : start + chunk]
+        )
+        shard.db.execute(f"DELETE FROM vault_file WHERE uid IN ({in_list})")
+
+
+@db_session
+def get_retention_policy(vault_id: str) -> RetentionPolicy:
+    shard = shards.get(vault_id)
+    stored = shard.VaultRetention.get(vault_id=vault_id)
+    if stored is None:
+        return default_policy()
+    return RetentionPolicy.model_validate(stored)
+
+
 @db_session
-def restore_file(uid: int) -> Optional[VaultFileModel]:
-    vault_file = select(f for f in VaultFile if f.uid == uid).first()
+def set_retention_policy(
+    vault_id: str, policy: Optional[RetentionPolicy]
+) -> None:
+    # None falls back to the server wide policy
+    shard = shards.get(vault_id)
+    stored = shard.VaultRetention.get(vault_id=vault_id)
+    if policy is None:
+        if stored is not None:
+            stored.delete()
+    elif stored is None:
+        shard.VaultRetention(vault_id=vault_id, **policy.model_dump())
+    else:
+        stored.set(**policy.model_dump())
+
+
+def prune_versions(
+    vault_id: str, policy: RetentionPolicy, after: str, limit: int, now: int
+) -> Tuple[int, Optional[str], VaultDelta]:
+    # Applies the policy to up to `limit` paths after `after`, returns the
+    # number of versions removed, the path to continue from and the
+    # versions removed
+    shard = shards.get(vault_id)
+    with db_session:
+        paths = shard.db.select(
+            "path FROM vault_file WHERE vault_id = $vault_id"
+            " AND path > $after GROUP BY path HAVING COUNT(*) > 1"
+            " ORDER BY path LIMIT $limit"
+        )
+        if len(paths) == 0:
+            return 0, None, VaultDelta()
+        last = paths[-1]
+        rows = shard.db.select(
+            "uid, path, modified, blob, size, deleted FROM vault_file"
+            " WHERE vault_id = $vault_id AND path > $after AND path <= $last"
+            " ORDER BY path, newest DESC, modified DESC, seq DESC"
+        )
+        versions: Dict[str, List[Tuple[int, int]]] = {}
+        for uid, path, modified, *_ in rows:
+            versions.setdefault(path, []).append((uid, modified))
+        pruned = set()
+        for path_versions in versions.values():
+            pruned.update(select_pruned(path_versions, policy, now))
+
+        removed = [row for row in rows if row[0] in pruned]
+        if len(removed) > 0:
+            stats = vault_stats_state(shard, vault_id)
+            for _, _, _, _, size, deleted in removed:
+                count_row(stats, size, False, deleted, -1)
+            delete_rows(shard, [uid for uid, *_ in removed])
+        delta = VaultDelta(
+            removed=tuple((uid, path) for uid, path, *_ in removed),
+            added=-sum(size or 0 for *_, size, _ in removed),
+        )
+        orphans = release_blobs(
+            shard, [blob for _, _, _, blob, _, _ in removed]
+        )
+    purge_blobs(shard, orphans)
+    return len(removed), last if len(paths) == limit else None, delta
+
+
+def prune_tombstones(
+    vault_id: str, deleted_before: int, limit: int
+) -> Tuple[int, bool, VaultDelta]:
+    # Removes files deleted before `deleted_before` with all their versions,
+    # returns the number of rows removed, whether none are left and the
+    # rows removed
+    shard = shards.get(vault_id)
+    with db_session:
+        paths = shard.db.select(
+            "path FROM vault_file WHERE vault_id = $vault_id"
+            " AND newest = 1 AND deleted = 1"
+            " AND COALESCE(deleted_at, modified) < $deleted_before"
+            " LIMIT $limit"
+        )
+        removed = []
+        for path in paths:
+            removed.extend(
+                shard.db.select(
+                    "uid, path, blob, size, newest, deleted, seq"
+                    " FROM vault_file"
+                    " WHERE vault_id = $vault_id AND path = $path"
+                )
+            )
+        compacted = 0
+        if len(removed) > 0:
+            stats = vault_stats_state(shard, vault_id)
+            for *_, size, newest, deleted, _ in removed:
+                count_row(stats, size, newest, deleted, -1)
+            delete_rows(shard, [uid for uid, *_ in removed])
+            compacted = mark_compacted(
+                shard,
+                vault_id,
+                [seq for *_, newest, _, seq in removed if newest],
+            )
+        delta = VaultDelta(
+            removed=tuple((uid, path) for uid, path, *_ in removed),
+            added=-sum(size or 0 for _, _, _, size, *_ in removed),
+            compacted=compacted,
+        )
+        orphans = release_blobs(shard, [blob for _, _, blob, *_ in removed])
+    purge_blobs(shard, orphans)
+    return len(removed), len(paths) < limit, delta
+
+
+@db_session
+def restore_file(vault_id: str, uid: int) -> Optional[FileRecord]:
+    shard = shards.get(vault_id)
+    vault_file = select(
+        f for f in shard.VaultFile if f.uid == uid and f.vault_id == vault_id
+    ).first()
     if vault_file is None:
         return None
-    vault_file.uid = uid
-    vault_file.deleted = False
-    vault_file.newest = True
-    ori_vault_file = select(
+    stats = vault_stats_state(shard, vault_id)
+    ori_vault_files = select(
         f
-        for f in VaultFile
-        if f.path == vault_file.path and f.deleted is False
+        for f in shard.VaultFile
+        if f.vault_id == vault_id
+        and f.path == vault_file.path
+        and f.newest is True
+        and f.uid != uid
     )
-    ori_vault_file.newest = False
-    return VaultFileModel.model_validate(vault_file)
+    for ori_vault_file in ori_vault_files:
+        count_file(stats, ori_vault_file, -1)
+        ori_vault_file.newest = False
+        count_file(stats, ori_vault_file, 1)
+    count_file(stats, vault_file, -1)
+    vault_file.deleted = False
+    vault_file.deleted_at = None
+    vault_file.newest = True
+    count_file(stats, vault_file, 1)
+    vault_file.seq = next_seq(shard, vault_id)
+    return entity_record(vault_file)
 
 
 @db_session
 def get_vault_size(vault_id: str) -> int:
-    return select(f.size for f in VaultFile if f.vault_id == vault_id).sum()
+    shard = shards.get(vault_id)
+    stats = shard.VaultStats.get(vault_id=vault_id)
+    if stats is None:
+        return compute_vault_stats(shard, vault_id)["total_bytes"]
+    return stats.total_bytes
 
 
 @db_session
-def get_vault_files(vault_id: str) -> List[VaultFileModel]:
-    files = select(
-        f
-        for f in VaultFile
-        if f.vault_id == vault_id and f.deleted is False and f.newest is True
+def get_vault_files(vault_id: str) -> List[FileRecord]:
+    shard = shards.get(vault_id)
+    rows = shard.db.select(
+        f"{RECORD_COLUMNS} FROM vault_file WHERE vault_id = $vault_id"
+        " AND deleted = 0 AND newest = 1"
     )
-    return [VaultFileModel.model_validate(f) for f in files]
+    return [file_record(row) for row in rows]
 
 
 @db_session
-def get_file(uid: int) -> Optional[VaultFileModel]:
-    file = select(f for f in VaultFile if f.uid == uid).first()
-    return None if file is None else VaultFileModel.model_validate(file)
+def get_file(vault_id: str, uid: int) -> Optional[FileRecord]:
+    # Content is read separately with iter_file_data
+    shard = shards.get(vault_id)
+    rows = shard.db.select(
+        f"{RECORD_COLUMNS} FROM vault_file"
+        " WHERE uid = $uid AND vault_id = $vault_id"
+    )
+    return file_record(rows[0]) if len(rows) > 0 else None
 
 
 @db_session
-def get_file_history(path: str) -> List[VaultFileModel]:
-    files = select(f for f in VaultFile if f.path == path).order_by(
-        desc(VaultFile.modified)
+def get_data_size(vault_id: str, file: FileRecord) -> int:
+    shard = shards.get(vault_id)
+    if file.blob is not None:
+        blob = shard.Blob.get(digest=file.blob)
+        return 0 if blob is None else blob.size
+    size = shard.db.select(
+        "length(data) FROM vault_file WHERE uid = $(file.uid)"
     )
-    return [VaultFileModel.model_validate(f) for f in files]
+    return 0 if len(size) == 0 or size[0] is None else size[0]
+
+
+def iter_file_data(
+    vault_id: str, file: FileRecord, piece_size: int
+) -> Iterator[bytes]:
+    shard = shards.get(vault_id)
+    if file.blob is not None:
+        with shard.blobs.open(file.blob) as f:
+            while True:
+                piece = f.read(piece_size)
+                if len(piece) == 0:
+                    return
+                yield piece
+
+    # Legacy rows, read the data column one piece at a time
+    offset = 1
+    while True:
+        with db_session:
+            piece = shard.db.select(
+                "substr(data, $offset, $piece_size) FROM vault_file"
+                " WHERE uid = $(file.uid)"
+            )
+        if len(piece) == 0 or piece[0] is None or len(piece[0]) == 0:
+            return
+        yield bytes(piece[0])
+        offset += piece_size
+
+
+def read_file(
+    vault_id: str, uid: int, max_size: int
+) -> Optional[Tuple[FileRecord, Optional[bytes]]]:
+    # The record of a file, with its content unless that is over max_size
+    file = get_file(vault_id, uid)
+    if file is None:
+        return None
+    if file.size == 0:
+        return file, b""
+    size = get_data_size(vault_id, file)
+    if size > max_size:
+        return file, None
+    try:
+        return file, b"".join(iter_file_data(vault_id, file, max(size, 1)))
+    except FileNotFoundError:
+        # Overwritten since the record was read and the old blob purged,
+        # read the new content instead
+        current = get_file(vault_id, uid)
+        if current is None or current.blob == file.blob:
+            raise
+        return read_file(vault_id, uid, max_size)
+
+
+def listing_page(
+    rows: List[Tuple], limit: int
+) -> Tuple[List[FileRecord], bool]:
+    # Listings fetch one row past the page to know whether there is more
+    return [file_record(row) for row in rows[:limit]], len(rows) > limit
+
+
+@db_session
+def get_file_history(
+    vault_id: str,
+    path: str,
+    last: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> Tuple[List[FileRecord], bool]:
+    # Newest first, `last` is the uid of the last item of the previous page
+    shard = shards.get(vault_id)
+    if last is None:
+        rows = shard.db.select(
+            f"{RECORD_COLUMNS} FROM vault_file"
+            " WHERE vault_id = $vault_id AND path = $path"
+            " ORDER BY modified DESC, uid DESC LIMIT $(limit + 1)"
+        )
+    else:
+        rows = shard.db.select(
+            f"{RECORD_COLUMNS} FROM vault_file"
+            " WHERE vault_id = $vault_id AND path = $path"
+            " AND (modified, uid) <"
+            " (SELECT modified, uid FROM vault_file WHERE uid = $last)"
+            " ORDER BY modified DESC, uid DESC LIMIT $(limit + 1)"
+        )
+    return listing_page(rows, limit)
 
 
 @db_session
-def get_deleted_files() -> List[VaultFileModel]:
-    files = select(
-        f for f in VaultFile if f.deleted is True and f.newest is True
+def get_deleted_files(
+    vault_id: str,
+    last: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> Tuple[List[FileRecord], bool]:
+    # Most recently created first, `last` works as in get_file_history
+    shard = shards.get(vault_id)
+    if last is None:
+        last = 2**63 - 1
+    rows = shard.db.select(
+        f"{RECORD_COLUMNS} FROM vault_file"
+        " WHERE vault_id = $vault_id AND newest = 1 AND deleted = 1"
+        " AND uid < $last ORDER BY uid DESC LIMIT $(limit + 1)"
     )
-    return [VaultFileModel.model_validate(f) for f in files]
+    return listing_page(rows, limit)
+
+
+def insert_metadata(
+    vault_file: Any, blob: Optional[Tuple[str, int]] = None
+) -> int:
+    return insert_file(vault_file, blob)[0]
 
 
 @db_session
-def insert_metadata(vault_file: Any) -> int:
+def insert_file(
+    vault_file: Any, blob: Optional[Tuple[str, int]] = None
+) -> ManifestRow:
+    # `blob` is a (digest, size) already committed to the blob store, it is
+    # attached in the same transaction so the row never exists without it
+    shard = shards.get(vault_file.vault_id)
     if vault_file.created == 0:
         vault_file.created = int(time.time()) * 1000
     if vault_file.modified == 0:
         vault_file.modified = int(time.time()) * 1000
 
-    ori_file = select(
-        f for f in VaultFile if f.path == vault_file.path and f.newest is True
-    ).first()
+    stats = vault_stats_state(shard, vault_file.vault_id)
+    ori_file = newest_file(shard, vault_file.vault_id, vault_file.path)
     if ori_file is not None:
+        count_file(stats, ori_file, -1)
         ori_file.newest = False
+        count_file(stats, ori_file, 1)
+
+    new_file = shard.VaultFile(
+        **vault_file.model_dump(), seq=next_seq(shard, vault_file.vault_id)
+    )
+    if blob is not None:
+        digest, size = blob
+        acquire_blob(shard, digest, size)
+        new_file.blob = digest
+    count_file(stats, new_file, 1)
+    # Assigns the uid, the enclosing session commits
+    flush()
+    return manifest_row(new_file)
+
+
+def duplicate_blob(shard: Shard, vault_file: Any) -> Optional[Tuple[str, int]]:
+    # A stored blob of a version with the same hash and size, the newest
+    # version of the same path first. Returns (digest, size).
+    rows = shard.db.select(
+        "vault_file.blob, blob.size FROM vault_file"
+        " JOIN blob ON blob.digest = vault_file.blob"
+        " WHERE vault_file.vault_id = $(vault_file.vault_id)"
+        " AND vault_file.hash = $(vault_file.hash)"
+        " AND vault_file.size = $(vault_file.size)"
+        " ORDER BY vault_file.path = $(vault_file.path)"
+        " AND vault_file.newest DESC LIMIT 1"
+    )
+    return rows[0] if len(rows) > 0 else None
 
-    new_file = VaultFile(**vault_file.model_dump())
-    commit()
-    return new_file.uid
+
+@db_session
+def find_duplicate_blob(vault_file: Any) -> Optional[Tuple[str, int]]:
+    return duplicate_blob(shards.get(vault_file.vault_id), vault_file)
 
 
 @db_session
-def insert_data(uid: int, data: bytes) -> None:
-    file = select(f for f in VaultFile if f.uid == uid).first()
-    file.data = data
+def insert_duplicate(vault_file: Any) -> Optional[ManifestRow]:
+    # Inserts a push whose content the vault already stores, the blob is
+    # looked up again so it cannot be purged in between. None if it was.
+    blob = duplicate_blob(shards.get(vault_file.vault_id), vault_file)
+    if blob is None:
+        return None
+    return insert_file(vault_file, blob)
+
+
+def overwrite_file(
+    vault_id: str,
+    uid: int,
+    vault_file: Any,
+    blob: Optional[Tuple[str, int]] = None,
+) -> Optional[Tuple[ManifestRow, int]]:
+    # Replaces the content of a recent version in place instead of adding a
+    # new one, used for rapid successive pushes of the same path. Returns
+    # the row and the change of the vault size, None if the version is not
+    # the newest live version of the path anymore.
+    shard = shards.get(vault_id)
+    with db_session:
+        file = shard.VaultFile.get(uid=uid)
+        if (
+            file is None
+            or not file.newest
+            or file.deleted
+            or file.vault_id != vault_id
+            or file.path != vault_file.path
+        ):
+            return None
+        if vault_file.modified == 0:
+            vault_file.modified = int(time.time()) * 1000
+
+        stats = vault_stats_state(shard, vault_id)
+        count_file(stats, file, -1)
+        previous_size, previous_blob = file.size or 0, file.blob
+        file.set(
+            hash=vault_file.hash,
+            extension=vault_file.extension,
+            size=vault_file.size,
+            modified=vault_file.modified,
+            data=None,
+            blob=None,
+            seq=next_seq(shard, vault_id),
+        )
+        if blob is not None:
+            digest, size = blob
+            acquire_blob(shard, digest, size)
+            file.blob = digest
+        count_file(stats, file, 1)
+        row = manifest_row(file)
+        orphans = release_blobs(shard, [previous_blob])
+    purge_blobs(shard, orphans)
+    return row, (vault_file.size or 0) - previous_size
+
+
+def newest_file(shard: Shard, vault_id: str, path: str) -> Any:
+    # The index of a hot vault knows the row, it is only trusted if the row
+    # is still the newest one since the index may lag behind
+    uid = vault_index.newest_uid(vault_id, path)
+    if uid is not None:
+        file = shard.VaultFile.get(uid=uid)
+        if (
+            file is not None
+            and file.newest
+            and file.vault_id == vault_id
+            and file.path == path
+        ):
+            return file
+    return select(
+        f
+        for f in shard.VaultFile
+        if f.vault_id == vault_id and f.path == path and f.newest is True
+    ).first()
+
+
+def insert_data(vault_id: str, uid: int, data: bytes) -> None:
+    digest = shards.blob_store(vault_id).put(data)
+    insert_blob(vault_id, uid=uid, digest=digest, size=len(data))
+
+
+def insert_blob(vault_id: str, uid: int, digest: str, size: int) -> None:
+    # `digest` must already be committed to the vault's blob store
+    shard = shards.get(vault_id)
+    with db_session:
+        file = select(
+            f
+            for f in shard.VaultFile
+            if f.uid == uid and f.vault_id == vault_id
+        ).first()
+        previous = file.blob
+        acquire_blob(shard, digest, size)
+        file.blob = digest
+        file.data = None
+        orphans = release_blobs(shard, [previous])
+    purge_blobs(shard, orphans)
+
+
+def move_data_to_blob_store(limit: int = 100) -> int:
+    # Moves legacy inline content out of the vault_file table in batches
+    moved = 0
+    for shard in shards.all():
+        with db_session:
+            files = select(f for f in shard.VaultFile if f.data is not None)[
+                : limit - moved
+            ]
+            for file in files:
+                digest = shard.blobs.put(file.data)
+                acquire_blob(shard, digest, len(file.data))
+                file.blob = digest
+                file.data = None
+        moved += len(files)
+        if moved >= limit:
+            break
+    return moved
 
 
 @db_session
-def delete_vault_file(path: str) -> None:
-    vault_files = select(f for f in VaultFile if f.path == path)
+def delete_vault_file(vault_id: str, path: str) -> Optional[ManifestRow]:
+    # Returns the tombstone, None if the path has no newest version
+    shard = shards.get(vault_id)
+    stats = vault_stats_state(shard, vault_id)
+    vault_files = select(
+        f for f in shard.VaultFile if f.vault_id == vault_id and f.path == path
+    )
+    tombstone = None
     for vault_file in vault_files:
+        count_file(stats, vault_file, -1)
         vault_file.deleted = True
         vault_file.is_snapshot = True
+        if vault_file.newest:
+            vault_file.seq = next_seq(shard, vault_id)
+            vault_file.deleted_at = int(time.time() * 1000)
+            tombstone = manifest_row(vault_file)
+        count_file(stats, vault_file, 1)
+    return tombstone
@@ -0,0 +1,276 @@
+import asyncio
+import bisect
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from obsync.utils.config import VAULT_INDEX_MEMORY
+
+# The columns of a ManifestRow, in order
+MANIFEST_COLUMNS = (
+    "uid",
+    "path",
+    "hash",
+    "size",
+    "created",
+    "modified",
+    "folder",
+    "deleted",
+    "seq",
+)
+ManifestRow = Tuple[int, str, str, int, int, int, bool, bool, Optional[int]]
+
+
+class VaultDelta(NamedTuple):
+    # What maintenance changed in a vault: the deleted versions as
+    # (uid, path), the change of the vault size and the compaction mark, 0
+    # unless a newest row was deleted
+    removed: Tuple[Tuple[int, str], ...] = ()
+    added: int = 0
+    compacted: int = 0
+
+    def is_empty(self) -> bool:
+        return len(self.removed) == 0 and self.added == 0
+
+
+# Rough footprint of a row and its dict entry, paths and hashes come on top
+ROW_OVERHEAD = 400
+
+
+def row_bytes(row: ManifestRow) -> int:
+    return ROW_OVERHEAD + len(row[1] or "") + len(row[2] or "")
+
+
+class VaultIndex(object):
+    # The newest version of every path of a vault, tombstones included, and
+    # the totals the size request needs. Listings sorted by uid and seq are
+    # built on first use and thrown away by the next write.
+    def __init__(
+        self,
+        rows: Iterable[ManifestRow],
+        seq: Optional[int],
+        compacted: int,
+        total_bytes: int,
+    ) -> None:
+        super().__init__()
+        self.files: Dict[str, ManifestRow] = {row[1]: row for row in rows}
+        self.seq = seq
+        self.compacted = compacted
+        self.total_bytes = total_bytes
+        self.nbytes = sum(row_bytes(row) for row in self.files.values())
+        self.by_uid: Optional[Tuple[List[int], List[ManifestRow]]] = None
+        self.by_seq: Optional[Tuple[List[int], List[ManifestRow]]] = None
+
+    def put(self, row: ManifestRow, added: int) -> None:
+        # `row` is the newest version of its path after a committed write,
+        # `added` the bytes the write added to the vault. Writes may
+        # be applied out of order, the highest seq wins.
+        self.total_bytes += added
+        current = self.files.get(row[1])
+        if current is None or (current[8] or 0) <= (row[8] or 0):
+            if current is not None:
+                self.nbytes -= row_bytes(current)
+            self.files[row[1]] = row
+            self.nbytes += row_bytes(row)
+        self.advance(row[8] or 0)
+        self.by_uid = self.by_seq = None
+
+    def apply(self, delta: VaultDelta) -> None:
+        # A newest row deleted by maintenance only goes if no write has
+        # replaced it since
+        self.total_bytes += delta.added
+        for uid, path in delta.removed:
+            current = self.files.get(path)
+            if current is not None and current[0] == uid:
+                del self.files[path]
+                self.nbytes -= row_bytes(current)
+        self.compacted = max(self.compacted, delta.compacted)
+        self.by_uid = self.by_seq = None
+
+    def advance(self, seq: int) -> None:
+        self.seq = seq if self.seq is None else max(self.seq, seq)
+
+    def newest_uid(self, path: str) -> Optional[int]:
+        row = self.files.get(path)
+        return None if row is None else row[0]
+
+    def manifest_page(
+        self, since: Optional[int], after: int, limit: int
+    ) -> Optional[List[ManifestRow]]:
+        # Same pages as get_manifest_page
+        if since is None:
+            if self.by_uid is None:
+                rows = sorted(
+                    (row for row in self.files.values() if row[7] is False),
+                    key=lambda row: row[0],
+                )
+                self.by_uid = ([row[0] for row in rows], rows)
+            keys, rows = self.by_uid
+        else:
+            if since < self.compacted:
+                return None
+            if self.by_seq is None:
+                by_seq: List[Tuple[int, ManifestRow]] = sorted(
+                    (
+                        (row[8], row)
+                        for row in self.files.values()
+                        if row[8] is not None
+                    ),
+                    key=lambda pair: pair[0],
+                )
+                self.by_seq = (
+                    [seq for seq, _ in by_seq],
+                    [row for _, row in by_seq],
+                )
+            keys, rows = self.by_seq
+        start = bisect.bisect_right(keys, after)
+        return rows[start : start + limit]
+
+
+class VaultIndexCache(object):
+    # Indexes of the vaults clients are connected to, built on connect and
+    # kept current by the writes of this worker. Vaults without clients are
+    # evicted least recently used first once the indexes take more than
+    # `max_bytes`. Writes of other workers drop the index of their vault, it
+    # is rebuilt by the next connection. Maintenance applies its delta.
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.indexes: "OrderedDict[str, VaultIndex]" = OrderedDict()
+        self.pins: Dict[str, int] = {}
+        self.loading: Dict[str, "asyncio.Future[Optional[VaultIndex]]"] = {}
+        # Vaults written to while their index was being loaded
+        self.stale: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evicted = 0
+
+    def get(self, vault_id: str) -> Optional[VaultIndex]:
+        index = self.indexes.get(vault_id)
+        if index is None:
+            self.misses += 1
+            return None
+        self.indexes.move_to_end(vault_id)
+        self.hits += 1
+        return index
+
+    async def load(
+        self,
+        vault_id: str,
+        loader: Callable[[str], Awaitable[VaultIndex]],
+    ) -> Optional[VaultIndex]:
+        # None when the cache is disabled, full or a write raced the load
+        index = self.indexes.get(vault_id)
+        if index is not None or not self.has_room():
+            return index
+        if vault_id not in self.loading:
+            self.loading[vault_id] = asyncio.ensure_future(
+                self._load(vault_id, loader)
+            )
+        return await asyncio.shield(self.loading[vault_id])
+
+    def pin(self, vault_id: str) -> None:
+        self.pins[vault_id] = self.pins.get(vault_id, 0) + 1
+
+    def unpin(self, vault_id: str) -> None:
+        pins = self.pins.get(vault_id, 0) - 1
+        if pins > 0:
+            self.pins[vault_id] = pins
+        else:
+            self.pins.pop(vault_id, None)
+            self.evict()
+
+    def put(self, vault_id: str, row: ManifestRow, added: int = 0) -> None:
+        # Called once the write of `row` has committed
+        index = self.indexes.get(vault_id)
+        if index is not None:
+            index.put(row, added)
+        self.mark_stale(vault_id)
+
+    def apply(self, vault_id: str, delta: VaultDelta) -> None:
+        # Called once the maintenance write of `delta` has committed
+        index = self.indexes.get(vault_id)
+        if index is not None:
+            index.apply(delta)
+        self.mark_stale(vault_id)
+
+    def advance(self, vault_id: str, seq: int) -> None:
+        index = self.indexes.get(vault_id)
+        if index is not None and index.seq is None:
+            # The sequence was just created, with its compaction mark
+            self.drop(vault_id)
+        elif index is not None:
+            index.advance(seq)
+        self.mark_stale(vault_id)
+
+    def drop(self, vault_id: str) -> None:
+        self.indexes.pop(vault_id, None)
+        self.mark_stale(vault_id)
+
+    def mark_stale(self, vault_id: str) -> None:
+        if vault_id in self.loading:
+            self.stale.add(vault_id)
+
+    def newest_uid(self, vault_id: str, path: str) -> Optional[int]:
+        # Read from the writer threads, a hint only since writes that have
+        # not been applied yet are missing
+        index = self.indexes.get(vault_id)
+        return None if index is None else index.newest_uid(path)
+
+    def nbytes(self) -> int:
+        return sum(index.nbytes for index in self.indexes.values())
+
+    def has_room(self) -> bool:
+        return self.max_bytes > 0 and self.nbytes() < self.max_bytes
+
+    def evict(self) -> None:
+        total = self.nbytes()
+        for vault_id in list(self.indexes):
+            if total <= self.max_bytes:
+                return
+            if vault_id in self.pins:
+                continue
+            total -= self.indexes.pop(vault_id).nbytes
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            vaults=len(self.indexes),
+            bytes=self.nbytes(),
+            hits=self.hits,
+            misses=self.misses,
+            loads=self.loads,
+            evicted=self.evicted,
+        )
+
+    async def _load(
+        self,
+        vault_id: str,
+        loader: Callable[[str], Awaitable[VaultIndex]],
+    ) -> Optional[VaultIndex]:
+        self.stale.discard(vault_id)
+        try:
+            index = await loader(vault_id)
+        finally:
+            del self.loading[vault_id]
+        self.loads += 1
+        if vault_id in self.stale:
+            self.stale.discard(vault_id)
+            return None
+        self.indexes[vault_id] = index
+        self.evict()
+        return self.indexes.get(vault_id)
+
+
+vault_index = VaultIndexCache(max_bytes=VAULT_INDEX_MEMORY)
@@ -2,7 +2,6 @@ import time
 from typing import List, Optional
 from uuid import uuid1
 
-import bcrypt
 from pony.orm import (
     db_session,
     delete,
@@ -12,6 +11,7 @@ from pydantic import BaseModel, ConfigDict
 
 from obsync.db.vault import Share, User, Vault
 from obsync.utils.config import DOMAIN_NAME
+from obsync.utils.kdf import check_password, hash_password
 from obsync.utils.scrypt import make_key_hash
 
 
@@ -50,7 +50,7 @@ class UserModel(BaseModel):
 
 @db_session
 def share_vault_invite(email: str, name: str, vault_id: str) -> ShareModel:
-    share = Share(id=uuid1(), email=email, name=name, vault_id=vault_id)
+    share = Share(uid=str(uuid1()), email=email, name=name, vault_id=vault_id)
     return ShareModel.model_validate(share)
 
 
@@ -111,14 +111,23 @@ def has_access_to_vault(vault_id: str, email: str) -> bool:
     )
 
 
-@db_session
 def new_user(name: str, email: str, password: str) -> UserModel:
+    return create_user(
+        name=name, email=email, password_hash=hash_password(password)
+    )
+
+
+@db_session
+def find_user(email: str) -> Optional[UserModel]:
+    user = User.get(email=email)
+    return None if user is None else UserModel.model_validate(user)
+
+
+@db_session
+def create_user(name: str, email: str, password_hash: str) -> UserModel:
     if User.exists(email=email):
         return UserModel.model_validate(User.get(email=email))
-    hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
-    user = User(
-        name=name, email=email, password=hash.decode("utf-8"), license=""
-    )
+    user = User(name=name, email=email, password=password_hash, license="")
     return UserModel.model_validate(user)
 
 
@@ -129,27 +138,46 @@ def user_info(email: str) -> Optional[UserModel]:
 
 
 @db_session
+def get_password_hash(email: str) -> Optional[str]:
+    user = select(u for u in User if u.email == email).first()
+    return None if user is None else user.password
+
+
 def login(email: str, password: str) -> Optional[UserModel]:
-    user_info = select(u for u in User if u.email == email).first()
-    if user_info is None:
+    hashed = get_password_hash(email)
+    if hashed is None or not check_password(password, hashed):
         return None
-    if bcrypt.checkpw(
-        password.encode("utf-8"), user_info.password.encode("utf-8")
-    ):
-        return UserModel.model_validate(user_info)
-    return None
+    return user_info(email)
 
 
-@db_session
 def new_vault(
     name: str, user_email: str, password: str, salt: str, keyhash: str
+) -> VaultModel:
+    if keyhash == "":
+        keyhash = make_key_hash(password, salt)
+    return create_vault(
+        name=name,
+        user_email=user_email,
+        password=password,
+        salt=salt,
+        keyhash=keyhash,
+    )
+
+
+@db_session
+def find_vault(name: str, user_email: str) -> Optional[VaultModel]:
+    vault = Vault.get(name=name, user_email=user_email)
+    return None if vault is None else VaultModel.model_validate(vault)
+
+
+@db_session
+def create_vault(
+    name: str, user_email: str, password: str, salt: str, keyhash: str
 ) -> VaultModel:
     if Vault.exists(name=name, user_email=user_email):
         return VaultModel.model_validate(
             Vault.get(name=name, user_email=user_email)
         )
-    if keyhash == "":
-        keyhash = make_key_hash(password, salt)
 
     vault = Vault(
         id=str(uuid1()),
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from obsync.utils import fastjson
+from obsync.utils.config import BUS_DB, BUS_POLL_INTERVAL, CHANNEL_BUS
+from obsync.utils.logger import get_logger
+
+Handler = Callable[[str, Dict], Awaitable[None]]
+
+logger = get_logger()
+
+
+class ChannelBus(object):
+    # Carries vault events between worker processes. Subscribers receive
+    # every published event once, including the ones of their own worker.
+    # Remote subscribers only receive the events of the other workers.
+    def __init__(self) -> None:
+        super().__init__()
+        self.handlers: List[Handler] = []
+        self.remote_handlers: List[Handler] = []
+
+    def subscribe(self, handler: Handler) -> None:
+        self.handlers.append(handler)
+
+    def subscribe_remote(self, handler: Handler) -> None:
+        self.remote_handlers.append(handler)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, vault_id: str, message: Dict) -> None:
+        raise NotImplementedError
+
+    async def deliver(
+        self, vault_id: str, message: Dict, remote: bool = False
+    ) -> None:
+        handlers = self.handlers
+        if remote:
+            handlers = handlers + self.remote_handlers
+        for handler in handlers:
+            try:
+                await handler(vault_id, message)
+            except Exception:
+                logger.exception("Channel bus handler failed")
+
+
+class LocalBus(ChannelBus):
+    # Single process only, also used as the fake in tests
+    def __init__(self) -> None:
+        super().__init__()
+        self.published: List[Tuple[str, Dict]] = []
+
+    async def publish(self, vault_id: str, message: Dict) -> None:
+        self.published.append((vault_id, message))
+        await self.deliver(vault_id, message)
+
+
+class SQLiteBus(ChannelBus):
+    # Workers append events to a shared SQLite file and poll it for the
+    # events of the other workers
+    def __init__(
+        self, filename: str, poll_interval: float, retention: float = 60.0
+    ) -> None:
+        super().__init__()
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self.con: Optional[sqlite3.Connection] = None
+        self.last_id = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._open)
+        self.task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    async def publish(self, vault_id: str, message: Dict) -> None:
+        await self.deliver(vault_id, message)
+        await asyncio.to_thread(
+            self._insert, vault_id, fastjson.dumps(message)
+        )
+
+    def _open(self) -> None:
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        self.con = sqlite3.connect(
+            self.filename,
+            timeout=5,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS event ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " origin TEXT NOT NULL,"
+            " vault_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        # Only events published after this worker started are delivered
+        self.last_id = self.con.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM event"
+        ).fetchone()[0]
+
+    def connection(self) -> sqlite3.Connection:
+        if self.con is None:
+            raise RuntimeError("Channel bus is not started")
+        return self.con
+
+    def _insert(self, vault_id: str, payload: str) -> None:
+        self.connection().execute(
+            "INSERT INTO event (origin, vault_id, payload, created)"
+            " VALUES (?, ?, ?, ?)",
+            (self.origin, vault_id, payload, time.time()),
+        )
+
+    def _fetch(self) -> List[Tuple[int, str, str, str]]:
+        rows = (
+            self.connection()
+            .execute(
+                "SELECT id, origin, vault_id, payload FROM event"
+                " WHERE id > ? ORDER BY id",
+                (self.last_id,),
+            )
+            .fetchall()
+        )
+        return rows
+
+    def _prune(self) -> None:
+        self.connection().execute(
+            "DELETE FROM event WHERE created < ?",
+            (time.time() - self.retention,),
+        )
+
+    async def _poll(self) -> None:
+        last_prune = time.monotonic()
+        while True:
+            try:
+                rows = await asyncio.to_thread(self._fetch)
+                for id, origin, vault_id, payload in rows:
+                    self.last_id = id
+                    if origin != self.origin:
+                        await self.deliver(
+                            vault_id, fastjson.loads(payload), remote=True
+                        )
+                if time.monotonic() - last_prune > self.retention:
+                    await asyncio.to_thread(self._prune)
+                    last_prune = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Channel bus poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+def create_channel_bus(kind: str = CHANNEL_BUS) -> ChannelBus:
+    if kind == "sqlite":
+        return SQLiteBus(BUS_DB, poll_interval=BUS_POLL_INTERVAL)
+    if kind == "local":
+        return LocalBus()
+    raise ValueError("Unknown channel bus: {}".format(kind))
+
+
+channel_bus = create_channel_bus()
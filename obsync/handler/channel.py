@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.websockets import WebSocket
+
+from obsync.utils import fastjson
+from obsync.utils.config import CLIENT_QUEUE_SIZE
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+
+class FanoutStats(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.broadcasts = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_delivery(self, latency: float) -> None:
+        self.delivered += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            broadcasts=self.broadcasts,
+            delivered=self.delivered,
+            evicted=self.evicted,
+            avg_latency_ms=(
+                0.0
+                if self.delivered == 0
+                else self.total_latency * 1000 / self.delivered
+            ),
+            max_latency_ms=self.max_latency * 1000,
+        )
+
+
+class ClientSender(object):
+    # Owns the outbound queue of one client, drained by its own task so a
+    # slow client only delays itself
+    def __init__(
+        self, ws: WebSocket, max_queue: int, stats: FanoutStats
+    ) -> None:
+        super().__init__()
+        self.ws = ws
+        self.stats = stats
+        # Replies to the client itself are queued without a timestamp, they
+        # are not counted as broadcast deliveries
+        self.queue: "asyncio.Queue[Tuple[str, Optional[float]]]" = (
+            asyncio.Queue(maxsize=max_queue)
+        )
+        self.task: Optional[asyncio.Task] = asyncio.create_task(self._drain())
+
+    def offer(self, frame: str, enqueued: Optional[float]) -> bool:
+        try:
+            self.queue.put_nowait((frame, enqueued))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _drain(self) -> None:
+        try:
+            while True:
+                frame, enqueued = await self.queue.get()
+                await self.ws.send_text(frame)
+                if enqueued is not None:
+                    self.stats.record_delivery(time.perf_counter() - enqueued)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The connection is gone, its handler cleans up on disconnect
+            self.task = None
+
+
+class ChannelManager(object):
+    def __init__(
+        self,
+        max_queue: int = CLIENT_QUEUE_SIZE,
+        stats: Optional[FanoutStats] = None,
+    ) -> None:
+        super().__init__()
+        self.max_queue = max_queue
+        self.clients: Dict[WebSocket, ClientSender] = {}
+        # Channels come and go with their clients, a shared stats object
+        # keeps counting across them
+        self.stats = FanoutStats() if stats is None else stats
+
+    def add_client(self, ws: WebSocket) -> None:
+        if ws not in self.clients:
+            self.clients[ws] = ClientSender(ws, self.max_queue, self.stats)
+
+    def remove_client(self, ws: WebSocket) -> None:
+        sender = self.clients.pop(ws, None)
+        if sender is not None:
+            sender.close()
+
+    def is_empty(self) -> bool:
+        return len(self.clients) == 0
+
+    async def broadcast(self, message: Dict) -> None:
+        # Serialized once, then handed to every client queue without waiting
+        frame = fastjson.dumps(message)
+        enqueued = time.perf_counter()
+        self.stats.broadcasts += 1
+        for ws, sender in list(self.clients.items()):
+            if not sender.offer(frame, enqueued):
+                self.evict(ws)
+
+    def send(self, ws: WebSocket, frame: str) -> bool:
+        # Sent after the broadcasts already queued for the client, False
+        # if it is not in the channel
+        sender = self.clients.get(ws)
+        if sender is None:
+            return False
+        if not sender.offer(frame, None):
+            self.evict(ws)
+        return True
+
+    def evict(self, ws: WebSocket) -> None:
+        logger.info("Evicting client with a full send queue")
+        self.stats.evicted += 1
+        self.remove_client(ws)
+        asyncio.create_task(self._close(ws))
+
+    async def _close(self, ws: WebSocket) -> None:
+        try:
+            await ws.close(code=1013)
+        except Exception:
+            pass
@@ -0,0 +1,130 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from obsync.utils.logger import get_logger
+
+Publish = Callable[[str, Dict], Awaitable[None]]
+
+logger = get_logger()
+
+
+class PathState(object):
+    def __init__(self) -> None:
+        super().__init__()
+        # The version later pushes of `source` overwrite until the window
+        # since it was created ends
+        self.uid: Optional[int] = None
+        self.source: Any = None
+        self.created = 0.0
+        self.published = -math.inf
+        # Latest broadcast held back until the window since `published` ends
+        self.pending: Optional[Dict] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.touched = 0.0
+
+
+class PushDebouncer(object):
+    # Coalesces the pushes a client sends every few seconds while a note is
+    # edited. A push within `window` seconds of the version the same source
+    # created overwrites it instead of adding a version, and broadcasts of
+    # a path are limited to one per window: the first one is sent at once,
+    # the later ones are replaced by a single broadcast of the latest state
+    # at the end of the window. A non-positive window disables both.
+    def __init__(self, window: float, publish: Publish) -> None:
+        super().__init__()
+        self.window = window
+        self.publish = publish
+        self.paths: "OrderedDict[Tuple[str, str], PathState]" = OrderedDict()
+        self.tasks: Set[asyncio.Task] = set()
+
+    def target(self, vault_id: str, path: str, source: Any) -> Optional[int]:
+        state = self.paths.get((vault_id, path))
+        if state is None or state.uid is None or state.source is not source:
+            return None
+        if time.monotonic() - state.created >= self.window:
+            return None
+        return state.uid
+
+    def pushed(self, vault_id: str, path: str, source: Any, uid: int) -> None:
+        # Records the version a push wrote, the window of an overwritten
+        # version keeps running
+        if self.window <= 0:
+            return
+        state = self.touch(vault_id, path)
+        if state.uid != uid or state.source is not source:
+            state.uid, state.source = uid, source
+            state.created = state.touched
+
+    async def broadcast(self, vault_id: str, path: str, message: Dict) -> None:
+        if self.window <= 0 or message.get("deleted"):
+            self.cancel(vault_id, path)
+            await self.publish(vault_id, message)
+            return
+        state = self.touch(vault_id, path)
+        delay = state.published + self.window - state.touched
+        if delay <= 0:
+            self.drop_pending(state)
+            state.published = state.touched
+            await self.publish(vault_id, message)
+            return
+        state.pending = message
+        if state.timer is None:
+            state.timer = asyncio.get_running_loop().call_later(
+                delay, self.fire, vault_id, path
+            )
+
+    def cancel(self, vault_id: str, path: str) -> None:
+        # The path was deleted or restored, what was held back or pushed
+        # before is outdated
+        state = self.paths.pop((vault_id, path), None)
+        if state is not None:
+            self.drop_pending(state)
+
+    def drop_pending(self, state: PathState) -> None:
+        state.pending = None
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+
+    def fire(self, vault_id: str, path: str) -> None:
+        task = asyncio.create_task(self.publish_pending(vault_id, path))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def publish_pending(self, vault_id: str, path: str) -> None:
+        state = self.paths.get((vault_id, path))
+        if state is None or state.pending is None:
+            return
+        message = state.pending
+        self.drop_pending(state)
+        state.published = time.monotonic()
+        try:
+            await self.publish(vault_id, message)
+        except Exception:
+            logger.exception("Held back broadcast failed")
+
+    async def flush(self) -> None:
+        # Sends everything held back, on shutdown
+        for vault_id, path in list(self.paths):
+            await self.publish_pending(vault_id, path)
+        if len(self.tasks) > 0:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def touch(self, vault_id: str, path: str) -> PathState:
+        now = time.monotonic()
+        # States are ordered by their last use, expired ones are dropped
+        while len(self.paths) > 0:
+            key, oldest = next(iter(self.paths.items()))
+            if oldest.timer is not None or now - oldest.touched < self.window:
+                break
+            del self.paths[key]
+        state = self.paths.get((vault_id, path))
+        if state is None:
+            state = self.paths[(vault_id, path)] = PathState()
+        else:
+            self.paths.move_to_end((vault_id, path))
+        state.touched = now
+        return state
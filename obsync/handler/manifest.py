@@ -0,0 +1,97 @@
+import asyncio
+from typing import List, Optional, Set, cast
+
+from fastapi.websockets import WebSocket
+
+from obsync.db.aio import get_manifest_page, prewarm_files
+from obsync.db.blob_cache import blob_cache
+from obsync.db.vault_files_schema import ManifestRow
+from obsync.utils import fastjson
+from obsync.utils.config import BLOB_CACHE_PREWARM, MANIFEST_BATCH_SIZE
+
+# Keeps prewarming tasks referenced until they are done
+prewarming: Set[asyncio.Task] = set()
+
+
+def prewarm(vault_id: str, uids: List[int]) -> None:
+    # Most recent first, the files a client pulls after its manifest
+    if len(uids) == 0:
+        return
+    task = asyncio.ensure_future(prewarm_files(vault_id, uids[::-1]))
+    prewarming.add(task)
+    task.add_done_callback(prewarming.discard)
+
+
+def encode_push(row: ManifestRow) -> str:
+    uid, path, hash, size, created, modified, folder, deleted, _ = row
+    return fastjson.dumps(
+        {
+            "op": "push",
+            "path": path,
+            "hash": hash,
+            "size": size,
+            "ctime": created,
+            "mtime": modified,
+            "folder": folder,
+            "deleted": deleted,
+            "device": "insignificantv5",
+            "uid": uid,
+        }
+    )
+
+
+async def send_manifest(
+    websocket: WebSocket,
+    vault_id: str,
+    since: Optional[int],
+    batch_size: int = MANIFEST_BATCH_SIZE,
+    prewarm_cache: bool = BLOB_CACHE_PREWARM,
+) -> int:
+    # Pages are read while the previous page is being written to the socket
+    sent = 0
+    listed: List[int] = []
+    after = 0 if since is None else since
+    page = asyncio.ensure_future(
+        get_manifest_page(vault_id, since, after, batch_size)
+    )
+    while True:
+        rows: Optional[List[ManifestRow]] = await page
+        if rows is None:
+            # The change log was compacted, send the full manifest instead
+            since, after = None, 0
+            page = asyncio.ensure_future(
+                get_manifest_page(vault_id, since, after, batch_size)
+            )
+            continue
+        if len(rows) == 0:
+            break
+
+        if since is None:
+            after = rows[-1][0]
+        else:
+            # Rows of the change log always have a seq
+            after = cast(int, rows[-1][8])
+        if len(rows) == batch_size:
+            page = asyncio.ensure_future(
+                get_manifest_page(vault_id, since, after, batch_size)
+            )
+
+        # Every push is a message of its own to the client and ASGI sends one
+        # message per call, so frames cannot be merged. A send only waits
+        # while the socket is backed up.
+        frames = [encode_push(row) for row in rows]
+        for frame in frames:
+            await websocket.send_text(frame)
+        sent += len(frames)
+        if prewarm_cache:
+            listed.extend(
+                row[0]
+                for row in rows
+                if not row[7] and blob_cache.cacheable(row[3] or 0)
+            )
+
+        if len(rows) < batch_size:
+            break
+    if prewarm_cache:
+        prewarm(vault_id, listed)
+    return sent
@@ -0,0 +1,101 @@
+from typing import Annotated, Any, Dict, Literal, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+
+from obsync.utils import fastjson
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class SizeRequest(BaseModel):
+    op: Literal["size"]
+
+
+class PullRequest(BaseModel):
+    op: Literal["pull"]
+    uid: Optional[int] = None
+
+
+class PushRequest(BaseModel):
+    # Extra fields such as the device name are relayed to the other clients
+    model_config = ConfigDict(extra="allow")
+
+    op: Literal["push"]
+    path: str
+    extension: str = ""
+    hash: str = ""
+    ctime: int = 0
+    mtime: int = 0
+    folder: bool = False
+    deleted: bool = False
+    size: int = 0
+    pieces: int = 0
+
+
+class HistoryRequest(BaseModel):
+    op: Literal["history"]
+    path: str
+    # uid of the last item the client already has
+    last: Optional[int] = None
+
+
+class DeletedRequest(BaseModel):
+    op: Literal["deleted"]
+    last: Optional[int] = None
+
+
+class RestoreRequest(BaseModel):
+    op: Literal["restore"]
+    uid: Optional[int] = None
+
+
+class PingRequest(BaseModel):
+    op: Literal["ping"]
+
+
+Request = Annotated[
+    Union[
+        SizeRequest,
+        PullRequest,
+        PushRequest,
+        HistoryRequest,
+        DeletedRequest,
+        RestoreRequest,
+        PingRequest,
+    ],
+    Field(discriminator="op"),
+]
+request_adapter: TypeAdapter[Request] = TypeAdapter(Request)
+
+UNKNOWN_OP_ERRORS = ("union_tag_invalid", "union_tag_not_found")
+
+
+def decode(frame: Union[str, bytes]) -> Optional[Request]:
+    # Parses and validates in one pass, None for ops the server does not
+    # know about
+    try:
+        return request_adapter.validate_json(frame)
+    except ValidationError as e:
+        errors = e.errors()
+        if errors[0]["type"] in UNKNOWN_OP_ERRORS:
+            return None
+        loc = ".".join(str(part) for part in errors[0]["loc"][1:])
+        detail = (
+            errors[0]["msg"] if loc == "" else f"{loc}: {errors[0]['msg']}"
+        )
+        raise ProtocolError(f"Invalid message, {detail}")
+
+
+def encode(message: Dict[str, Any]) -> str:
+    return fastjson.dumps(message)
+
+
+# Replies that never change are encoded once
+OK = encode({"op": "ok"})
+RES_OK = encode({"res": "ok"})
+NEXT = encode({"res": "next"})
+PONG = encode({"op": "pong"})
+ERROR = encode({"error": "error"})
+UID_REQUIRED = encode({"error": "UID is required"})
@@ -0,0 +1,32 @@
+from typing import Any, Dict
+
+from obsync.db.blob_cache import blob_cache
+from obsync.db.coalescer import write_coalescer
+from obsync.db.compaction import compaction_scheduler
+from obsync.db.executor import db_executor
+from obsync.db.shards import shards
+from obsync.db.vault_index import vault_index
+from obsync.handler.websocket import fanout_stats
+from obsync.utils import fastjson
+from obsync.utils.kdf import kdf_pool
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+
+def worker_stats() -> Dict[str, Any]:
+    # Counters of this worker process only
+    return dict(
+        db=db_executor.stats(),
+        coalescer=write_coalescer.stats(),
+        shards=shards.stats(),
+        vault_index=vault_index.stats(),
+        blob_cache=blob_cache.stats(),
+        compaction=compaction_scheduler.to_dict(),
+        fanout=fanout_stats.to_dict(),
+        kdf=kdf_pool.stats(),
+    )
+
+
+async def log_worker_stats() -> None:
+    logger.info(f"Worker stats: {fastjson.dumps(worker_stats())}")
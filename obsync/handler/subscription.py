@@ -4,6 +4,8 @@ from fastapi import APIRouter
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
 
+from obsync.handler.utils import FastJSONResponse
+
 
 class SubscriptionHandler(object):
     def __init__(self) -> None:
@@ -14,7 +16,7 @@ class SubscriptionHandler(object):
         )
 
     async def list_subscription(self, request: Request) -> JSONResponse:
-        return JSONResponse(
+        return FastJSONResponse(
             content=dict(
                 business="",
                 publish="",
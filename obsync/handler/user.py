@@ -5,11 +5,65 @@ import jwt
 from fastapi import APIRouter
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ConfigDict, ValidationError
-
-from obsync.db.vault_schema import login, new_user, user_info
-from obsync.handler.utils import get_jwt_email
+from pydantic import BaseModel, Field, ValidationError
+
+from obsync.db.aio import login, new_user, user_info
+from obsync.handler.utils import (
+    FastJSONResponse,
+    get_jwt_email,
+    validation_errors,
+)
 from obsync.utils.config import SIGNUP_KEY, secret
+from obsync.utils.kdf import KDFBusyError
+
+
+def license_expiry() -> int:
+    return int(time.time()) * 1000 + (24 * 365 * 60 * 60 * 1000)
+
+
+class SignInReq(BaseModel):
+    email: str
+    password: str
+
+
+class SignInRes(BaseModel):
+    email: str
+    license: str
+    name: str
+    token: str
+
+
+class UserInfoReq(BaseModel):
+    token: str
+
+
+class DiscountStatus(BaseModel):
+    status: str = "approved"
+    expiry_ts: int = Field(default_factory=license_expiry)
+    type: str = "education"
+
+
+class UserInfoRes(BaseModel):
+    uid: str
+    email: str
+    name: str
+    payment: str = ""
+    license: str = ""
+    credit: int = 0
+    mfa: bool = False
+    discount: DiscountStatus = Field(default_factory=DiscountStatus)
+
+
+class SignUpReq(BaseModel):
+    email: str
+    password: str
+    fullname: str
+    signup_key: str
+
+
+class SignUpRes(BaseModel):
+    email: str
+    name: str
 
 
 class UserHandler(object):
@@ -22,38 +76,28 @@ class UserHandler(object):
         self.router.add_route("/info", self.user_info, methods=["POST"])
 
     async def sign_in(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            email: str
-            password: str
-
-        class Res(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            email: str
-            license: str
-            name: str
-            token: str
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = SignInReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content={"error": e}, status_code=400)
+            return FastJSONResponse(
+                content={"error": validation_errors(e)}, status_code=400
+            )
 
-        user_info = login(email=req.email, password=req.password)
+        try:
+            user_info = await login(email=req.email, password=req.password)
+        except KDFBusyError as e:
+            return FastJSONResponse(content={"error": str(e)}, status_code=503)
         if user_info is None:
             print("Invalid password")
-            return JSONResponse(
+            return FastJSONResponse(
                 content={"error": "Invalid password or email"},
                 status_code=200,
             )
 
         payload = {"email": user_info.email}
         token = jwt.encode(payload, secret, algorithm="HS256")
-        return JSONResponse(
-            content=Res(
+        return FastJSONResponse(
+            content=SignInRes(
                 email=user_info.email,
                 license=user_info.license,
                 name=user_info.name,
@@ -63,49 +107,25 @@ class UserHandler(object):
         )
 
     async def user_info(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            token: str
-
-        class Res(BaseModel):
-            class status(BaseModel):
-                model_config = ConfigDict(from_attributes=True)
-                status: str = "approved"
-                expiry_ts: int = int(time.time()) * 1000 + (
-                    24 * 365 * 60 * 60 * 1000
-                )
-                type: str = "education"
-
-            model_config = ConfigDict(from_attributes=True)
-
-            uid: str
-            email: str
-            name: str
-            payment: str = ""
-            license: str = ""
-            credit: int = 0
-            mfa: bool = False
-            discount: status = status()
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = UserInfoReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content={"error": e}, status_code=400)
+            return FastJSONResponse(
+                content={"error": validation_errors(e)}, status_code=400
+            )
         email = get_jwt_email(jwt_string=req.token, secret=secret)
         if email is None:
-            return JSONResponse(
+            return FastJSONResponse(
                 content={"error": "not logged in"}, status_code=200
             )
-        user = user_info(email=email)
+        user = await user_info(email=email)
         if user is None:
-            return JSONResponse(
+            return FastJSONResponse(
                 content={"error": "not logged in"}, status_code=200
             )
 
-        return JSONResponse(
-            content=Res(
+        return FastJSONResponse(
+            content=UserInfoRes(
                 uid=str(uuid1()),
                 email=email,
                 name=user.name,
@@ -114,41 +134,33 @@ class UserHandler(object):
         )
 
     async def sign_up(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            email: str
-            password: str
-            fullname: str
-            signup_key: str
-
-        class Res(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            email: str
-            name: str
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = SignUpReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content=e, status_code=400)
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
 
         if SIGNUP_KEY is not None and req.signup_key != SIGNUP_KEY:
-            return JSONResponse(
+            return FastJSONResponse(
                 content={"error": "Invalid signup key"}, status_code=400
             )
 
-        user_model = new_user(
-            name=req.fullname, email=req.email, password=req.password.strip()
-        )
+        try:
+            user_model = await new_user(
+                name=req.fullname,
+                email=req.email,
+                password=req.password.strip(),
+            )
+        except KDFBusyError as e:
+            return FastJSONResponse(content={"error": str(e)}, status_code=503)
         if user_model is None:
-            return JSONResponse(
+            return FastJSONResponse(
                 content={"error": "not sign up"}, status_code=500
             )
 
-        return JSONResponse(
-            content=Res(
+        return FastJSONResponse(
+            content=SignUpRes(
                 email=req.email,
                 name=req.fullname,
             ).model_dump(),
@@ -156,4 +168,4 @@ class UserHandler(object):
         )
 
     async def sign_out(self, _: Request) -> JSONResponse:
-        return JSONResponse(content={}, status_code=200)
+        return FastJSONResponse(content={}, status_code=200)
@@ -1,12 +1,35 @@
 import random
 import string
+from typing import Any, Dict, List
 
 import jwt
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+
+from obsync.utils import fastjson
+from obsync.utils.cache import MISSING, TTLCache
+from obsync.utils.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+# (token, secret) -> email, only successfully decoded tokens are cached
+token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return fastjson.dumpb(content)
+
+
+def validation_errors(e: ValidationError) -> List[Dict[str, Any]]:
+    # e.errors() may hold exceptions, the JSON form is always serializable
+    return fastjson.loads(e.json(include_url=False, include_input=False))
 
 
 def get_jwt_email(jwt_string: str, secret: bytes) -> str:
-    token = jwt.decode(jwt=jwt_string, key=secret, algorithms=["HS256"])
-    claims = token.get("email", None)
+    claims = token_cache.get((jwt_string, secret))
+    if claims is MISSING:
+        token = jwt.decode(jwt=jwt_string, key=secret, algorithms=["HS256"])
+        claims = token.get("email", None)
+        token_cache.set((jwt_string, secret), claims)
     return claims
 
 
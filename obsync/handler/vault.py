@@ -3,19 +3,69 @@ from typing import List, Optional
 from fastapi import APIRouter
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
-from obsync.db.vault_schema import (
-    VaultModel,
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+from obsync.db.aio import (
     delete_vault,
     get_shared_vaults,
     get_vault,
+    get_vault_stats,
     get_vaults,
     has_access_to_vault,
     new_vault,
     user_info,
 )
-from obsync.handler.utils import generate_password, get_jwt_email
+from obsync.db.vault_schema import VaultModel
+from obsync.handler.utils import (
+    FastJSONResponse,
+    generate_password,
+    get_jwt_email,
+    validation_errors,
+)
 from obsync.utils.config import secret
-from pydantic import BaseModel, ConfigDict, ValidationError
+from obsync.utils.kdf import KDFBusyError
+
+
+class ListVaultReq(BaseModel):
+    token: str
+
+
+class ListVaultRes(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    shared: List[VaultModel]
+    vaults: List[VaultModel]
+    limit: int
+
+
+class CreateVaultReq(BaseModel):
+    keyhash: Optional[str] = ""
+    name: str
+    salt: Optional[str] = ""
+    token: str
+
+
+class DeleteVaultReq(BaseModel):
+    token: str
+    vault_uid: str
+
+
+class AccessVaultReq(BaseModel):
+    host: str
+    keyhash: str
+    token: str
+    vault_uid: str
+
+
+class VaultStatsReq(BaseModel):
+    token: str
+    vault_uid: str
+
+
+class AccessVaultRes(BaseModel):
+    allowed: bool = True
+    email: str
+    name: str
 
 
 class VaultHandler(object):
@@ -26,40 +76,30 @@ class VaultHandler(object):
         self.router.add_route("/create", self.create_vault, methods=["POST"])
         self.router.add_route("/delete", self.delete_vault, methods=["POST"])
         self.router.add_route("/access", self.access_vault, methods=["POST"])
+        self.router.add_route("/stats", self.vault_stats, methods=["POST"])
 
     async def list_vault(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            token: str
-
-        class Res(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            shared: List[VaultModel]
-            vaults: List[VaultModel]
-            limit: int
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = ListVaultReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content=e, status_code=400)
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
 
         email = get_jwt_email(jwt_string=req.token, secret=secret)
         if email is None:
-            return JSONResponse(content="Invalid token", status_code=401)
+            return FastJSONResponse(content="Invalid token", status_code=401)
 
-        vaults = get_vaults(email=email)
+        vaults = await get_vaults(email=email)
         if vaults is None:
-            return JSONResponse(content="Invalid email", status_code=500)
+            return FastJSONResponse(content="Invalid email", status_code=500)
 
-        shared = get_shared_vaults(email=email)
+        shared = await get_shared_vaults(email=email)
         if shared is None:
-            return JSONResponse(content="Invalid email", status_code=500)
+            return FastJSONResponse(content="Invalid email", status_code=500)
 
-        return JSONResponse(
-            content=Res(
+        return FastJSONResponse(
+            content=ListVaultRes(
                 shared=shared,
                 vaults=vaults,
                 limit=100,
@@ -68,23 +108,16 @@ class VaultHandler(object):
         )
 
     async def create_vault(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            keyhash: Optional[str] = ""
-            name: str
-            salt: Optional[str] = ""
-            token: str
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = CreateVaultReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content=e, status_code=400)
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
 
         email = get_jwt_email(jwt_string=req.token, secret=secret)
         if email is None:
-            return JSONResponse(content="Invalid token", status_code=401)
+            return FastJSONResponse(content="Invalid token", status_code=401)
 
         password = ""
         salt = ""
@@ -109,92 +142,96 @@ class VaultHandler(object):
             if req.keyhash != "":
                 keyhash = req.keyhash
             else:
-                return JSONResponse(
+                return FastJSONResponse(
                     content="keyhash must be provided if salt is provided",
                     status_code=400,
                 )
 
-        vault = new_vault(
-            name=req.name,
-            user_email=email,
-            password=password,
-            salt=salt,
-            keyhash=keyhash,
-        )
+        try:
+            vault = await new_vault(
+                name=req.name,
+                user_email=email,
+                password=password,
+                salt=salt,
+                keyhash=keyhash,
+            )
+        except KDFBusyError as e:
+            return FastJSONResponse(content=str(e), status_code=503)
         if vault is None:
-            return JSONResponse(content="Invalid vault", status_code=500)
+            return FastJSONResponse(content="Invalid vault", status_code=500)
 
-        return JSONResponse(
+        return FastJSONResponse(
             content=vault.model_dump(),
             status_code=200,
         )
 
     async def delete_vault(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            token: str
-            vault_uid: str
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = DeleteVaultReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content=e, status_code=400)
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
 
         email = get_jwt_email(jwt_string=req.token, secret=secret)
         if email is None:
-            return JSONResponse(content="Invalid token", status_code=401)
+            return FastJSONResponse(content="Invalid token", status_code=401)
 
-        vault_deleted = delete_vault(id=req.vault_uid, email=email)
+        vault_deleted = await delete_vault(id=req.vault_uid, email=email)
         if vault_deleted > 0:
-            return JSONResponse(content={}, status_code=200)
+            return FastJSONResponse(content={}, status_code=200)
         else:
-            return JSONResponse(content="Delete vault error", status_code=500)
+            return FastJSONResponse(
+                content="Delete vault error", status_code=500
+            )
 
     async def access_vault(self, request: Request) -> JSONResponse:
-        class Req(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            host: str
-            keyhash: str
-            token: str
-            vault_uid: str
-
-        class Res(BaseModel):
-            model_config = ConfigDict(from_attributes=True)
-
-            allowed: bool = True
-            email: str
-            name: str
-
-        req_json = await request.json()
         try:
-            req = Req.model_validate(req_json)
+            req = AccessVaultReq.model_validate_json(await request.body())
         except ValidationError as e:
-            return JSONResponse(content=e, status_code=400)
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
 
         email = get_jwt_email(jwt_string=req.token, secret=secret)
         if email is None:
-            return JSONResponse(content="Invalid token", status_code=401)
+            return FastJSONResponse(content="Invalid token", status_code=401)
 
-        if not has_access_to_vault(vault_id=req.vault_uid, email=email):
-            return JSONResponse(
+        if not await has_access_to_vault(vault_id=req.vault_uid, email=email):
+            return FastJSONResponse(
                 content="You do not have access to this vault", status_code=401
             )
 
-        vault = get_vault(id=req.vault_uid, keyhash=req.keyhash)
+        vault = await get_vault(id=req.vault_uid, keyhash=req.keyhash)
         if vault is None:
-            return JSONResponse(content="Error vault", status_code=500)
+            return FastJSONResponse(content="Error vault", status_code=500)
 
-        user = user_info(email=email)
+        user = await user_info(email=email)
         if user is None:
-            return JSONResponse(content="Error user info", status_code=500)
+            return FastJSONResponse(content="Error user info", status_code=500)
 
-        return JSONResponse(
-            content=Res(
-                email=email,
-                name=user.name,
-            ).model_dump_json(),
+        return FastJSONResponse(
+            content=AccessVaultRes(email=email, name=user.name).model_dump(),
             status_code=200,
         )
+
+    async def vault_stats(self, request: Request) -> JSONResponse:
+        # Sizes and counts of the versions the vault stores
+        try:
+            req = VaultStatsReq.model_validate_json(await request.body())
+        except ValidationError as e:
+            return FastJSONResponse(
+                content=validation_errors(e), status_code=400
+            )
+
+        email = get_jwt_email(jwt_string=req.token, secret=secret)
+        if email is None:
+            return FastJSONResponse(content="Invalid token", status_code=401)
+
+        if not await has_access_to_vault(vault_id=req.vault_uid, email=email):
+            return FastJSONResponse(
+                content="You do not have access to this vault", status_code=401
+            )
+
+        stats = await get_vault_stats(req.vault_uid)
+        return FastJSONResponse(content=stats.model_dump(), status_code=200)
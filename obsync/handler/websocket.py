@@ -1,272 +1,519 @@
+import asyncio
 import json
-from typing import Dict, Optional, Set, Tuple
+import math
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 from fastapi.websockets import WebSocket, WebSocketDisconnect, WebSocketState
-from pydantic import BaseModel, ConfigDict, Field, create_model
 
-from obsync.db.vault_files_schema import (
+from obsync.db.access_cache import (
+    apply_vault_delta,
+    invalidate_vault,
+    on_vault_changed,
+    on_vault_maintained,
+)
+from obsync.db.aio import (
+    advance_vault_seq,
     delete_vault_file,
+    find_duplicate_blob,
+    get_data_size,
     get_deleted_files,
-    get_file,
     get_file_history,
-    get_vault_files,
+    get_vault,
+    get_vault_seq,
     get_vault_size,
-    insert_data,
+    has_access_to_vault,
+    insert_duplicate,
     insert_metadata,
+    iter_file_data,
+    load_vault_index,
+    overwrite_file,
+    read_file,
     restore_file,
-    snapshot,
-)
-from obsync.db.vault_schema import (
-    VaultModel,
-    get_vault,
-    has_access_to_vault,
     set_vault_version,
 )
+from obsync.db.blob_cache import CachedFile, blob_cache
+from obsync.db.blob_store import BlobMissingError, BlobTooLargeError
+from obsync.db.compaction import compaction_scheduler
+from obsync.db.shards import shards
+from obsync.db.vault_files_schema import VaultMetaFileModel
+from obsync.db.vault_index import VaultDelta, vault_index
+from obsync.db.vault_schema import VaultModel
+from obsync.handler import protocol
+from obsync.handler.bus import channel_bus
+from obsync.handler.channel import ChannelManager, FanoutStats
+from obsync.handler.debounce import PushDebouncer
+from obsync.handler.manifest import send_manifest
+from obsync.handler.protocol import (
+    DeletedRequest,
+    HistoryRequest,
+    PingRequest,
+    PullRequest,
+    PushRequest,
+    RestoreRequest,
+    SizeRequest,
+)
 from obsync.handler.utils import get_jwt_email
-from obsync.utils.config import MAX_STORAGE_BYTES, secret
+from obsync.utils.config import (
+    MAX_FILE_BYTES,
+    MAX_STORAGE_BYTES,
+    PULL_PIECE_SIZE,
+    PUSH_COALESCE_WINDOW,
+    PUSH_MEMORY_THRESHOLD,
+    secret,
+)
 from obsync.utils.logger import get_logger
 
+Handler = Callable[[WebSocket, str, Any], Awaitable[bool]]
 
-channels = {}
+# Bus op carrying access cache invalidations between workers
+INVALIDATE = "invalidate"
+# Bus op telling the other workers a version was overwritten in place, its
+# broadcast to clients may be held back
+OVERWRITTEN = "overwritten"
+# Bus op carrying what maintenance changed in a vault to the other workers
+MAINTAINED = "maintained"
+
+channels: Dict[str, ChannelManager] = {}
+fanout_stats = FanoutStats()
 logger = get_logger()
 
 
-class ChannelManager(BaseModel):
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-    clients: Set = Field(default=set())
+async def broadcast_local(vault_id: str, message: Dict) -> None:
+    if message.get("op") == INVALIDATE:
+        # Sent by a worker that changed the vault, not meant for clients
+        invalidate_vault(vault_id)
+        return
+    if message.get("op") in (OVERWRITTEN, MAINTAINED):
+        # Only for the other workers, see drop_remote_state
+        return
+    if vault_id in channels:
+        await channels[vault_id].broadcast(message)
+
+
+async def drop_remote_state(vault_id: str, message: Dict) -> None:
+    if message.get("op") == MAINTAINED:
+        apply_vault_delta(vault_id, vault_delta(message))
+        return
+    # Another worker wrote to the vault, this index missed it and the
+    # content cached for the uid may have been overwritten
+    vault_index.drop(vault_id)
+    if message.get("uid"):
+        blob_cache.discard(vault_id, int(message["uid"]))
+
 
-    def add_client(self, ws: WebSocket) -> None:
-        self.clients.add(ws)
+async def publish(vault_id: str, message: Dict) -> None:
+    await channel_bus.publish(vault_id, message)
 
-    def remove_client(self, ws: WebSocket) -> None:
-        self.clients.discard(ws)
 
-    def is_empty(self) -> bool:
-        return len(self.clients) == 0
+async def publish_invalidation(vault_id: str) -> None:
+    await channel_bus.publish(vault_id, {"op": INVALIDATE})
 
-    async def broadcast(self, message: Dict) -> None:
-        for client in self.clients:
-            await client.send_json(message)
 
+async def publish_delta(vault_id: str, delta: VaultDelta) -> None:
+    await channel_bus.publish(vault_id, dict(delta._asdict(), op=MAINTAINED))
 
-def init_handler(req: str) -> Tuple[Optional[Dict], Optional[VaultModel]]:
+
+def vault_delta(message: Dict) -> VaultDelta:
+    return VaultDelta(
+        removed=tuple((int(uid), path) for uid, path in message["removed"]),
+        added=int(message["added"]),
+        compacted=int(message["compacted"]),
+    )
+
+
+async def init_handler(
+    req: str,
+) -> Tuple[Optional[Dict], Optional[VaultModel]]:
     initial = json.loads(req)
 
     email = get_jwt_email(jwt_string=initial["token"], secret=secret)
 
-    vault_result = get_vault(id=initial["id"], keyhash=initial["keyhash"])
+    vault_result = await get_vault(
+        id=initial["id"], keyhash=initial["keyhash"]
+    )
+    if vault_result is None:
+        return None, None
 
-    if has_access_to_vault(vault_id=vault_result.id, email=email):
+    if await has_access_to_vault(vault_id=vault_result.id, email=email):
         return initial, vault_result
     else:
         return None, None
 
 
 class WebSocketHandler(object):
+    def __init__(self) -> None:
+        super().__init__()
+        channel_bus.subscribe(broadcast_local)
+        channel_bus.subscribe_remote(drop_remote_state)
+        on_vault_changed(publish_invalidation)
+        on_vault_maintained(publish_delta)
+        self.debouncer = PushDebouncer(PUSH_COALESCE_WINDOW, publish)
+        # op -> coroutine handling one decoded message, returns False to
+        # close the connection
+        self.handlers: Dict[str, Handler] = {
+            "size": self.on_size,
+            "pull": self.on_pull,
+            "push": self.on_push,
+            "history": self.on_history,
+            "ping": self.on_ping,
+            "deleted": self.on_deleted,
+            "restore": self.on_restore,
+        }
+
+    async def startup(self) -> None:
+        await channel_bus.start()
+
+    async def shutdown(self) -> None:
+        await self.debouncer.flush()
+        await channel_bus.stop()
+
+    async def on_size(
+        self, websocket: WebSocket, vault_id: str, message: SizeRequest
+    ) -> bool:
+        size = await get_vault_size(vault_id)
+        await websocket.send_text(
+            protocol.encode(
+                {"res": "ok", "size": size, "limit": MAX_STORAGE_BYTES}
+            )
+        )
+        return True
+
+    async def on_pull(
+        self, websocket: WebSocket, vault_id: str, message: PullRequest
+    ) -> bool:
+        if message.uid is None:
+            await websocket.send_text(protocol.UID_REQUIRED)
+            return False
+
+        try:
+            return await self.send_file(websocket, vault_id, message.uid)
+        except (FileNotFoundError, BlobMissingError):
+            # The row outlived its blob, e.g. deleted from the blob directory
+            logger.warning(f"Content of {message.uid} in {vault_id} is gone")
+            await websocket.send_text(protocol.ERROR)
+            return False
+
+    async def send_file(
+        self, websocket: WebSocket, vault_id: str, uid: int
+    ) -> bool:
+        cached = blob_cache.get(vault_id, uid)
+        if cached is None:
+            read = await read_file(vault_id, uid)
+            if read is None:
+                return False
+            file, cached = read
+        if cached is not None:
+            await self.send_cached(websocket, cached)
+            return True
+
+        # Too large for the blob cache, stream it
+        pieces = 0
+        if file.size != 0:
+            pieces = math.ceil(
+                await get_data_size(vault_id, file) / PULL_PIECE_SIZE
+            )
+
+        await websocket.send_text(
+            protocol.encode(
+                {"hash": file.hash, "size": file.size, "pieces": pieces}
+            )
+        )
+
+        if pieces > 0:
+            async for piece in iter_file_data(vault_id, file, PULL_PIECE_SIZE):
+                await websocket.send_bytes(piece)
+        return True
+
+    async def send_cached(
+        self, websocket: WebSocket, cached: CachedFile
+    ) -> None:
+        pieces = 0
+        if cached.size != 0:
+            pieces = math.ceil(len(cached.data) / PULL_PIECE_SIZE)
+        await websocket.send_text(
+            protocol.encode(
+                {"hash": cached.hash, "size": cached.size, "pieces": pieces}
+            )
+        )
+        for start in range(0, pieces * PULL_PIECE_SIZE, PULL_PIECE_SIZE):
+            await websocket.send_bytes(
+                cached.data[start : start + PULL_PIECE_SIZE]
+            )
+
+    async def on_push(
+        self, websocket: WebSocket, vault_id: str, message: PushRequest
+    ) -> bool:
+        if message.size > MAX_FILE_BYTES:
+            await websocket.send_text(
+                protocol.encode({"error": "File exceeds the size limit"})
+            )
+            return False
+
+        vault_file = VaultMetaFileModel(
+            vault_id=vault_id,
+            path=message.path,
+            hash=message.hash,
+            extension=message.extension,
+            size=message.size,
+            created=message.ctime,
+            modified=message.mtime,
+            folder=message.folder,
+            deleted=message.deleted,
+        )
+        # Kept for the pulls the broadcast of this push is about to cause
+        data: Optional[bytes] = b""
+        if message.deleted:
+            await delete_vault_file(vault_id, message.path)
+            vault_uid: Optional[int] = 0
+        else:
+            vault_uid = None
+            if (
+                message.size > 0
+                and message.hash != ""
+                and await find_duplicate_blob(vault_file)
+            ):
+                # The vault already stores this content, it is not uploaded
+                # again
+                vault_uid = await insert_duplicate(vault_file)
+                data = None
+            if vault_uid is None:
+                blob = None
+                if message.size > 0:
+                    received = await self.receive_blob(
+                        websocket, vault_id, message
+                    )
+                    if received is None:
+                        return False
+                    blob, data = received
+                try:
+                    vault_uid = await self.store_push(
+                        websocket, vault_file, blob
+                    )
+                except BlobMissingError as e:
+                    # Purged while it was uploaded, the client pushes again
+                    await websocket.send_text(
+                        protocol.encode({"error": str(e)})
+                    )
+                    return False
+            self.debouncer.pushed(vault_id, message.path, websocket, vault_uid)
+
+        if vault_uid is None:
+            await websocket.send_text(protocol.ERROR)
+            return False
+        if vault_uid and data is not None:
+            blob_cache.put(
+                vault_id,
+                vault_uid,
+                CachedFile(message.hash, message.size, data),
+            )
+
+        metadata = message.model_dump()
+        metadata["uid"] = str(vault_uid)
+        await self.debouncer.broadcast(vault_id, message.path, metadata)
+
+        await self.reply(websocket, vault_id, protocol.OK)
+        return True
+
+    async def reply(
+        self, websocket: WebSocket, vault_id: str, frame: str
+    ) -> None:
+        # Queued behind the broadcasts pending for the client, so it still
+        # receives the broadcast of its own write before the reply
+        channel = channels.get(vault_id)
+        if channel is None or not channel.send(websocket, frame):
+            await websocket.send_text(frame)
+
+    async def store_push(
+        self,
+        websocket: WebSocket,
+        vault_file: VaultMetaFileModel,
+        blob: Optional[Tuple[str, int]],
+    ) -> int:
+        # Rapid pushes of this connection overwrite its last version
+        target = self.debouncer.target(
+            vault_file.vault_id, vault_file.path, websocket
+        )
+        if target is not None and await overwrite_file(
+            vault_file.vault_id, target, vault_file, blob
+        ):
+            await publish(
+                vault_file.vault_id, {"op": OVERWRITTEN, "uid": str(target)}
+            )
+            return target
+        return await insert_metadata(vault_file=vault_file, blob=blob)
+
+    async def receive_blob(
+        self, websocket: WebSocket, vault_id: str, message: PushRequest
+    ) -> Optional[Tuple[Tuple[str, int], Optional[bytes]]]:
+        # Received before touching the database so a failed upload does not
+        # replace the newest version. Returns the committed (digest, size)
+        # and the content if the blob cache takes it, None on failure.
+        writer = shards.blob_store(vault_id).writer(
+            max_memory=PUSH_MEMORY_THRESHOLD, max_size=MAX_FILE_BYTES
+        )
+        try:
+            for _ in range(message.pieces):
+                await websocket.send_text(protocol.NEXT)
+                piece = await websocket.receive_bytes()
+                if writer.size + len(piece) > writer.max_memory:
+                    # Spilled to a file, write it off the event loop
+                    await asyncio.to_thread(writer.write, piece)
+                else:
+                    writer.write(piece)
+            data = None
+            if blob_cache.cacheable(writer.size):
+                data = writer.contents()
+            # fsync and rename, on a thread of their own rather than one
+            # the database reads need
+            blob = await asyncio.to_thread(writer.commit)
+        except BlobTooLargeError as e:
+            await websocket.send_text(protocol.encode({"error": str(e)}))
+            return None
+        finally:
+            writer.abort()
+        return blob, data
+
+    async def on_history(
+        self, websocket: WebSocket, vault_id: str, message: HistoryRequest
+    ) -> bool:
+        items, more = await get_file_history(
+            vault_id, message.path, message.last
+        )
+        if len(items) == 0 and message.last is None:
+            await websocket.send_text(protocol.ERROR)
+            return False
+
+        await websocket.send_text(
+            protocol.encode(
+                {"items": [f.to_dict() for f in items], "more": more}
+            )
+        )
+        return True
+
+    async def on_ping(
+        self, websocket: WebSocket, vault_id: str, message: PingRequest
+    ) -> bool:
+        await websocket.send_text(protocol.PONG)
+        return True
+
+    async def on_deleted(
+        self, websocket: WebSocket, vault_id: str, message: DeletedRequest
+    ) -> bool:
+        items, more = await get_deleted_files(vault_id, message.last)
+        if len(items) == 0 and message.last is None:
+            await websocket.send_text(protocol.ERROR)
+            return False
+
+        await websocket.send_text(
+            protocol.encode(
+                {"items": [f.to_dict() for f in items], "more": more}
+            )
+        )
+        return True
+
+    async def on_restore(
+        self, websocket: WebSocket, vault_id: str, message: RestoreRequest
+    ) -> bool:
+        if message.uid is None:
+            await websocket.send_text(protocol.UID_REQUIRED)
+            return False
+
+        res_vault_file = await restore_file(vault_id, uid=message.uid)
+        if res_vault_file is None:
+            await websocket.send_text(protocol.ERROR)
+            return False
+
+        vault_file_dict = res_vault_file.to_dict()
+        vault_file_dict["op"] = "push"
+        if res_vault_file.path is not None:
+            self.debouncer.cancel(vault_id, res_vault_file.path)
+        await channel_bus.publish(vault_id, vault_file_dict)
+        await self.reply(websocket, vault_id, protocol.RES_OK)
+        return True
+
+    async def close_websocket(
+        self, websocket: WebSocket, vault_id: Optional[str]
+    ) -> None:
+        if websocket.client_state is not WebSocketState.DISCONNECTED:
+            await websocket.close()
+        if vault_id is None:
+            return
+        if vault_id in channels:
+            channels[vault_id].remove_client(websocket)
+            if channels[vault_id].is_empty():
+                del channels[vault_id]
+        compaction_scheduler.mark_dirty(vault_id)
+
     async def ws_handler(self, websocket: WebSocket) -> None:
+        joined_vault_id: Optional[str] = None
+        pinned_vault_id: Optional[str] = None
         try:
             await websocket.accept()
 
-            err = "error"
             msg = await websocket.receive_text()
-            connection_info, connected_vault = init_handler(msg)
-            if connected_vault is None:
+            connection_info, connected_vault = await init_handler(msg)
+            if connection_info is None or connected_vault is None:
+                await websocket.send_text(
+                    protocol.encode({"error": "Vault not found"})
+                )
                 return
 
             await websocket.send_json({"res": "ok"})
+            # Keeps the index of the vault while the client is connected
+            vault_index.pin(connected_vault.id)
+            pinned_vault_id = connected_vault.id
+            await load_vault_index(connected_vault.id)
             try:
                 version = int(connection_info["version"])
             except ValueError:
                 version = 0
-            if connected_vault.version > version:
-                vault_files = get_vault_files(connected_vault.id)
-                if vault_files is None:
-                    return
-                for file in vault_files:
-                    await websocket.send_json(
-                        {
-                            "op": "push",
-                            "path": file.path,
-                            "hash": file.hash,
-                            "size": file.size,
-                            "ctime": file.created,
-                            "mtime": file.modified,
-                            "folder": file.folder,
-                            "deleted": file.deleted,
-                            "device": "insignificantv5",
-                            "uid": file.uid,
-                        }
-                    )
-
-            version_bumped = False
-            await websocket.send_json(
-                {"op": "ready", "version": connected_vault.version}
-            )
-
-            if connected_vault.version < version:
-                set_vault_version(connected_vault.id, version)
+            vault_seq = await get_vault_seq(connected_vault.id)
+            if vault_seq is None:
+                vault_seq = await advance_vault_seq(
+                    connected_vault.id, connected_vault.version
+                )
+            if vault_seq > version:
+                # Only send what changed since the client last synced, unless
+                # it is a first sync or the change log was compacted
+                await send_manifest(
+                    websocket,
+                    connected_vault.id,
+                    since=version if version > 0 else None,
+                )
+
+            await websocket.send_json({"op": "ready", "version": vault_seq})
+
+            if vault_seq < version:
+                await advance_vault_seq(connected_vault.id, version)
+                await set_vault_version(connected_vault.id, version)
 
             if connected_vault.id not in channels:
-                channels[connected_vault.id] = ChannelManager()
+                channels[connected_vault.id] = ChannelManager(
+                    stats=fanout_stats
+                )
 
             channels[connected_vault.id].add_client(websocket)
-
-            async def close_websocket() -> None:
-                if websocket.client_state is not WebSocketState.DISCONNECTED:
-                    await websocket.close()
-                if connected_vault.id in channels:
-                    channels[connected_vault.id].remove_client(websocket)
-                    if channels[connected_vault.id].is_empty():
-                        del channels[connected_vault.id]
-                snapshot(connected_vault.id)
+            joined_vault_id = connected_vault.id
 
             while True:
-                msg = await websocket.receive_text()
-                m = json.loads(msg)
-                op = m.get("op")
-
-                if op == "size":
-                    size = get_vault_size(connected_vault.id)
-                    await websocket.send_json(
-                        {
-                            "res": "ok",
-                            "size": size,
-                            "limit": MAX_STORAGE_BYTES,
-                        }
+                frame = await websocket.receive_text()
+                try:
+                    message = protocol.decode(frame)
+                except protocol.ProtocolError as e:
+                    await websocket.send_text(
+                        protocol.encode({"error": str(e)})
                     )
-
-                elif op == "pull":
-                    pull_uid = m.get("uid", None)
-                    if pull_uid is None:
-                        await websocket.send_json({"error": "UID is required"})
-                        return
-
-                    file = get_file(pull_uid)
-                    if file is None:
-                        return
-
-                    pieces = 0
-                    if file.size != 0:
-                        pieces = 1
-
-                    await websocket.send_json(
-                        {
-                            "hash": file.hash,
-                            "size": file.size,
-                            "pieces": pieces,
-                        }
-                    )
-
-                    if file.size != 0:
-                        await websocket.send_bytes(file.data)
-
-                elif op == "push":
-                    metadata = m
-                    vault_uid = None
-
-                    if metadata["deleted"]:
-                        delete_vault_file(metadata["path"])
-                        vault_uid = 0
-                    else:
-                        vault_meta_file = create_model(
-                            "VaultMetaFileModel",
-                            vault_id=(str, ...),
-                            path=(str, ...),
-                            hash=(str, ...),
-                            extension=(str, ...),
-                            size=(int, ...),
-                            created=(int, ...),
-                            modified=(int, ...),
-                            folder=(bool, ...),
-                            deleted=(bool, ...),
-                        )
-
-                        vault_uid = insert_metadata(
-                            vault_file=vault_meta_file(
-                                vault_id=connected_vault.id,
-                                path=metadata["path"],
-                                hash=metadata["hash"],
-                                extension=metadata["extension"],
-                                size=metadata.get("size", 0),
-                                created=metadata["ctime"],
-                                modified=metadata["mtime"],
-                                folder=metadata["folder"],
-                                deleted=metadata["deleted"],
-                            )
-                        )
-
-                    if vault_uid is None:
-                        await websocket.send_json({"error": str(err)})
-                        return
-
-                    if metadata.get("size", 0) > 0:
-                        full_binary = bytearray()
-                        for _ in range(metadata["pieces"]):
-                            await websocket.send_json({"res": "next"})
-                            binary_message = await websocket.receive_bytes()
-                            full_binary += binary_message
-
-                        insert_data(uid=vault_uid, data=bytes(full_binary))
-
-                    metadata["uid"] = str(vault_uid)
-                    await channels[connected_vault.id].broadcast(metadata)
-
-                    if not version_bumped:
-                        set_vault_version(connected_vault.id, version + 1)
-                        version_bumped = True
-
-                    await websocket.send_json({"op": "ok"})
-
-                elif op == "history":
-                    history = m
-                    files = get_file_history(history["path"])
-                    if len(files) == 0:
-                        await websocket.send_json({"error": str(err)})
-                        return
-
-                    await websocket.send_json(
-                        {
-                            "items": [f.model_dump() for f in files],
-                            "more": False,
-                        }
-                    )
-
-                elif op == "ping":
-                    await websocket.send_json({"op": "pong"})
-
-                elif op == "deleted":
-                    files = get_deleted_files()
-                    if len(files) == 0:
-                        await websocket.send_json({"error": str(err)})
-                        return
-                    await websocket.send_json(
-                        {"items": [f.model_dump() for f in files]}
-                    )
-
-                elif op == "restore":
-                    restore_uid = m.get("uid")
-                    if restore_uid is None:
-                        await websocket.send_json({"error": "UID is required"})
-                        return
-
-                    res_vault_file = restore_file(uid=int(restore_uid))
-
-                    if res_vault_file is None:
-                        await websocket.send_json({"error": str(err)})
-                        return
-
-                    vault_file_dict = res_vault_file.model_dump()
-                    vault_file_dict["op"] = "push"
-                    await channels[connected_vault.id].broadcast(
-                        vault_file_dict
-                    )
-                    await websocket.send_json({"res": "ok"})
-
-                else:
-                    logger.info(f"Unknown operation: {op}")
-                    logger.info(f"Data: {msg}")
+                    return
+                if message is None:
+                    logger.info(f"Unknown operation: {frame}")
+                    continue
+                handler = self.handlers[message.op]
+                if not await handler(websocket, connected_vault.id, message):
+                    return
         except WebSocketDisconnect:
             return
 
         finally:
-            await close_websocket()
+            await self.close_websocket(websocket, joined_vault_id)
+            if pinned_vault_id is not None:
+                vault_index.unpin(pinned_vault_id)
@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+class TTLCache(object):
+    # LRU cache whose entries also expire `ttl` seconds after being set, a
+    # non-positive size or ttl disables it
+    def __init__(self, max_size: int, ttl: float) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = (
+            OrderedDict()
+        )
+        # Bumped by every invalidation, see set()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(
+        self, key: Hashable, value: Any, generation: Optional[int] = None
+    ) -> None:
+        # Pass the generation read before loading the value, so a value
+        # loaded while an invalidation happened is not cached
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Any], bool]) -> int:
+        self.generation += 1
+        keys = [key for key in self.entries if predicate(key)]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(size=len(self.entries), hits=self.hits, misses=self.misses)
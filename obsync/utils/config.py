@@ -2,14 +2,123 @@ import os
 import pickle
 
 PROVIDER = "sqlite"
+# Earlier versions let Pony resolve a relative DB_PATH against obsync/db
+LEGACY_DB_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db"
+)
+
+
+def resolve_vault_db(db_path: str, legacy_root: str = LEGACY_DB_ROOT) -> str:
+    # A vaults.db left where earlier versions put it stays in use until it
+    # is moved to DB_PATH, rather than starting over with an empty one
+    vault_db = os.path.join(os.path.abspath(db_path), "vaults.db")
+    legacy = os.path.normpath(os.path.join(legacy_root, db_path, "vaults.db"))
+    if os.path.exists(legacy) and not os.path.exists(vault_db):
+        return legacy
+    return vault_db
 
-VAULT_DB = os.path.join(os.environ.get("DB_PATH", "."), "vaults.db")
-SECRET_PATH = os.path.join(os.environ.get("DB_PATH", "."), "secret.gob")
+
+# Resolved once, Pony would resolve a relative database name against the
+# module binding it and everything else against the working directory
+DB_PATH = os.path.abspath(os.environ.get("DB_PATH", "."))
+VAULT_DB = resolve_vault_db(os.environ.get("DB_PATH", "."))
+SECRET_PATH = os.path.join(DB_PATH, "secret.gob")
+BUS_DB = os.path.join(DB_PATH, "bus.db")
+BLOB_PATH = os.path.join(DB_PATH, "blobs")
+# Held by the worker that runs the periodic maintenance
+MAINTENANCE_LOCK = os.path.join(DB_PATH, "maintenance.lock")
+BLOB_STORE = os.environ.get("BLOB_STORE", "file")
+# One SQLite file and blob directory per vault under SHARD_PATH, the
+# catalog of users, vaults and shares stays in vaults.db
+VAULT_SHARDS = os.environ.get("VAULT_SHARDS", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+SHARD_PATH = os.path.join(DB_PATH, "vaults")
+SHARD_MAX_OPEN = int(os.environ.get("SHARD_MAX_OPEN", 64))
 
 DOMAIN_NAME = os.environ.get("DOMAIN_NAME", "localhost:3000")
 MAX_STORAGE_BYTES = (
     int(os.environ.get("MAX_STORAGE_GB", 10)) * 1024 * 1024 * 1024
 )
+PULL_PIECE_SIZE = int(os.environ.get("PULL_PIECE_SIZE_KB", 2048)) * 1024
+PUSH_MEMORY_THRESHOLD = (
+    int(os.environ.get("PUSH_MEMORY_THRESHOLD_KB", 1024)) * 1024
+)
+MAX_FILE_BYTES = int(os.environ.get("MAX_FILE_SIZE_MB", 200)) * 1024 * 1024
+DB_READ_WORKERS = int(os.environ.get("DB_READ_WORKERS", 4))
+# Only used with VAULT_SHARDS, a single database has a single writer
+DB_WRITE_WORKERS = int(os.environ.get("DB_WRITE_WORKERS", 4))
+# SQLite pragmas of vaults.db, applied to every connection
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "wal")
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "normal")
+DB_BUSY_TIMEOUT = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+# Negative is KiB per connection, positive is pages
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16384))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE_MB", 256)) * 1024 * 1024
+WAL_AUTOCHECKPOINT = int(os.environ.get("WAL_AUTOCHECKPOINT_PAGES", 1000))
+WAL_CHECKPOINT_INTERVAL = int(
+    os.environ.get("WAL_CHECKPOINT_INTERVAL_SEC", 60)
+)
+WAL_TRUNCATE_BYTES = int(os.environ.get("WAL_TRUNCATE_MB", 64)) * 1024 * 1024
+# A checkpoint gives up after this long instead of holding up writers
+WAL_CHECKPOINT_TIMEOUT = int(os.environ.get("WAL_CHECKPOINT_TIMEOUT_MS", 100))
+MANIFEST_BATCH_SIZE = int(os.environ.get("MANIFEST_BATCH_SIZE", 500))
+WS_PER_MESSAGE_DEFLATE = os.environ.get(
+    "WS_PER_MESSAGE_DEFLATE", "true"
+).lower() in ("1", "true", "yes")
+# Worker processes serving the app, events only need to cross processes
+# with more than one
+WORKERS = int(os.environ.get("WORKERS", 1))
+CHANNEL_BUS = os.environ.get(
+    "CHANNEL_BUS", "sqlite" if WORKERS > 1 else "local"
+)
+BUS_POLL_INTERVAL = int(os.environ.get("BUS_POLL_INTERVAL_MS", 50)) / 1000
+CLIENT_QUEUE_SIZE = int(os.environ.get("CLIENT_QUEUE_SIZE", 256))
+STATS_RECONCILE_INTERVAL = (
+    int(os.environ.get("STATS_RECONCILE_INTERVAL_MIN", 60)) * 60
+)
+# Every worker logs its pool, cache and fanout counters this often
+STATS_LOG_INTERVAL = int(os.environ.get("STATS_LOG_INTERVAL_SEC", 300))
+COMPACTION_INTERVAL = int(os.environ.get("COMPACTION_INTERVAL_SEC", 30))
+COMPACTION_DELAY = int(os.environ.get("COMPACTION_DELAY_SEC", 60))
+COMPACTION_ROW_BUDGET = int(os.environ.get("COMPACTION_ROW_BUDGET", 5000))
+KDF_WORKERS = int(os.environ.get("KDF_WORKERS", 2))
+KDF_MAX_PENDING = int(os.environ.get("KDF_MAX_PENDING", 32))
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 100))
+# Version retention, the defaults keep every version and tombstone
+RETENTION_KEEP_VERSIONS = int(os.environ.get("RETENTION_KEEP_VERSIONS", 0))
+RETENTION_BUCKETS = os.environ.get("RETENTION_BUCKETS", "")
+RETENTION_TOMBSTONE_DAYS = int(os.environ.get("RETENTION_TOMBSTONE_DAYS", 0))
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL_MIN", 60)) * 60
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 200))
+# Pushes are committed in shared transactions of up to WRITE_BATCH_SIZE
+WRITE_BATCH_DELAY = int(os.environ.get("WRITE_BATCH_DELAY_MS", 2)) / 1000
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 64))
+# Decoded tokens, vault lookups and access checks
+AUTH_CACHE_TTL = int(os.environ.get("AUTH_CACHE_TTL_SEC", 60))
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+# In-memory file index of the vaults clients are connected to, 0 disables it
+VAULT_INDEX_MEMORY = (
+    int(os.environ.get("VAULT_INDEX_MEMORY_MB", 64)) * 1024 * 1024
+)
+# Contents of recently pushed and pulled files, files over the size limit
+# are streamed from the blob store. Prewarming loads the files listed in a
+# manifest before the client pulls them.
+BLOB_CACHE_MEMORY = int(os.environ.get("BLOB_CACHE_MB", 64)) * 1024 * 1024
+BLOB_CACHE_MAX_FILE = (
+    int(os.environ.get("BLOB_CACHE_MAX_FILE_KB", 1024)) * 1024
+)
+BLOB_CACHE_PREWARM = os.environ.get("BLOB_CACHE_PREWARM", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Pushes of a path within the window of the version pushed before it by the
+# same connection overwrite that version, and its broadcasts are limited to
+# one per window. 0 disables it.
+PUSH_COALESCE_WINDOW = float(os.environ.get("PUSH_COALESCE_WINDOW_SEC", 0))
 ADDR_HTTP = os.environ.get("ADDR_HTTP", "127.0.0.1:3000")
 SIGNUP_KEY = os.environ.get("SIGNUP_KEY", None)
 
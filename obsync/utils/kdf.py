@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import bcrypt
+
+from obsync.utils.config import KDF_MAX_PENDING, KDF_WORKERS
+from obsync.utils.logger import get_logger
+
+T = TypeVar("T")
+
+logger = get_logger()
+
+
+class KDFBusyError(RuntimeError):
+    pass
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode(
+        "utf-8"
+    )
+
+
+def check_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+class KDFPool(object):
+    # Password hashing and key derivation run in worker processes instead
+    # of tying up the database threads, the single writer in particular
+    def __init__(self, workers: int, max_pending: int) -> None:
+        super().__init__()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        # Workers are forked rather than spawned so they do not import the
+        # server's main module again
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        return self.pool
+
+    async def start(self) -> None:
+        # Fork the workers at startup, before the database threads exist
+        await asyncio.wrap_future(self.get_pool().submit(len, ""))
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        # Jobs past max_pending are rejected right away rather than queued
+        # behind work that would take seconds to drain
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"KDF queue full, {self.pending} jobs pending")
+            raise KDFBusyError("Server busy, try again later")
+        start = time.perf_counter()
+        self.pending += 1
+        try:
+            return await asyncio.wrap_future(
+                self.get_pool().submit(func, *args)
+            )
+        finally:
+            self.pending -= 1
+            elapsed = time.perf_counter() - start
+            self.completed += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            workers=self.workers,
+            pending=self.pending,
+            completed=self.completed,
+            rejected=self.rejected,
+            avg_ms=(
+                0.0
+                if self.completed == 0
+                else self.total_time * 1000 / self.completed
+            ),
+            max_ms=self.max_time * 1000,
+        )
+
+    async def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+kdf_pool = KDFPool(workers=KDF_WORKERS, max_pending=KDF_MAX_PENDING)
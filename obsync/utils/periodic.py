@@ -0,0 +1,76 @@
+import asyncio
+import fcntl
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from obsync.utils.logger import get_logger
+
+logger = get_logger()
+
+
+class ProcessLock(object):
+    # An advisory file lock held by one process at a time, the OS releases
+    # it when the process exits
+    def __init__(self, filename: str) -> None:
+        super().__init__()
+        self.filename = filename
+        self.fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        # Does not wait, True once this process holds the lock
+        if self.fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def release(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class PeriodicTask(object):
+    # With a lock only the worker holding it runs the task, another worker
+    # takes over once the holder exits
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        func: Callable[[], Awaitable[Any]],
+        lock: Optional[ProcessLock] = None,
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.lock = lock
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        # A non-positive interval disables the task
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.lock is not None and not self.lock.acquire():
+                continue
+            try:
+                await self.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Periodic task {self.name} failed")
@@ -0,0 +1,61 @@
+import argparse
+from typing import List, Optional
+
+from pony.orm import db_session
+from pydantic import ValidationError
+
+from obsync.db.retention import RetentionPolicy
+from obsync.db.vault import Vault
+from obsync.db.vault_files_schema import (
+    get_retention_policy,
+    set_retention_policy,
+)
+
+FIELDS = ("keep_versions", "buckets", "tombstone_days")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Show or change the version retention policy of a"
+        " vault. Options left out keep their current value."
+    )
+    parser.add_argument("vault_id", type=str)
+    parser.add_argument("-k", "--keep-versions", type=int)
+    parser.add_argument("-b", "--buckets", type=str, help="e.g. 1h:1d,1d:30d")
+    parser.add_argument("-t", "--tombstone-days", type=int)
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="fall back to the server wide policy",
+    )
+    return parser.parse_args(argv)
+
+
+def update_policy(args: argparse.Namespace) -> RetentionPolicy:
+    with db_session:
+        if not Vault.exists(id=args.vault_id):
+            raise SystemExit(f"Unknown vault {args.vault_id}")
+    if args.reset:
+        set_retention_policy(args.vault_id, None)
+        return get_retention_policy(args.vault_id)
+    policy = get_retention_policy(args.vault_id)
+    changes = {
+        name: getattr(args, name)
+        for name in FIELDS
+        if getattr(args, name) is not None
+    }
+    if len(changes) > 0:
+        try:
+            policy = RetentionPolicy.model_validate(
+                dict(policy.model_dump(), **changes)
+            )
+        except ValidationError as e:
+            raise SystemExit(str(e))
+        set_retention_policy(args.vault_id, policy)
+    return policy
+
+
+if __name__ == "__main__":
+    policy = update_policy(parse_args())
+    for name in FIELDS:
+        print(f"{name}: {getattr(policy, name)}")
@@ -0,0 +1,131 @@
+import argparse
+import os
+import shutil
+import sqlite3
+from typing import List
+
+from obsync.db.blob_store import FileBlobStore, blob_store
+from obsync.db.migrations import table_columns
+from obsync.db.shards import shards
+from obsync.utils.config import VAULT_DB
+
+# Tables keyed by vault_id that move to the shards, blob is rebuilt
+TABLES = ("vault_file", "vault_seq", "vault_stats", "vault_retention")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Move the files of every vault out of vaults.db into"
+        " their own shard. Stop the server first."
+    )
+    parser.add_argument(
+        "--purge",
+        action="store_true",
+        help="delete the moved rows and blobs from vaults.db afterwards",
+    )
+    parser.add_argument("--vacuum", action="store_true")
+    return parser.parse_args()
+
+
+def central_vault_ids(con: sqlite3.Connection) -> List[str]:
+    union = " UNION ".join(f"SELECT vault_id FROM {table}" for table in TABLES)
+    return [
+        row[0]
+        for row in con.execute(f"SELECT * FROM ({union}) ORDER BY 1")
+        if row[0] is not None
+    ]
+
+
+def copy_blob(
+    source: FileBlobStore, target: FileBlobStore, digest: str
+) -> None:
+    # Hard links when possible, the central copy may go away with --purge
+    if target.exists(digest):
+        return
+    tmp_path = os.path.join(target.tmp_dir, digest)
+    try:
+        os.link(source.path(digest), tmp_path)
+    except OSError:
+        shutil.copyfile(source.path(digest), tmp_path)
+    target.put_file(digest, tmp_path)
+
+
+def split_vault(vault_id: str, central: FileBlobStore) -> int:
+    # Returns the number of vault_file rows moved, -1 when the shard already
+    # holds files and is left alone
+    shards.get(vault_id)
+    con = sqlite3.connect(shards.path(vault_id), isolation_level=None)
+    try:
+        if con.execute("SELECT 1 FROM vault_file LIMIT 1").fetchone():
+            return -1
+        con.execute("ATTACH DATABASE ? AS central", (VAULT_DB,))
+        con.execute("BEGIN IMMEDIATE")
+        for table in TABLES:
+            columns = ", ".join(table_columns(con, table))
+            con.execute(
+                f"INSERT OR REPLACE INTO main.{table} ({columns})"
+                f" SELECT {columns} FROM central.{table} WHERE vault_id = ?",
+                (vault_id,),
+            )
+        # Reference counts only cover the rows of this vault now
+        con.execute(
+            "INSERT OR IGNORE INTO main.blob (digest, size, refcount)"
+            " SELECT digest, size, 0 FROM central.blob"
+            " WHERE digest IN (SELECT blob FROM main.vault_file)"
+        )
+        con.execute(
+            "UPDATE main.blob SET refcount = (SELECT COUNT(*)"
+            " FROM main.vault_file WHERE vault_file.blob = blob.digest)"
+        )
+        digests = [row[0] for row in con.execute("SELECT digest FROM blob")]
+        # Created with the kind of the central store
+        target = shards.blob_store(vault_id)
+        assert isinstance(target, FileBlobStore)
+        for digest in digests:
+            copy_blob(central, target, digest)
+        con.execute("COMMIT")
+        return con.execute("SELECT COUNT(*) FROM vault_file").fetchone()[0]
+    finally:
+        con.close()
+
+
+def purge_central(con: sqlite3.Connection, vault_ids: List[str]) -> None:
+    digests = [row[0] for row in con.execute("SELECT digest FROM blob")]
+    con.execute("BEGIN IMMEDIATE")
+    for vault_id in vault_ids:
+        for table in TABLES:
+            con.execute(f"DELETE FROM {table} WHERE vault_id = ?", (vault_id,))
+    con.execute("DELETE FROM blob")
+    con.execute("COMMIT")
+    for digest in digests:
+        blob_store.delete(digest)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if shards.root is None:
+        raise SystemExit("Set VAULT_SHARDS=true to split vaults.db")
+    if not isinstance(blob_store, FileBlobStore):
+        raise SystemExit("Splitting needs BLOB_STORE=file")
+    con = sqlite3.connect(VAULT_DB, isolation_level=None)
+    vault_ids = central_vault_ids(con)
+    split = []
+    for vault_id in vault_ids:
+        moved = split_vault(vault_id, blob_store)
+        if moved < 0:
+            print(f"Skipped {vault_id}, its shard already holds files.")
+            continue
+        split.append(vault_id)
+        print(f"Moved {moved} files of {vault_id}.")
+    if args.purge:
+        if len(split) < len(vault_ids):
+            raise SystemExit(
+                "Not purging, some vaults were skipped. Pass --purge to the"
+                " run that splits them."
+            )
+        purge_central(con, split)
+        print("Purged vaults.db.")
+    if args.vacuum:
+        con.execute("VACUUM")
+    con.close()
+    print("Done.")
@@ -4,14 +4,33 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
+from obsync.db.coalescer import write_coalescer
+from obsync.db.compaction import compaction_scheduler
+from obsync.db.maintenance import (
+    checkpoint_vault_db,
+    prune_all_vaults,
+    reconcile_all_vault_stats,
+)
+from obsync.handler.stats import log_worker_stats
 from obsync.handler.subscription import SubscriptionHandler
 from obsync.handler.user import UserHandler
 from obsync.handler.vault import VaultHandler
 from obsync.handler.websocket import WebSocketHandler
-from obsync.utils.config import ADDR_HTTP
+from obsync.utils.config import (
+    ADDR_HTTP,
+    MAINTENANCE_LOCK,
+    RETENTION_INTERVAL,
+    STATS_LOG_INTERVAL,
+    STATS_RECONCILE_INTERVAL,
+    WAL_CHECKPOINT_INTERVAL,
+    WS_PER_MESSAGE_DEFLATE,
+)
+from obsync.utils.kdf import kdf_pool
 from obsync.utils.logger import get_logger
+from obsync.utils.periodic import PeriodicTask, ProcessLock
 
 app = FastAPI()
+app.add_event_handler("startup", kdf_pool.start)
 
 app.add_middleware(
     CORSMiddleware,
@@ -40,10 +59,44 @@ user_handler = UserHandler()
 app.include_router(user_handler.router, prefix="/user")
 
 websocket_handler = WebSocketHandler()
+app.add_event_handler("startup", websocket_handler.startup)
+app.add_event_handler("shutdown", websocket_handler.shutdown)
 app.add_websocket_route("/", websocket_handler.ws_handler)
 app.add_websocket_route("/ws", websocket_handler.ws_handler)
 app.add_websocket_route("/ws.obsidian.md", websocket_handler.ws_handler)
 
+# Periodic maintenance runs in one worker
+maintenance_lock = ProcessLock(MAINTENANCE_LOCK)
+stats_reconciler = PeriodicTask(
+    "vault stats reconcile",
+    STATS_RECONCILE_INTERVAL,
+    reconcile_all_vault_stats,
+    maintenance_lock,
+)
+app.add_event_handler("startup", stats_reconciler.start)
+app.add_event_handler("shutdown", stats_reconciler.stop)
+retention_pruner = PeriodicTask(
+    "version retention", RETENTION_INTERVAL, prune_all_vaults, maintenance_lock
+)
+app.add_event_handler("startup", retention_pruner.start)
+app.add_event_handler("shutdown", retention_pruner.stop)
+app.add_event_handler("shutdown", kdf_pool.shutdown)
+app.add_event_handler("startup", compaction_scheduler.start)
+app.add_event_handler("shutdown", compaction_scheduler.stop)
+app.add_event_handler("shutdown", write_coalescer.stop)
+wal_checkpointer = PeriodicTask(
+    "wal checkpoint",
+    WAL_CHECKPOINT_INTERVAL,
+    checkpoint_vault_db,
+    maintenance_lock,
+)
+app.add_event_handler("startup", wal_checkpointer.start)
+app.add_event_handler("shutdown", wal_checkpointer.stop)
+# Every worker logs its own counters
+stats_logger = PeriodicTask("stats log", STATS_LOG_INTERVAL, log_worker_stats)
+app.add_event_handler("startup", stats_logger.start)
+app.add_event_handler("shutdown", stats_logger.stop)
+
 
 logger.info("Serving start...")
 
@@ -53,4 +106,9 @@ if __name__ == "__main__":
 
     host = str(ADDR_HTTP.split(":")[0])
     port = int(ADDR_HTTP.split(":")[1])
-    uvicorn.run(app, host=host, port=port)
+    uvicorn.run(
+        app,
+        host=host,
+        port=port,
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+    )
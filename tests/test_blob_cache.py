@@ -0,0 +1,148 @@
+import asyncio
+from uuid import uuid4
+
+from obsync.db import vault_files_schema
+from obsync.db.aio import overwrite_file, prewarm_files, read_file, snapshot
+from obsync.db.blob_cache import BlobCache, CachedFile, blob_cache
+from obsync.db.shards import shards
+from obsync.db.vault_files_schema import insert_data, insert_metadata
+from tests.test_vault_files import new_file
+
+
+def cached(size: int) -> CachedFile:
+    return CachedFile("hash", size, b"x" * size)
+
+
+def test_cache_stays_within_its_budget():
+    cache = BlobCache(max_bytes=10, max_file=4)
+    cache.put("vault", 1, cached(4))
+    cache.put("vault", 2, cached(4))
+    assert cache.get("vault", 1) is not None
+    cache.put("vault", 3, cached(4))
+    cache.put("vault", 4, cached(5))
+
+    assert cache.get("vault", 2) is None
+    assert cache.contains("vault", 1) and cache.contains("vault", 3)
+    assert not cache.contains("vault", 4)
+    assert cache.stats() == dict(files=2, bytes=8, hits=1, misses=1, evicted=1)
+
+    cache.invalidate("vault")
+    assert cache.stats()["files"] == 0
+    assert cache.nbytes == 0
+
+
+def test_reads_raced_by_an_overwrite_are_not_cached():
+    cache = BlobCache(max_bytes=10, max_file=4)
+    cache.put("vault", 1, cached(2))
+    generation = cache.generation
+    cache.discard("vault", 1)
+    cache.put("vault", 1, cached(3), generation)
+    assert not cache.contains("vault", 1)
+    assert cache.nbytes == 0
+
+
+def test_disabled_cache_keeps_nothing():
+    cache = BlobCache(max_bytes=0, max_file=4)
+    cache.put("vault", 1, cached(0))
+    assert not cache.contains("vault", 1)
+    assert cache.max_file == 0
+
+
+def test_small_files_are_read_into_the_cache():
+    vault_id = str(uuid4())
+    small = insert_metadata(new_file(vault_id, "small.md", size=3))
+    insert_data(vault_id, small, b"abc")
+    large = insert_metadata(new_file(vault_id, "large.md", size=1))
+    insert_data(vault_id, large, b"x" * (blob_cache.max_file + 1))
+
+    file, content = asyncio.run(read_file(vault_id, small))
+    assert content == CachedFile(file.hash, 3, b"abc")
+    assert blob_cache.get(vault_id, small) == content
+
+    file, content = asyncio.run(read_file(vault_id, large))
+    assert file.uid == large and content is None
+    assert not blob_cache.contains(vault_id, large)
+    assert asyncio.run(read_file(vault_id, 2**40)) is None
+
+
+def test_prewarm_reads_listed_files():
+    vault_id = str(uuid4())
+    uids = []
+    for i in range(3):
+        uid = insert_metadata(new_file(vault_id, f"{i}.md", size=2))
+        insert_data(vault_id, uid, b"%02d" % i)
+        uids.append(uid)
+
+    assert asyncio.run(prewarm_files(vault_id, uids)) == 6
+    assert blob_cache.get(vault_id, uids[1]).data == b"01"
+    assert asyncio.run(prewarm_files(vault_id, uids)) == 0
+
+
+def test_concurrent_pulls_share_a_read():
+    vault_id = str(uuid4())
+    uid = insert_metadata(new_file(vault_id, "note.md", size=4))
+    insert_data(vault_id, uid, b"note")
+
+    async def run():
+        return await asyncio.gather(
+            *[read_file(vault_id, uid) for _ in range(5)]
+        )
+
+    reads = asyncio.run(run())
+    assert all(read is reads[0] for read in reads)
+
+
+def test_pulls_after_an_overwrite_read_the_new_content():
+    vault_id = str(uuid4())
+    uid = insert_metadata(new_file(vault_id, "a.md", size=3))
+    insert_data(vault_id, uid, b"old")
+    digest = shards.blob_store(vault_id).put(b"new")
+
+    async def run():
+        stale = asyncio.ensure_future(read_file(vault_id, uid))
+        await asyncio.sleep(0)
+        assert await overwrite_file(
+            vault_id, uid, new_file(vault_id, "a.md", size=3), (digest, 3)
+        )
+        fresh = await read_file(vault_id, uid)
+        await stale
+        return fresh
+
+    _, content = asyncio.run(run())
+    assert content.data == b"new"
+    assert blob_cache.get(vault_id, uid).data == b"new"
+
+
+def test_reads_racing_an_overwrite_get_the_new_content(monkeypatch):
+    vault_id = str(uuid4())
+    uid = insert_metadata(new_file(vault_id, "a.md", size=3))
+    insert_data(vault_id, uid, b"old")
+    digest = shards.blob_store(vault_id).put(b"new")
+    iter_file_data = vault_files_schema.iter_file_data
+
+    def overwritten(*args):
+        # The overwrite purges the blob the read is about to open
+        monkeypatch.setattr(
+            vault_files_schema, "iter_file_data", iter_file_data
+        )
+        file = new_file(vault_id, "a.md", size=3)
+        assert vault_files_schema.overwrite_file(
+            vault_id, uid, file, (digest, 3)
+        )
+        return iter_file_data(*args)
+
+    monkeypatch.setattr(vault_files_schema, "iter_file_data", overwritten)
+    _, data = vault_files_schema.read_file(vault_id, uid, max_size=1024)
+    assert data == b"new"
+
+
+def test_compaction_only_drops_the_deleted_versions():
+    vault_id = str(uuid4())
+    old = insert_metadata(new_file(vault_id, "a.md"))
+    newest = insert_metadata(new_file(vault_id, "a.md"))
+    for uid in (old, newest):
+        blob_cache.put(vault_id, uid, cached(1))
+
+    assert asyncio.run(snapshot(vault_id)) == (2, True)
+    assert not blob_cache.contains(vault_id, old)
+    assert blob_cache.contains(vault_id, newest)
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from obsync.db.blob_store import (
+    BlobTooLargeError,
+    FileBlobStore,
+    MemoryBlobStore,
+)
+
+
+def test_file_blob_store_put_get(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    digest = store.put(b"test data")
+    assert store.exists(digest)
+    assert store.get(digest) == b"test data"
+    assert store.path(digest).startswith(
+        os.path.join(str(tmp_path), digest[:2], digest[2:4])
+    )
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_file_blob_store_deduplicates(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    digest_1 = store.put(b"same data")
+    digest_2 = store.put(b"same data")
+    assert digest_1 == digest_2
+    assert store.put(b"other data") != digest_1
+
+
+def test_file_blob_store_delete(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    digest = store.put(b"test data")
+    store.delete(digest)
+    assert not store.exists(digest)
+    store.delete(digest)
+
+
+def test_memory_blob_store():
+    store = MemoryBlobStore()
+    digest = store.put(b"test data")
+    assert store.get(digest) == b"test data"
+    store.delete(digest)
+    assert not store.exists(digest)
+
+
+def test_blob_writer_in_memory(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    writer = store.writer(max_memory=16, max_size=1024)
+    writer.write(b"test ")
+    writer.write(b"data")
+    assert writer.spill is None
+    digest, size = writer.commit()
+    assert digest == store.digest(b"test data")
+    assert size == 9
+    assert store.get(digest) == b"test data"
+
+
+def test_blob_writer_spills_to_disk(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    writer = store.writer(max_memory=4, max_size=1024)
+    writer.write(b"test ")
+    writer.write(b"data")
+    assert writer.spill is not None
+    assert writer.buffer is None
+    digest, size = writer.commit()
+    writer.abort()
+    assert store.get(digest) == b"test data"
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_blob_writer_rejects_large_files(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    writer = store.writer(max_memory=4, max_size=8)
+    writer.write(b"test ")
+    with pytest.raises(BlobTooLargeError):
+        writer.write(b"data")
+    writer.abort()
+    assert os.listdir(store.tmp_dir) == []
@@ -0,0 +1,63 @@
+import asyncio
+
+from obsync.handler.bus import LocalBus, SQLiteBus
+
+
+def test_local_bus():
+    bus = LocalBus()
+    received = []
+
+    async def handler(vault_id, message):
+        received.append((vault_id, message))
+
+    bus.subscribe(handler)
+    asyncio.run(bus.publish("vault", {"op": "push"}))
+    assert received == [("vault", {"op": "push"})]
+    assert bus.published == [("vault", {"op": "push"})]
+
+
+def test_sqlite_bus_between_workers(tmp_path):
+    filename = str(tmp_path / "bus.db")
+    worker_1 = SQLiteBus(filename, poll_interval=0.01)
+    worker_2 = SQLiteBus(filename, poll_interval=0.01)
+    received_1 = []
+    received_2 = []
+
+    async def handler_1(vault_id, message):
+        received_1.append((vault_id, message))
+
+    async def handler_2(vault_id, message):
+        received_2.append((vault_id, message))
+
+    worker_1.subscribe(handler_1)
+    worker_2.subscribe(handler_2)
+    remote_1 = []
+    remote_2 = []
+
+    async def remote_handler_1(vault_id, message):
+        remote_1.append(vault_id)
+
+    async def remote_handler_2(vault_id, message):
+        remote_2.append(vault_id)
+
+    worker_1.subscribe_remote(remote_handler_1)
+    worker_2.subscribe_remote(remote_handler_2)
+
+    async def run():
+        await worker_1.start()
+        await worker_2.start()
+        await worker_1.publish("vault", {"op": "push", "uid": "1"})
+        for _ in range(100):
+            if len(received_2) > 0:
+                break
+            await asyncio.sleep(0.01)
+        # Give worker 1 a chance to see its own event
+        await asyncio.sleep(0.05)
+        await worker_1.stop()
+        await worker_2.stop()
+
+    asyncio.run(run())
+    assert received_1 == [("vault", {"op": "push", "uid": "1"})]
+    assert received_2 == [("vault", {"op": "push", "uid": "1"})]
+    assert remote_1 == []
+    assert remote_2 == ["vault"]
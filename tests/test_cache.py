@@ -0,0 +1,128 @@
+import asyncio
+import time
+from uuid import uuid1
+
+import jwt
+
+from obsync.db import access_cache, aio
+from obsync.db.access_cache import vault_cache
+from obsync.db.vault_index import VaultDelta
+from obsync.db.vault_schema import new_user, new_vault
+from obsync.handler.utils import get_jwt_email, token_cache
+from obsync.utils.cache import MISSING, TTLCache
+from tests.test_vault_files import new_file
+
+SECRET = "0" * 32
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == dict(size=2, hits=3, misses=1)
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(max_size=10, ttl=0.01)
+    cache.set("a", None)
+    assert cache.get("a") is None
+    time.sleep(0.02)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["size"] == 0
+
+
+def test_ttl_cache_skips_values_loaded_across_invalidation():
+    cache = TTLCache(max_size=10, ttl=60)
+    generation = cache.generation
+    assert cache.invalidate(lambda key: key[0] == "vault") == 0
+    cache.set(("vault", "a"), True, generation)
+    assert cache.get(("vault", "a")) is MISSING
+    cache.set(("vault", "a"), True, cache.generation)
+    cache.set(("other", "a"), True)
+    assert cache.invalidate(lambda key: key[0] == "vault") == 1
+    assert cache.get(("other", "a")) is True
+
+
+def test_jwt_email_is_cached():
+    token = jwt.encode({"email": "cache@example.com"}, SECRET, "HS256")
+    assert get_jwt_email(token, SECRET) == "cache@example.com"
+    hits = token_cache.hits
+    assert get_jwt_email(token, SECRET) == "cache@example.com"
+    assert token_cache.hits == hits + 1
+
+
+def test_vault_writes_invalidate_cache():
+    email = f"{uuid1()}@example.com"
+    new_user(name="Cache User", email=email, password="password")
+    vault = new_vault(
+        name=str(uuid1()),
+        user_email=email,
+        password="password",
+        salt="salt",
+        keyhash="keyhash",
+    )
+
+    async def run():
+        first = await aio.get_vault(id=vault.id, keyhash="keyhash")
+        misses = vault_cache.misses
+        assert await aio.get_vault(id=vault.id, keyhash="keyhash") is first
+        assert vault_cache.misses == misses
+        assert (
+            await aio.has_access_to_vault(vault.id, "other@example.com")
+            is False
+        )
+
+        await aio.set_vault_version(vault.id, first.version + 1)
+        second = await aio.get_vault(id=vault.id, keyhash="keyhash")
+        assert second.version == first.version + 1
+
+        await aio.share_vault_invite(
+            email="other@example.com", name="Other", vault_id=vault.id
+        )
+        assert await aio.has_access_to_vault(vault.id, "other@example.com")
+
+        assert await aio.delete_vault(id=vault.id, email=email) == 1
+        assert await aio.get_vault(id=vault.id, keyhash="keyhash") is None
+        assert not await aio.has_access_to_vault(vault.id, email)
+
+    asyncio.run(run())
+
+
+def test_maintenance_keeps_the_vault_cache(monkeypatch):
+    email = f"{uuid1()}@example.com"
+    vault = new_vault(
+        name=str(uuid1()),
+        user_email=email,
+        password="password",
+        salt="salt",
+        keyhash="keyhash",
+    )
+    deltas = []
+
+    async def record(vault_id, delta):
+        deltas.append((vault_id, delta))
+
+    monkeypatch.setattr(access_cache, "delta_listeners", [record])
+
+    async def run():
+        await aio.get_vault(id=vault.id, keyhash="keyhash")
+        await aio.insert_metadata(new_file(vault.id, "a.md"))
+        # Flagging the newest version a snapshot deletes nothing
+        assert await aio.snapshot(vault.id) == (1, True)
+        assert deltas == []
+
+        uid = await aio.insert_metadata(new_file(vault.id, "b.md"))
+        await aio.insert_metadata(new_file(vault.id, "b.md"))
+        assert await aio.snapshot(vault.id) == (2, True)
+        misses = vault_cache.misses
+        await aio.get_vault(id=vault.id, keyhash="keyhash")
+        assert vault_cache.misses == misses
+        return uid
+
+    uid = asyncio.run(run())
+    assert deltas == [(vault.id, VaultDelta(((uid, "b.md"),)))]
@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from obsync.handler.channel import ChannelManager, FanoutStats
+
+
+class FakeWebSocket(object):
+    def __init__(self, blocked: bool = False) -> None:
+        self.frames = []
+        self.blocked = blocked
+        self.closed = False
+
+    async def send_text(self, data: str) -> None:
+        if self.blocked:
+            await asyncio.Event().wait()
+        self.frames.append(json.loads(data))
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+
+
+def test_broadcast_to_all_clients():
+    async def run():
+        channel = ChannelManager(max_queue=4)
+        clients = [FakeWebSocket() for _ in range(3)]
+        for client in clients:
+            channel.add_client(client)
+        await channel.broadcast({"op": "push", "path": "a.md"})
+        await asyncio.sleep(0.01)
+        return channel, clients
+
+    channel, clients = asyncio.run(run())
+    for client in clients:
+        assert client.frames == [{"op": "push", "path": "a.md"}]
+    stats = channel.stats.to_dict()
+    assert stats["broadcasts"] == 1
+    assert stats["delivered"] == 3
+
+
+def test_slow_client_is_evicted():
+    async def run():
+        channel = ChannelManager(max_queue=2)
+        slow = FakeWebSocket(blocked=True)
+        fast = FakeWebSocket()
+        channel.add_client(slow)
+        channel.add_client(fast)
+        for i in range(5):
+            await channel.broadcast({"op": "push", "uid": i})
+            await asyncio.sleep(0.01)
+        return channel, slow, fast
+
+    channel, slow, fast = asyncio.run(run())
+    assert [f["uid"] for f in fast.frames] == [0, 1, 2, 3, 4]
+    assert slow.closed
+    assert slow not in channel.clients
+    assert channel.stats.evicted == 1
+
+
+def test_stats_outlive_the_channel():
+    async def run():
+        stats = FanoutStats()
+        for _ in range(2):
+            channel = ChannelManager(max_queue=4, stats=stats)
+            client = FakeWebSocket()
+            channel.add_client(client)
+            await channel.broadcast({"op": "push", "path": "a.md"})
+            await asyncio.sleep(0.01)
+            channel.remove_client(client)
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats.broadcasts == 2
+    assert stats.delivered == 2
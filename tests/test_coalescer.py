@@ -0,0 +1,106 @@
+import asyncio
+from uuid import uuid1
+
+import pytest
+
+from obsync.db.coalescer import WriteCoalescer
+from obsync.db.shards import shards
+from obsync.db.vault_files_schema import (
+    delete_vault_file,
+    get_vault_files,
+    insert_metadata,
+)
+from tests.test_vault_files import new_file
+
+
+def fail() -> None:
+    raise ValueError("bad write")
+
+
+def test_concurrent_writes_share_a_transaction():
+    vault_id = str(uuid1())
+    coalescer = WriteCoalescer(max_delay=0.05, max_ops=64)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                coalescer.submit(
+                    insert_metadata,
+                    vault_file=new_file(vault_id, f"{i}.md", modified=i + 1),
+                )
+                for i in range(10)
+            ],
+            coalescer.submit(delete_vault_file, vault_id, "0.md"),
+        )
+
+    results = asyncio.run(run())
+    assert len(set(results[:10])) == 10
+    assert coalescer.stats()["batches"] == 1
+    assert coalescer.stats()["ops"] == 11
+    paths = {f.path for f in get_vault_files(vault_id)}
+    assert paths == {f"{i}.md" for i in range(1, 10)}
+
+
+def test_batches_are_capped_at_max_ops():
+    vault_id = str(uuid1())
+    coalescer = WriteCoalescer(max_delay=10, max_ops=3)
+
+    async def run():
+        await asyncio.gather(
+            *[
+                coalescer.submit(
+                    insert_metadata,
+                    vault_file=new_file(vault_id, f"{i}.md"),
+                )
+                for i in range(6)
+            ]
+        )
+
+    asyncio.run(run())
+    assert coalescer.stats()["batches"] == 2
+    assert coalescer.stats()["max_batch"] == 3
+    assert len(get_vault_files(vault_id)) == 6
+
+
+def test_failed_write_does_not_fail_the_batch():
+    vault_id = str(uuid1())
+    coalescer = WriteCoalescer(max_delay=0.05, max_ops=64)
+
+    async def run():
+        return await asyncio.gather(
+            coalescer.submit(
+                insert_metadata, vault_file=new_file(vault_id, "a.md")
+            ),
+            coalescer.submit(fail),
+            coalescer.submit(
+                insert_metadata, vault_file=new_file(vault_id, "b.md")
+            ),
+            return_exceptions=True,
+        )
+
+    first, failed, last = asyncio.run(run())
+    assert isinstance(first, int)
+    assert isinstance(last, int)
+    with pytest.raises(ValueError):
+        raise failed
+    assert {f.path for f in get_vault_files(vault_id)} == {"a.md", "b.md"}
+
+
+def test_transactions_do_not_span_shards():
+    vault_ids = [str(uuid1()) for _ in range(3)]
+    coalescer = WriteCoalescer(max_delay=0.05, max_ops=64)
+
+    async def run():
+        await asyncio.gather(
+            *[
+                coalescer.submit_to(
+                    vault_id,
+                    insert_metadata,
+                    vault_file=new_file(vault_id, "a.md"),
+                )
+                for vault_id in vault_ids
+            ]
+        )
+
+    asyncio.run(run())
+    assert coalescer.stats()["batches"] == (1 if shards.root is None else 3)
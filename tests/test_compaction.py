@@ -0,0 +1,56 @@
+import asyncio
+from uuid import uuid4
+
+from obsync.db.compaction import CompactionScheduler
+from obsync.db.shards import shards
+from obsync.db.vault_files_schema import (
+    get_file_history,
+    get_vault_stats,
+    insert_metadata,
+)
+from tests.test_vault_files import new_file
+
+
+def push(vault_id: str, path: str, content: bytes) -> None:
+    blob = (shards.blob_store(vault_id).put(content), len(content))
+    insert_metadata(
+        vault_file=new_file(vault_id, path, size=len(content)), blob=blob
+    )
+
+
+def test_compaction_respects_row_budget():
+    vault_id = str(uuid4())
+    for i in range(6):
+        push(vault_id, "a.md", f"version {i}".encode())
+
+    scheduler = CompactionScheduler(interval=0, delay=0, row_budget=3)
+    scheduler.mark_dirty(vault_id)
+    scheduler.mark_dirty(vault_id)
+    assert scheduler.to_dict()["pending"] == 1
+
+    # 1 newest row flipped to snapshot and 2 old versions removed
+    assert asyncio.run(scheduler.run_once()) == 3
+    assert len(get_file_history(vault_id, "a.md")[0]) == 4
+    assert vault_id in scheduler.dirty
+
+    assert asyncio.run(scheduler.run_once()) == 3
+    assert asyncio.run(scheduler.run_once()) == 0
+    assert vault_id not in scheduler.dirty
+    assert len(get_file_history(vault_id, "a.md")[0]) == 1
+
+    stats = get_vault_stats(vault_id)
+    assert stats.version_count == 1
+    assert stats.total_bytes == len(b"version 5")
+    assert scheduler.to_dict()["rows_rewritten"] == 6
+
+
+def test_compaction_waits_for_delay():
+    vault_id = str(uuid4())
+    push(vault_id, "a.md", b"one")
+    push(vault_id, "a.md", b"two")
+
+    scheduler = CompactionScheduler(interval=0, delay=3600, row_budget=100)
+    scheduler.mark_dirty(vault_id)
+    assert asyncio.run(scheduler.run_once()) == 0
+    assert asyncio.run(scheduler.run_once(force=True)) == 2
+    assert len(get_file_history(vault_id, "a.md")[0]) == 1
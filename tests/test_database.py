@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+from pony.orm import db_session
+
+from obsync.db.database import (
+    PRAGMAS,
+    apply_pragmas,
+    bound_filename,
+    checkpoint_wal,
+    db,
+    effective_pragmas,
+    wal_size,
+)
+from obsync.utils.config import resolve_vault_db
+
+
+def test_connections_use_configured_pragmas():
+    with db_session:
+        pragmas = effective_pragmas(db.get_connection())
+    assert pragmas["journal_mode"] == PRAGMAS["journal_mode"]
+    assert pragmas["busy_timeout"] == PRAGMAS["busy_timeout"]
+    assert pragmas["cache_size"] == PRAGMAS["cache_size"]
+
+
+def test_checkpoint_truncates_large_wal(tmp_path):
+    filename = str(tmp_path / "vaults.db")
+    con = sqlite3.connect(filename, isolation_level=None)
+    apply_pragmas(con)
+    con.execute("PRAGMA wal_autocheckpoint = 0")
+    con.execute("CREATE TABLE t (data BLOB)")
+    for _ in range(20):
+        con.execute("INSERT INTO t VALUES (randomblob(8192))")
+    assert wal_size(filename) > 0
+
+    mode, busy, _, _ = checkpoint_wal(1 << 30, filename)
+    assert (mode, busy) == ("PASSIVE", 0)
+    assert wal_size(filename) > 0
+
+    mode, busy, _, _ = checkpoint_wal(0, filename)
+    assert (mode, busy) == ("TRUNCATE", 0)
+    assert wal_size(filename) == 0
+    con.close()
+
+
+def test_checkpoints_use_the_bound_file():
+    filename = bound_filename(db)
+    assert os.path.isabs(filename) and os.path.exists(filename)
+
+
+def test_a_database_of_an_earlier_version_stays_in_use(tmp_path, monkeypatch):
+    legacy_root = tmp_path / "obsync" / "db"
+    (legacy_root / "data").mkdir(parents=True)
+    (tmp_path / "cwd").mkdir()
+    monkeypatch.chdir(tmp_path / "cwd")
+    moved = str(tmp_path / "cwd" / "data" / "vaults.db")
+    assert resolve_vault_db("data", str(legacy_root)) == moved
+
+    (legacy_root / "data" / "vaults.db").touch()
+    legacy = str(legacy_root / "data" / "vaults.db")
+    assert resolve_vault_db("data", str(legacy_root)) == legacy
+
+    (tmp_path / "cwd" / "data").mkdir()
+    (tmp_path / "cwd" / "data" / "vaults.db").touch()
+    assert resolve_vault_db("data", str(legacy_root)) == moved
@@ -0,0 +1,54 @@
+import asyncio
+
+from obsync.handler.debounce import PushDebouncer
+
+
+def debouncer(window):
+    published = []
+
+    async def publish(vault_id, message):
+        published.append(message["hash"])
+
+    return PushDebouncer(window, publish), published
+
+
+def test_deletes_cancel_held_broadcasts():
+    pushes, published = debouncer(0.05)
+
+    async def run():
+        await pushes.broadcast("vault", "a.md", {"hash": "a"})
+        await pushes.broadcast("vault", "a.md", {"hash": "b"})
+        await pushes.broadcast("vault", "b.md", {"hash": "c"})
+        await pushes.broadcast("vault", "a.md", {"hash": "d", "deleted": True})
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert published == ["a", "c", "d"]
+    assert len(pushes.paths) == 1
+
+
+def test_only_the_same_source_overwrites():
+    pushes, _ = debouncer(60)
+    pushes.pushed("vault", "a.md", "laptop", 1)
+    assert pushes.target("vault", "a.md", "laptop") == 1
+    assert pushes.target("vault", "a.md", "phone") is None
+    assert pushes.target("vault", "b.md", "laptop") is None
+
+    pushes.pushed("vault", "a.md", "phone", 2)
+    assert pushes.target("vault", "a.md", "laptop") is None
+    pushes.cancel("vault", "a.md")
+    assert pushes.target("vault", "a.md", "phone") is None
+
+
+def test_disabled_debouncer_keeps_nothing():
+    pushes, published = debouncer(0)
+    pushes.pushed("vault", "a.md", "laptop", 1)
+    assert pushes.target("vault", "a.md", "laptop") is None
+
+    async def run():
+        for hash in ("a", "b"):
+            await pushes.broadcast("vault", "a.md", {"hash": hash})
+
+    asyncio.run(run())
+    assert published == ["a", "b"]
+    assert len(pushes.paths) == 0
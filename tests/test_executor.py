@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+from obsync.db.executor import DatabaseExecutor
+
+
+def test_writes_run_on_a_single_thread():
+    executor = DatabaseExecutor(read_workers=2)
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                executor.write(lambda: threading.current_thread().name)
+                for _ in range(8)
+            ]
+        )
+
+    names = asyncio.run(run())
+    executor.shutdown()
+    assert len(set(names)) == 1
+    assert names[0].startswith("db-write")
+
+
+def test_stats():
+    executor = DatabaseExecutor(read_workers=2)
+
+    async def run():
+        return await executor.read(sum, [1, 2, 3])
+
+    assert asyncio.run(run()) == 6
+    stats = executor.stats()
+    executor.shutdown()
+    assert stats["read"]["completed"] == 1
+    assert stats["read"]["queued"] == 0
+    assert stats["write"]["completed"] == 0
@@ -0,0 +1,62 @@
+import asyncio
+from uuid import uuid1
+
+from obsync.db import aio
+from obsync.utils.kdf import (
+    KDFBusyError,
+    KDFPool,
+    check_password,
+    hash_password,
+)
+
+
+def test_password_round_trip():
+    hashed = hash_password("secret")
+    assert check_password("secret", hashed)
+    assert not check_password("wrong", hashed)
+
+
+def test_pool_rejects_past_max_pending():
+    pool = KDFPool(workers=1, max_pending=1)
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                pool.run(hash_password, "a"),
+                pool.run(hash_password, "b"),
+                return_exceptions=True,
+            )
+        finally:
+            await pool.shutdown()
+
+    first, second = asyncio.run(run())
+    assert check_password("a", first)
+    assert isinstance(second, KDFBusyError)
+    stats = pool.stats()
+    assert stats["completed"] == 1
+    assert stats["rejected"] == 1
+    assert stats["pending"] == 0
+
+
+def test_existing_users_and_vaults_skip_the_kdf(monkeypatch):
+    email = f"{uuid1()}@kdf.test"
+    runs = []
+    run_kdf = aio.kdf_pool.run
+
+    async def counted(func, *args):
+        runs.append(func)
+        return await run_kdf(func, *args)
+
+    monkeypatch.setattr(aio.kdf_pool, "run", counted)
+
+    async def run():
+        try:
+            user = await aio.new_user("kdf", email, "secret")
+            vault = await aio.new_vault("v", email, "pw", "salt", "")
+            assert await aio.new_user("kdf", email, "other") == user
+            assert await aio.new_vault("v", email, "pw", "salt", "") == vault
+        finally:
+            await aio.kdf_pool.shutdown()
+
+    asyncio.run(run())
+    assert len(runs) == 2
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from uuid import uuid4
+
+from obsync.db.vault_files_schema import (
+    VaultFileModel,
+    advance_vault_seq,
+    delete_vault_file,
+    get_vault_seq,
+    insert_metadata,
+)
+from obsync.handler.manifest import send_manifest
+
+
+class FakeWebSocket(object):
+    def __init__(self) -> None:
+        self.frames = []
+
+    async def send_text(self, data: str) -> None:
+        self.frames.append(json.loads(data))
+
+
+def insert_file(vault_id: str, path: str) -> int:
+    return insert_metadata(
+        vault_file=VaultFileModel(
+            uid=uuid4().int >> 97,
+            vault_id=vault_id,
+            hash="hash",
+            path=path,
+            extension="md",
+            size=0,
+            created=1,
+            modified=2,
+            folder=False,
+            deleted=False,
+        )
+    )
+
+
+def test_send_full_manifest():
+    vault_id = str(uuid4())
+    for i in range(7):
+        insert_file(vault_id, f"{i}.md")
+    delete_vault_file(vault_id, "0.md")
+
+    websocket = FakeWebSocket()
+    sent = asyncio.run(
+        send_manifest(websocket, vault_id, since=None, batch_size=3)
+    )
+    assert sent == 6
+    assert sorted(f["path"] for f in websocket.frames) == [
+        f"{i}.md" for i in range(1, 7)
+    ]
+    assert websocket.frames[0]["op"] == "push"
+    assert websocket.frames[0]["mtime"] == 2
+
+
+def test_send_changed_files():
+    vault_id = str(uuid4())
+    advance_vault_seq(vault_id, 0)
+    for i in range(5):
+        insert_file(vault_id, f"{i}.md")
+    since = get_vault_seq(vault_id)
+    insert_file(vault_id, "1.md")
+    insert_file(vault_id, "5.md")
+    delete_vault_file(vault_id, "2.md")
+
+    websocket = FakeWebSocket()
+    sent = asyncio.run(
+        send_manifest(websocket, vault_id, since=since, batch_size=2)
+    )
+    assert sent == 3
+    assert [(f["path"], f["deleted"]) for f in websocket.frames] == [
+        ("1.md", False),
+        ("5.md", False),
+        ("2.md", True),
+    ]
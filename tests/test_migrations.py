@@ -0,0 +1,111 @@
+import sqlite3
+
+from pony.orm import db_session
+
+from obsync.db.database import db
+from obsync.db.migrations import MIGRATIONS, run_migrations, table_columns
+
+
+def query_plan(db, sql: str) -> str:
+    with db_session:
+        rows = db.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    return " ".join(row[-1] for row in rows)
+
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "vaults.db"))
+    con.execute(
+        "CREATE TABLE vault_file (uid INTEGER PRIMARY KEY, vault_id TEXT,"
+        " path TEXT, hash TEXT, modified INTEGER, newest BOOLEAN,"
+        " deleted BOOLEAN, data BLOB)"
+    )
+    con.execute(
+        "CREATE TABLE share (uid TEXT PRIMARY KEY, email TEXT, name TEXT)"
+    )
+    con.commit()
+
+    assert run_migrations(con) == len(MIGRATIONS)
+    assert "blob" in table_columns(con, "vault_file")
+    indexes = {
+        row[0]
+        for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert "idx_vault_file__vault_id_newest_deleted" in indexes
+    assert "idx_vault_file__vault_id_path_newest" in indexes
+    assert "idx_vault_file__vault_id_path_modified" in indexes
+    assert "idx_vault_file__vault_id_hash" in indexes
+    assert "idx_share__email" in indexes
+
+    # Running again is a no-op
+    assert run_migrations(con) == len(MIGRATIONS)
+
+
+def test_get_vault_files_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT * FROM vault_file WHERE vault_id = 'v'"
+        " AND deleted = 0 AND newest = 1",
+    )
+    assert "USING INDEX idx_vault_file__vault_id_newest_deleted" in plan
+
+
+def test_insert_metadata_lookup_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT * FROM vault_file WHERE vault_id = 'v'"
+        " AND path = 'p' AND newest = 1",
+    )
+    assert "USING INDEX idx_vault_file__vault_id_path_newest" in plan
+
+
+def test_duplicate_blob_lookup_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT blob FROM vault_file WHERE vault_id = 'v'"
+        " AND hash = 'h' AND size = 1",
+    )
+    assert "USING INDEX idx_vault_file__vault_id_hash" in plan
+
+
+def test_get_file_history_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT * FROM vault_file WHERE vault_id = 'v' AND path = 'p'"
+        " AND (modified, uid) < (1, 1) ORDER BY modified DESC, uid DESC",
+    )
+    assert "USING INDEX idx_vault_file__vault_id_path_modified" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_get_deleted_files_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT * FROM vault_file WHERE vault_id = 'v'"
+        " AND newest = 1 AND deleted = 1 AND uid < 10 ORDER BY uid DESC",
+    )
+    assert "USING INDEX idx_vault_file__vault_id_newest_deleted" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_get_vault_size_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT SUM(size) FROM vault_file WHERE vault_id = 'v'",
+    )
+    assert "USING INDEX idx_vault_file__vault_id" in plan
+
+
+def test_get_shared_vaults_uses_index():
+    plan = query_plan(
+        db,
+        "SELECT v.* FROM vault v, share s"
+        " WHERE s.email = 'e' AND s.vault_id = v.id",
+    )
+    assert "USING INDEX idx_share__email" in plan
+
+
+def test_get_vaults_uses_index():
+    plan = query_plan(db, "SELECT * FROM vault WHERE user_email = 'e'")
+    assert "USING INDEX idx_vault__user_email" in plan
@@ -0,0 +1,36 @@
+import asyncio
+
+from obsync.utils.periodic import PeriodicTask, ProcessLock
+
+
+def test_one_process_holds_the_lock(tmp_path):
+    filename = str(tmp_path / "maintenance.lock")
+    holder, other = ProcessLock(filename), ProcessLock(filename)
+    assert holder.acquire() and holder.acquire()
+    assert not other.acquire()
+
+    holder.release()
+    assert other.acquire()
+    other.release()
+
+
+def test_tasks_only_run_while_holding_the_lock(tmp_path):
+    filename = str(tmp_path / "maintenance.lock")
+    holder = ProcessLock(filename)
+    assert holder.acquire()
+    runs = []
+
+    async def run():
+        runs.append(1)
+
+    async def main():
+        task = PeriodicTask("test", 0.01, run, ProcessLock(filename))
+        await task.start()
+        await asyncio.sleep(0.05)
+        assert len(runs) == 0
+        holder.release()
+        await asyncio.sleep(0.05)
+        await task.stop()
+
+    asyncio.run(main())
+    assert len(runs) > 0
@@ -0,0 +1,39 @@
+import pytest
+
+from obsync.handler import protocol
+from obsync.handler.protocol import (
+    HistoryRequest,
+    ProtocolError,
+    PullRequest,
+    PushRequest,
+)
+
+
+def test_decode_ops():
+    message = protocol.decode('{"op": "pull", "uid": "12"}')
+    assert isinstance(message, PullRequest)
+    assert message.uid == 12
+
+    message = protocol.decode(b'{"op": "history", "path": "a.md"}')
+    assert isinstance(message, HistoryRequest)
+    assert message.last is None
+
+
+def test_decode_push_keeps_extra_fields():
+    message = protocol.decode(
+        '{"op": "push", "path": "a.md", "hash": "h", "size": 3,'
+        ' "pieces": 1, "device": "phone"}'
+    )
+    assert isinstance(message, PushRequest)
+    dumped = message.model_dump()
+    assert dumped["device"] == "phone"
+    assert dumped["op"] == "push"
+
+
+def test_decode_unknown_and_invalid():
+    assert protocol.decode('{"op": "unknown"}') is None
+    assert protocol.decode('{"uid": 1}') is None
+    with pytest.raises(ProtocolError, match="uid"):
+        protocol.decode('{"op": "pull", "uid": "x"}')
+    with pytest.raises(ProtocolError):
+        protocol.decode("not json")
@@ -0,0 +1,145 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from obsync.db.maintenance import prune_vault
+from obsync.db.retention import (
+    RetentionPolicy,
+    default_policy,
+    parse_buckets,
+    select_pruned,
+)
+from obsync.db.vault_files_schema import (
+    delete_vault_file,
+    get_changes,
+    get_file_history,
+    get_retention_policy,
+    get_vault_seq,
+    get_vault_stats,
+    insert_metadata,
+    prune_tombstones,
+    prune_versions,
+    set_retention_policy,
+)
+from obsync.db.vault_index import VaultDelta
+from obsync.db.vault_schema import new_vault
+from set_retention import parse_args, update_policy
+from tests.test_vault_files import new_file
+
+HOUR = 60 * 60 * 1000
+DAY = 24 * HOUR
+
+
+def test_parse_buckets():
+    assert parse_buckets("1d:30d, 1h:1d") == [(HOUR, DAY), (DAY, 30 * DAY)]
+    with pytest.raises(ValueError):
+        parse_buckets("1x:1d")
+
+
+def test_select_pruned_keep_versions():
+    versions = [(uid, 0) for uid in range(5)]
+    policy = RetentionPolicy(keep_versions=2)
+    assert select_pruned(versions, policy, now=0) == [2, 3, 4]
+    assert select_pruned(versions, RetentionPolicy(), now=0) == []
+
+
+def test_select_pruned_buckets():
+    now = 100 * DAY
+    versions = [
+        (1, now - 10),
+        # two versions in the same hour, the newer one is kept
+        (2, now - 2 * HOUR + 10),
+        (3, now - 2 * HOUR + 5),
+        # two versions on the same day a week ago
+        (4, now - 7 * DAY + 10),
+        (5, now - 7 * DAY + 5),
+        # older than every bucket
+        (6, now - 60 * DAY),
+    ]
+    policy = RetentionPolicy(buckets="1h:1d,1d:30d")
+    assert select_pruned(versions, policy, now) == [3, 5, 6]
+
+
+def test_prune_versions():
+    vault_id = str(uuid4())
+    for size in range(1, 6):
+        insert_metadata(
+            vault_file=new_file(vault_id, "a.md", size=size, modified=size)
+        )
+    insert_metadata(vault_file=new_file(vault_id, "b.md", size=1))
+
+    policy = RetentionPolicy(keep_versions=2)
+    removed, after, delta = prune_versions(vault_id, policy, "", 1, now=0)
+    assert (removed, after) == (3, "a.md")
+    assert {path for _, path in delta.removed} == {"a.md"}
+    assert (len(delta.removed), delta.added) == (3, -6)
+    assert prune_versions(vault_id, policy, after, 1, now=0) == (
+        0,
+        None,
+        VaultDelta(),
+    )
+
+    history, _ = get_file_history(vault_id, "a.md")
+    assert sorted(f.size for f in history) == [4, 5]
+    stats = get_vault_stats(vault_id)
+    assert stats.version_count == 3
+    assert stats.total_bytes == 10
+
+
+def test_prune_tombstones():
+    vault_id = str(uuid4())
+    insert_metadata(vault_file=new_file(vault_id, "a.md", size=1))
+    insert_metadata(vault_file=new_file(vault_id, "a.md", size=2))
+    insert_metadata(vault_file=new_file(vault_id, "b.md", size=3))
+    delete_vault_file(vault_id, "a.md")
+    seq = get_vault_seq(vault_id)
+
+    assert prune_tombstones(vault_id, 0, 10)[:2] == (0, True)
+    removed, done, delta = prune_tombstones(vault_id, 2**62, 10)
+    assert (removed, done) == (2, True)
+    assert delta.compacted == seq and delta.added == -3
+    assert get_file_history(vault_id, "a.md") == ([], False)
+    # Clients behind the tombstone must resync from a full manifest
+    assert get_changes(vault_id, seq - 1) is None
+
+    stats = get_vault_stats(vault_id)
+    assert stats.tombstone_count == 0
+    assert stats.file_count == 1
+
+
+def test_per_vault_policy():
+    vault_id = str(uuid4())
+    for size in range(1, 4):
+        insert_metadata(vault_file=new_file(vault_id, "a.md", size=size))
+
+    # The server wide default keeps everything
+    assert asyncio.run(prune_vault(vault_id, 10)) == 0
+    set_retention_policy(vault_id, RetentionPolicy(keep_versions=1))
+    assert asyncio.run(prune_vault(vault_id, 10)) == 2
+    assert len(get_file_history(vault_id, "a.md")[0]) == 1
+    set_retention_policy(vault_id, None)
+
+
+def test_policies_are_changed_from_the_command_line():
+    vault = new_vault(
+        name=str(uuid4()),
+        user_email="retention@example.com",
+        password="password",
+        salt="salt",
+        keyhash="keyhash",
+    )
+    args = parse_args([vault.id, "--keep-versions", "2", "-b", "1h:1d"])
+    assert update_policy(args) == RetentionPolicy(
+        keep_versions=2, buckets="1h:1d"
+    )
+    update_policy(parse_args([vault.id, "--tombstone-days", "7"]))
+    assert get_retention_policy(vault.id) == RetentionPolicy(
+        keep_versions=2, buckets="1h:1d", tombstone_days=7
+    )
+
+    with pytest.raises(SystemExit):
+        update_policy(parse_args([vault.id, "--buckets", "1x"]))
+    with pytest.raises(SystemExit):
+        update_policy(parse_args([str(uuid4()), "--keep-versions", "1"]))
+    assert update_policy(parse_args([vault.id, "--reset"])) == default_policy()
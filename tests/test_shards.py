@@ -0,0 +1,53 @@
+import pytest
+from pony.orm import db_session
+
+from obsync.db.executor import DatabaseExecutor, vault_key
+from obsync.db.shards import ShardPool
+
+
+def test_unsharded_pool_uses_central_database():
+    pool = ShardPool(root=None, max_open=2)
+    assert pool.get("a") is pool.central
+    assert pool.get("b") is pool.central
+    assert pool.vault_ids() == []
+
+
+def test_shards_are_evicted_least_recently_used(tmp_path):
+    pool = ShardPool(root=str(tmp_path), max_open=2)
+    a = pool.get("a")
+    pool.get("b")
+    assert pool.get("a") is a
+    pool.get("c")
+    assert list(pool.open) == ["a", "c"]
+    assert pool.stats() == dict(open=2, opened=3, evicted=1)
+    assert pool.vault_ids() == ["a", "b", "c"]
+
+    shard = pool.get("b")
+    with db_session:
+        shard.VaultFile(
+            vault_id="b", path="note.md", hash="", size=0, modified=0
+        )
+    with db_session:
+        assert shard.VaultFile.select().count() == 1
+    assert pool.get("a").VaultFile is not shard.VaultFile
+
+
+def test_shard_paths_reject_invalid_vault_ids(tmp_path):
+    pool = ShardPool(root=str(tmp_path), max_open=2)
+    assert pool.path("vault-1_a") == str(tmp_path / "vault-1_a.db")
+    for vault_id in ("../a", "a/b", "", "a.db"):
+        with pytest.raises(ValueError):
+            pool.path(vault_id)
+
+
+def test_writes_of_a_vault_stay_on_one_writer():
+    executor = DatabaseExecutor(read_workers=1, write_workers=4)
+
+    def push(vault_id, path):
+        return vault_id
+
+    key = vault_key(push)
+    assert key("v1", "a") == key(vault_id="v1", path="b") == "v1"
+    assert executor.writer_for("v1") is executor.writer_for("v1")
+    assert len({executor.writer_for(str(n)) for n in range(32)}) == 4
+    executor.shutdown()
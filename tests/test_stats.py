@@ -0,0 +1,20 @@
+import asyncio
+import logging
+
+from obsync.handler.stats import log_worker_stats, worker_stats
+from obsync.utils import fastjson
+
+
+def test_worker_stats_are_logged(caplog):
+    stats = worker_stats()
+    assert stats["db"]["read"]["queued"] == 0
+    assert "pending" in stats["compaction"]
+    assert stats["fanout"]["evicted"] == 0
+    assert stats["kdf"]["pending"] == 0
+    assert "hits" in stats["blob_cache"]
+
+    with caplog.at_level(logging.INFO, logger="ob-sync"):
+        asyncio.run(log_worker_stats())
+    line = caplog.records[-1].getMessage()
+    assert line.startswith("Worker stats: ")
+    assert fastjson.loads(line[len("Worker stats: ") :]).keys() == stats.keys()
@@ -160,7 +160,7 @@ def test_share_vault_revoke(test_user):
     )
     share = get_vault_shares(vault.id)[0]
     share_vault_revoke(
-        share_id=share.id,
+        share_id=share.uid,
         vault_id=vault.id,
         email="",
     )
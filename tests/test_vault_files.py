@@ -1,23 +1,64 @@
 from uuid import uuid4
+
+import pytest
+from pony.orm import db_session
+
+from obsync.db.blob_store import BlobMissingError
+from obsync.db.shards import shards
 from obsync.db.vault_files_schema import (
     VaultFileModel,
-    restore_file,
-    insert_metadata,
-    insert_data,
+    advance_vault_seq,
+    compute_vault_stats,
+    delete_vault_file,
+    get_changes,
+    get_data_size,
+    get_deleted_files,
     get_file,
+    get_file_history,
+    get_vault_seq,
+    get_vault_size,
+    get_vault_stats,
+    insert_data,
+    insert_metadata,
+    iter_file_data,
+    overwrite_file,
+    reconcile_vault_stats,
+    snapshot,
 )
 
 
+def new_uid() -> int:
+    return uuid4().int >> 97
+
+
+def new_file(
+    vault_id: str, path: str, size: int = 0, modified: int = 0
+) -> VaultFileModel:
+    return VaultFileModel(
+        uid=new_uid(),
+        vault_id=vault_id,
+        hash="hash",
+        path=path,
+        extension="md",
+        size=size,
+        created=0,
+        modified=modified,
+        folder=False,
+        deleted=False,
+        data=None,
+    )
+
+
 def test_insert_meta_data():
-    id = uuid4()
-    vault_id = uuid4()
+    uid = new_uid()
+    vault_id = str(uuid4())
     hash = "hash"
     path = "/path/to/file"
     extension = "txt"
 
     file_id = insert_metadata(
         vault_file=VaultFileModel(
-            id=id,
+            uid=uid,
             vault_id=vault_id,
             hash=hash,
             path=path,
@@ -33,10 +74,10 @@ def test_insert_meta_data():
         )
     )
 
-    assert id == file_id
-    file_model = get_file(id=file_id)
+    assert uid == file_id
+    file_model = get_file(vault_id, uid=file_id)
     assert file_model is not None
-    assert file_model.id == file_id
+    assert file_model.uid == file_id
     assert file_model.vault_id == vault_id
     assert file_model.hash == hash
     assert file_model.path == path
@@ -44,15 +85,15 @@ def test_insert_meta_data():
 
 
 def test_insert_data():
-    id = uuid4()
-    vault_id = uuid4()
+    uid = new_uid()
+    vault_id = str(uuid4())
     hash = "hash"
     path = "/path/to/file"
     extension = "txt"
 
     file_id = insert_metadata(
         vault_file=VaultFileModel(
-            id=id,
+            uid=uid,
             vault_id=vault_id,
             hash=hash,
             path=path,
@@ -69,13 +110,172 @@ def test_insert_data():
     )
 
     data = b"test data 1"
-    insert_data(id=file_id, data=data)
-    file_model = get_file(id=id)
+    insert_data(vault_id, uid=file_id, data=data)
+    file_model = get_file(vault_id, uid=uid)
     assert file_model is not None
-    assert file_model.id == id
-    assert file_model.data == data
+    assert file_model.uid == uid
+    assert b"".join(iter_file_data(vault_id, file_model, 1024)) == data
 
     data = b"test data 2"
-    insert_data(id=file_id, data=data)
-    file_model = get_file(id=id)
-    assert file_model.data == data
+    insert_data(vault_id, uid=file_id, data=data)
+    file_model = get_file(vault_id, uid=uid)
+    assert b"".join(iter_file_data(vault_id, file_model, 1024)) == data
+
+
+def test_purged_blobs_are_not_referenced():
+    vault_id = str(uuid4())
+    blobs = shards.blob_store(vault_id)
+    digest = blobs.put(b"content")
+    # Purged by a release after the push stored it
+    blobs.delete(digest)
+    with pytest.raises(BlobMissingError):
+        insert_metadata(new_file(vault_id, "a.md", size=7), (digest, 7))
+    assert get_file_history(vault_id, "a.md")[0] == []
+
+
+def test_iter_file_data():
+    uid = new_uid()
+    vault_id = str(uuid4())
+    file_id = insert_metadata(
+        vault_file=VaultFileModel(
+            uid=uid,
+            vault_id=vault_id,
+            hash="hash",
+            path="/path/to/file",
+            extension="txt",
+            size=10,
+            created=0,
+            modified=0,
+            folder=False,
+            deleted=False,
+            data=None,
+            newest=True,
+            is_snapshot=False,
+        )
+    )
+    data = b"0123456789"
+    insert_data(vault_id, uid=file_id, data=data)
+
+    file_model = get_file(vault_id, uid=file_id)
+    assert get_data_size(vault_id, file_model) == len(data)
+    pieces = list(iter_file_data(vault_id, file_model, piece_size=4))
+    assert pieces == [b"0123", b"4567", b"89"]
+
+
+def test_get_changes():
+    vault_id = str(uuid4())
+    assert get_vault_seq(vault_id) is None
+    assert advance_vault_seq(vault_id, 0) == 0
+
+    insert_metadata(vault_file=new_file(vault_id, "a.md"))
+    insert_metadata(vault_file=new_file(vault_id, "b.md"))
+    insert_metadata(vault_file=new_file(vault_id, "c.md"))
+    since = get_vault_seq(vault_id)
+    assert since == 3
+
+    uid = insert_metadata(vault_file=new_file(vault_id, "a.md"))
+    delete_vault_file(vault_id, "b.md")
+    changes = get_changes(vault_id, since)
+    assert [(f.path, f.deleted) for f in changes] == [
+        ("a.md", False),
+        ("b.md", True),
+    ]
+    assert changes[0].uid == uid
+    assert get_changes(vault_id, get_vault_seq(vault_id)) == []
+
+
+def test_get_changes_after_compaction():
+    vault_id = str(uuid4())
+    advance_vault_seq(vault_id, 10)
+    insert_metadata(vault_file=new_file(vault_id, "a.md"))
+    insert_metadata(vault_file=new_file(vault_id, "b.md", size=10))
+    assert len(get_changes(vault_id, 10)) == 2
+    assert get_changes(vault_id, 9) is None
+
+    # b.md never received its content and is dropped by the snapshot
+    snapshot(vault_id)
+    assert get_changes(vault_id, 10) is None
+    assert get_changes(vault_id, 12) == []
+
+
+def test_vault_stats():
+    vault_id = str(uuid4())
+    insert_metadata(vault_file=new_file(vault_id, "a.md", size=10))
+    insert_metadata(vault_file=new_file(vault_id, "a.md", size=20))
+    insert_metadata(vault_file=new_file(vault_id, "b.md", size=5))
+    insert_metadata(vault_file=new_file(vault_id, "c.md", size=1))
+    delete_vault_file(vault_id, "c.md")
+
+    stats = get_vault_stats(vault_id)
+    assert stats.total_bytes == 36
+    assert stats.version_count == 4
+    assert stats.live_bytes == 25
+    assert stats.file_count == 2
+    assert stats.tombstone_count == 1
+    assert get_vault_size(vault_id) == 36
+
+    snapshot(vault_id)
+    stats = get_vault_stats(vault_id)
+    with db_session:
+        computed = compute_vault_stats(shards.get(vault_id), vault_id)
+    assert stats.model_dump(exclude={"vault_id"}) == computed
+    assert not reconcile_vault_stats(vault_id)
+
+
+def test_history_pagination():
+    vault_id = str(uuid4())
+    for size in range(5):
+        insert_metadata(
+            vault_file=new_file(vault_id, "a.md", size=size, modified=size + 1)
+        )
+    insert_metadata(vault_file=new_file(str(uuid4()), "a.md"))
+
+    items, more = get_file_history(vault_id, "a.md", limit=2)
+    assert more
+    seen = [item.size for item in items]
+    while more:
+        items, more = get_file_history(
+            vault_id, "a.md", last=items[-1].uid, limit=2
+        )
+        seen.extend(item.size for item in items)
+    assert seen == [4, 3, 2, 1, 0]
+
+
+def test_deleted_pagination():
+    vault_id = str(uuid4())
+    for path in ("a.md", "b.md", "c.md"):
+        insert_metadata(vault_file=new_file(vault_id, path))
+        delete_vault_file(vault_id, path)
+
+    first, more = get_deleted_files(vault_id, limit=2)
+    assert len(first) == 2 and more
+    rest, more = get_deleted_files(vault_id, last=first[-1].uid, limit=2)
+    assert len(rest) == 1 and not more
+    assert {item.path for item in first + rest} == {"a.md", "b.md", "c.md"}
+
+
+def test_overwrite_file():
+    vault_id = str(uuid4())
+    first = insert_metadata(
+        vault_file=new_file(vault_id, "a.md", size=10, modified=1)
+    )
+    uid = insert_metadata(
+        vault_file=new_file(vault_id, "a.md", size=20, modified=2)
+    )
+    seq = get_vault_seq(vault_id)
+
+    row, added = overwrite_file(
+        vault_id, uid, new_file(vault_id, "a.md", size=25, modified=3)
+    )
+    assert row[0] == uid and row[8] == seq + 1
+    assert added == 5
+    items, _ = get_file_history(vault_id, "a.md")
+    assert [item.size for item in items] == [25, 10]
+    stats = get_vault_stats(vault_id)
+    assert stats.total_bytes == 35 and stats.live_bytes == 25
+    assert not reconcile_vault_stats(vault_id)
+
+    # Only the newest live version of the path is overwritten
+    assert overwrite_file(vault_id, first, new_file(vault_id, "a.md")) is None
+    delete_vault_file(vault_id, "a.md")
+    assert overwrite_file(vault_id, uid, new_file(vault_id, "a.md")) is None
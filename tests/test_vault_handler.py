@@ -0,0 +1,43 @@
+from uuid import uuid4
+
+import jwt
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from obsync.db.vault_files_schema import insert_metadata
+from obsync.db.vault_schema import new_vault
+from obsync.handler.vault import VaultHandler
+from obsync.utils.config import secret
+from tests.test_vault_files import new_file
+
+
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(VaultHandler().router, prefix="/vault")
+    return TestClient(app)
+
+
+def token(email: str) -> str:
+    return jwt.encode({"email": email}, secret, algorithm="HS256")
+
+
+def test_vault_stats():
+    email = f"{uuid4()}@example.com"
+    vault = new_vault(
+        name=str(uuid4()),
+        user_email=email,
+        password="password",
+        salt="salt",
+        keyhash="keyhash",
+    )
+    insert_metadata(new_file(vault.id, "a.md", size=0))
+    insert_metadata(new_file(vault.id, "a.md", size=0))
+
+    request = {"token": token(email), "vault_uid": vault.id}
+    res = client().post("/vault/stats", json=request)
+    assert res.status_code == 200
+    assert res.json()["version_count"] == 2
+    assert res.json()["file_count"] == 1
+
+    request["token"] = token("other@example.com")
+    assert client().post("/vault/stats", json=request).status_code == 401
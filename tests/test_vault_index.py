@@ -0,0 +1,128 @@
+import asyncio
+from uuid import uuid4
+
+from obsync.db import aio
+from obsync.db.vault_files_schema import (
+    delete_vault_file,
+    get_manifest_page,
+    get_vault_size,
+    insert_metadata,
+    read_vault_index,
+    restore_file,
+)
+from obsync.db.vault_index import VaultIndex, VaultIndexCache, vault_index
+from tests.test_vault_files import new_file
+
+
+def assert_same_pages(vault_id, index):
+    for since in (None, 0, 3):
+        for after in (0, 3):
+            assert index.manifest_page(since, after, 2) == get_manifest_page(
+                vault_id, since, after, 2
+            )
+    assert index.total_bytes == get_vault_size(vault_id)
+
+
+def test_index_serves_the_same_manifest():
+    vault_id = str(uuid4())
+    uids = [
+        insert_metadata(new_file(vault_id, f"{i}.md", size=i, modified=1))
+        for i in range(4)
+    ]
+    insert_metadata(new_file(vault_id, "0.md", size=10, modified=2))
+    delete_vault_file(vault_id, "1.md")
+    restore_file(vault_id, uids[0])
+
+    assert_same_pages(vault_id, read_vault_index(vault_id))
+
+
+def test_writes_go_through_to_the_index():
+    vault_id = str(uuid4())
+    insert_metadata(new_file(vault_id, "a.md", size=1, modified=1))
+
+    async def run():
+        index = await aio.load_vault_index(vault_id)
+        await aio.insert_metadata(new_file(vault_id, "a.md", size=5))
+        await aio.insert_metadata(new_file(vault_id, "b.md", size=7))
+        await aio.delete_vault_file(vault_id, "b.md")
+        return index
+
+    index = asyncio.run(run())
+    assert vault_index.get(vault_id) is index
+    assert_same_pages(vault_id, index)
+    assert index.seq == 4
+
+    vault_index.drop(vault_id)
+    assert vault_index.get(vault_id) is None
+
+
+def test_maintenance_goes_through_to_the_index():
+    vault_id = str(uuid4())
+    for path in ("a.md", "a.md", "c.md"):
+        insert_metadata(new_file(vault_id, path, modified=1))
+    # Has a size but no content, compaction deletes it
+    insert_metadata(new_file(vault_id, "b.md", size=3, modified=1))
+    delete_vault_file(vault_id, "c.md")
+
+    async def run():
+        vault_index.pin(vault_id)
+        try:
+            index = await aio.load_vault_index(vault_id)
+            assert await aio.snapshot(vault_id) == (4, True)
+            assert await aio.prune_tombstones(vault_id, 2**62, 10) == (1, True)
+            assert vault_index.get(vault_id) is index
+            return index
+        finally:
+            vault_index.unpin(vault_id)
+
+    index = asyncio.run(run())
+    assert sorted(index.files) == ["a.md"]
+    assert index.compacted == index.seq
+    assert_same_pages(vault_id, index)
+    vault_index.drop(vault_id)
+
+
+def row(uid, path, seq, deleted=False):
+    return (uid, path, "hash", 1, 0, 0, False, deleted, seq)
+
+
+def test_older_writes_do_not_replace_newer_ones():
+    index = VaultIndex([row(1, "a.md", 1)], seq=1, compacted=0, total_bytes=1)
+    index.put(row(3, "a.md", 3), added=1)
+    index.put(row(2, "a.md", 2), added=1)
+    assert index.newest_uid("a.md") == 3
+    assert index.total_bytes == 3
+    assert index.seq == 3
+
+
+def test_idle_vaults_are_evicted_first():
+    cache = VaultIndexCache(max_bytes=1000)
+
+    async def loader(vault_id):
+        return VaultIndex(
+            [row(1, vault_id, 1)], seq=1, compacted=0, total_bytes=1
+        )
+
+    async def run():
+        cache.pin("a")
+        await cache.load("a", loader)
+        await cache.load("b", loader)
+        await cache.load("c", loader)
+
+    asyncio.run(run())
+    assert list(cache.indexes) == ["a", "c"]
+    cache.unpin("a")
+    asyncio.run(cache.load("d", loader))
+    assert list(cache.indexes) == ["c", "d"]
+    assert cache.stats()["evicted"] == 2
+
+
+def test_loads_raced_by_a_write_are_discarded():
+    cache = VaultIndexCache(max_bytes=1000)
+
+    async def loader(vault_id):
+        cache.put(vault_id, row(2, "a.md", 2), added=1)
+        return VaultIndex([], seq=1, compacted=0, total_bytes=0)
+
+    assert asyncio.run(cache.load("a", loader)) is None
+    assert cache.get("a") is None
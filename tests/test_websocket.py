@@ -0,0 +1,197 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import jwt
+from pony.orm import db_session
+
+from obsync.db.blob_cache import CachedFile, blob_cache
+from obsync.db.shards import shards
+from obsync.db.vault_files_schema import get_file, get_file_history
+from obsync.db.vault_index import VaultIndex, vault_index
+from obsync.handler import websocket
+from obsync.handler.bus import LocalBus
+from obsync.handler.channel import ChannelManager
+from obsync.handler.protocol import PullRequest, PushRequest
+from obsync.utils.config import secret
+
+
+class FakeWebSocket(object):
+    def __init__(self, pieces) -> None:
+        self.pieces = list(pieces)
+        self.frames = []
+        self.received = 0
+
+    async def send_text(self, data: str) -> None:
+        self.frames.append(json.loads(data))
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.frames.append(data)
+
+    async def receive_bytes(self) -> bytes:
+        piece = self.pieces.pop(0)
+        self.received += len(piece)
+        return piece
+
+
+def push_request(ws, path, content, hash="hash"):
+    ws.pieces = [content[:4], content[4:]]
+    return PushRequest(
+        op="push",
+        path=path,
+        hash=hash,
+        size=len(content),
+        pieces=len(ws.pieces),
+    )
+
+
+def push(handler, vault_id, path, content, hash="hash"):
+    ws = FakeWebSocket([])
+    message = push_request(ws, path, content, hash)
+    assert asyncio.run(handler.on_push(ws, vault_id, message))
+    return ws
+
+
+def stored_bytes(vault_id):
+    shard = shards.get(vault_id)
+    with db_session:
+        return shard.db.select(
+            "COALESCE(SUM(size), 0) FROM blob WHERE digest IN"
+            " (SELECT blob FROM vault_file WHERE vault_id = $vault_id)"
+        )[0]
+
+
+def test_reuploads_reuse_the_stored_blob(monkeypatch):
+    monkeypatch.setattr(websocket, "channel_bus", LocalBus())
+    handler = websocket.WebSocketHandler()
+    vault_id = str(uuid4())
+    content = b"encrypted content"
+
+    first = push(handler, vault_id, "a.md", content)
+    assert first.received == len(content)
+    assert stored_bytes(vault_id) == len(content)
+
+    # Same path, then another path with the same content
+    for path in ("a.md", "copy.md"):
+        again = push(handler, vault_id, path, content)
+        assert again.received == 0
+        assert again.frames == [{"op": "ok"}]
+    assert stored_bytes(vault_id) == len(content)
+
+    uids = [int(p["uid"]) for _, p in websocket.channel_bus.published]
+    files = [get_file(vault_id, uid) for uid in uids]
+    assert len(set(uids)) == 3
+    assert {f.blob for f in files} == {files[0].blob}
+
+    changed = push(handler, vault_id, "a.md", content, hash="other")
+    assert changed.received == len(content)
+
+
+def test_large_pushes_are_spilled_to_disk(monkeypatch):
+    monkeypatch.setattr(websocket, "channel_bus", LocalBus())
+    monkeypatch.setattr(websocket, "PUSH_MEMORY_THRESHOLD", 4)
+    handler = websocket.WebSocketHandler()
+    vault_id = str(uuid4())
+    content = b"encrypted content"
+
+    push(handler, vault_id, "a.md", content)
+    uid = int(websocket.channel_bus.published[-1][1]["uid"])
+    with shards.get(vault_id).blobs.open(get_file(vault_id, uid).blob) as f:
+        assert f.read() == content
+
+
+def test_rapid_pushes_are_coalesced(monkeypatch):
+    monkeypatch.setattr(websocket, "channel_bus", LocalBus())
+    handler = websocket.WebSocketHandler()
+    handler.debouncer.window = 0.2
+    vault_id = str(uuid4())
+    ws = FakeWebSocket([])
+
+    def published(op):
+        return [p for _, p in websocket.channel_bus.published if p["op"] == op]
+
+    async def run():
+        for i in range(3):
+            message = push_request(ws, "a.md", b"version %d" % i, f"v{i}")
+            assert await handler.on_push(ws, vault_id, message)
+        held = len(published("push"))
+        await asyncio.sleep(0.3)
+        message = push_request(ws, "a.md", b"version 3", "v3")
+        assert await handler.on_push(ws, vault_id, message)
+        return held
+
+    assert asyncio.run(run()) == 1
+    # The first broadcast is sent at once, the latest at the end of the
+    # window. The other workers learn about each overwrite right away. The
+    # push after the window adds a version.
+    assert [p["hash"] for p in published("push")][:2] == ["v0", "v2"]
+    assert len(published(websocket.OVERWRITTEN)) == 2
+    items, _ = get_file_history(vault_id, "a.md")
+    assert [item.hash for item in items] == ["v3", "v2"]
+    assert stored_bytes(vault_id) == 2 * len(b"version 0")
+
+
+def test_pushers_get_their_broadcast_before_the_reply(monkeypatch):
+    monkeypatch.setattr(websocket, "channel_bus", LocalBus())
+    handler = websocket.WebSocketHandler()
+    vault_id = str(uuid4())
+    ws = FakeWebSocket([])
+
+    async def run():
+        websocket.channels[vault_id] = ChannelManager()
+        websocket.channels[vault_id].add_client(ws)
+        try:
+            message = push_request(ws, "a.md", b"encrypted content")
+            assert await handler.on_push(ws, vault_id, message)
+            await asyncio.sleep(0.01)
+        finally:
+            websocket.channels.pop(vault_id).remove_client(ws)
+
+    asyncio.run(run())
+    assert [f["op"] for f in ws.frames if "op" in f] == ["push", "ok"]
+
+
+def test_pulls_of_missing_blobs_get_an_error(monkeypatch):
+    monkeypatch.setattr(websocket, "channel_bus", LocalBus())
+    handler = websocket.WebSocketHandler()
+    vault_id = str(uuid4())
+    push(handler, vault_id, "a.md", b"encrypted content")
+    uid = int(websocket.channel_bus.published[-1][1]["uid"])
+    shards.get(vault_id).blobs.delete(get_file(vault_id, uid).blob)
+
+    # Read whole for the blob cache, then streamed
+    for max_file in (blob_cache.max_file, 0):
+        monkeypatch.setattr(blob_cache, "max_file", max_file)
+        blob_cache.discard(vault_id, uid)
+        ws = FakeWebSocket([])
+        message = PullRequest(op="pull", uid=uid)
+        assert not asyncio.run(handler.on_pull(ws, vault_id, message))
+        assert ws.frames[-1] == {"error": "error"}
+
+
+def test_remote_overwrites_drop_cached_content():
+    vault_id = str(uuid4())
+    blob_cache.put(vault_id, 5, CachedFile("hash", 3, b"old"))
+    event = {"op": websocket.OVERWRITTEN, "uid": "5"}
+    asyncio.run(websocket.drop_remote_state(vault_id, event))
+    assert not blob_cache.contains(vault_id, 5)
+
+
+def test_remote_maintenance_goes_through_to_the_index():
+    vault_id = str(uuid4())
+    row = (1, "a.md", "hash", 5, 0, 0, False, True, 1)
+    index = VaultIndex([row], seq=1, compacted=0, total_bytes=5)
+    vault_index.indexes[vault_id] = index
+    event = {"op": websocket.MAINTAINED, "removed": [[1, "a.md"]]}
+    event.update(added=-5, compacted=1)
+    asyncio.run(websocket.drop_remote_state(vault_id, event))
+    assert vault_index.get(vault_id) is index
+    assert (index.files, index.total_bytes, index.compacted) == ({}, 0, 1)
+    vault_index.drop(vault_id)
+
+
+def test_unknown_vaults_are_refused():
+    token = jwt.encode({"email": "a@example.com"}, secret, algorithm="HS256")
+    init = {"token": token, "id": str(uuid4()), "keyhash": "keyhash"}
+    result = asyncio.run(websocket.init_handler(json.dumps(init)))
+    assert result == (None, None)